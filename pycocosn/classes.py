@@ -7,16 +7,18 @@ author: Rob Firth; github.com/RobFirth ; University of Southampton SN Group
 
 from __future__ import print_function  ## Force python3-like printing
 
+import hashlib
 import os
 import re
 import warnings
 from collections import OrderedDict
+from collections.abc import MutableMapping
 
 import astropy.units as u
 import numpy as np
 from astropy.constants import c
 from astropy.coordinates import SkyCoord, Distance
-from astropy.table import Table, vstack, Row, Column
+from astropy.table import Table, vstack, Column
 from astropy.time import Time
 from matplotlib import pyplot as plt
 from matplotlib.ticker import MultipleLocator
@@ -44,12 +46,25 @@ __all__ = ["BaseSpectrumClass",
            "BaseLCModelClass",
            "PhotometryClass",
            "SpectrumClass",
+           "LazySpectrumClass",
+           "ReferenceSpectrumClass",
            "LCfitClass",
            "specfitClass",
            "SNClass",
            "FilterClass",
            "InfoClass",
-           "find_specphase_spec"]
+           "FilterRegistryClass",
+           "FilterBankClass",
+           "SpectrumStackClass",
+           "SpectrumArchiveClass",
+           "PhotometryStoreClass",
+           "PhotometryArraysClass",
+           "PhotometryDataClass",
+           "find_specphase_spec",
+           "get_spectrum_archive_index_path",
+           "get_filter",
+           "clear_filter_registry",
+           "get_reference_spectrum"]
 
 #  #----------------------------------------------------------------------------#  #
 #  #                                   TOOLS                                    #  #
@@ -206,16 +221,26 @@ class BaseSpectrumClass():
              names=("wavelength", "flux"), wavelength_u=u.angstrom,
              flux_u=u.cgs.erg / u.si.cm ** 2 / u.si.s / u.angstrom,
              convert_flux_u=u.cgs.erg / u.si.cm ** 2 / u.si.s / u.angstrom,
-             verbose=False, spectrum_name = False):
+             verbose=False, spectrum_name = False, cache_dir = None):
         """
         Parameters
         ----------
+        cache_dir : directory to keep binary (.npz) copies of the spectrum
+            files in - the first load of a file writes one, and later loads of
+            the same (unchanged) file read it rather than parsing the text (see
+            utils.get_spectrum_cache_path). Defaults to
+            defaults._default_spectrum_cache_dir_path ($PYCOCO_SPEC_CACHE_DIR),
+            which is off unless set. False turns it off.
+
         Returns
         -------
         """
 
         errors.StringWarning(filename)
 
+        if cache_dir is None:
+            cache_dir = defaults._default_spectrum_cache_dir_path
+
         if abspath:
             path = filename
 
@@ -238,16 +263,33 @@ class BaseSpectrumClass():
 
         if os.path.isfile(path):
 
-            ## Some might have three columns, deal with laters - this is untidy
-            try:
-                if hasattr(self, "recon_directory"):
-                    names = names + ("flux_err",)
-                spec_table = Table.read(path, format=fmt, names=names)
+            if hasattr(self, "recon_directory"):
+                names = names + ("flux_err",)
 
-            except:
-                if "flux_err" not in names:
-                    names = names + ("flux_err",)
-                spec_table = Table.read(path, format=fmt, names=names)
+            spec_table = None
+            if cache_dir:
+                cache_path = utils.get_spectrum_cache_path(path, cache_dir, fmt=fmt, names=names)
+                spec_table = utils.read_spectrum_cache(cache_path, verbose=verbose)
+
+            if spec_table is None:
+                if fmt == "ascii":
+                    ## the CoCo layout - two or three columns, so no need to guess
+                    if "flux_err" not in names and utils.sniff_columns(path)[0] == len(names) + 1:
+                        names = names + ("flux_err",)
+                    spec_table = utils.read_columns_table(path, names=names, verbose=verbose)
+
+                else:
+                    ## Some might have three columns, deal with laters - this is untidy
+                    try:
+                        spec_table = Table.read(path, format=fmt, names=names)
+
+                    except:
+                        if "flux_err" not in names:
+                            names = names + ("flux_err",)
+                        spec_table = Table.read(path, format=fmt, names=names)
+
+                if cache_dir:
+                    utils.write_spectrum_cache(cache_path, spec_table, verbose=verbose)
 
             if verbose: print("Reading " + path)
 
@@ -259,22 +301,23 @@ class BaseSpectrumClass():
             else:
                 spec_table.meta["plot_label_string"] = r'$\rm{' + spec_table.meta["filename"].split('/')[-1].replace('_', '\_') + '}$'
 
-            spec_table['wavelength'].unit = wavelength_u
-
+            ## convert with one scale factor per column, rather than through Quantities
             if wavelength_u != u.Angstrom:
-                spec_table['wavelength'] = spec_table['wavelength'].to(u.Angstrom)
-
-            spec_table['flux'].unit = flux_u
-            if "flux_err" in spec_table.colnames:
-                spec_table["flux_err"].unit = flux_u
+                spec_table['wavelength'] = spec_table['wavelength'].data * wavelength_u.to(u.Angstrom)
+            spec_table['wavelength'].unit = u.Angstrom
 
                 #  Automatically convert units?
             if flux_u != convert_flux_u:
-                spec_table["flux"] = spec_table["flux"].to(convert_flux_u)
+                flux_scale = flux_u.to(convert_flux_u)
+                spec_table["flux"] = spec_table["flux"].data * flux_scale
                 if "flux_err" in spec_table.colnames:
-                    spec_table["flux_err"] = spec_table["flux_err"].to(convert_flux_u)
+                    spec_table["flux_err"] = spec_table["flux_err"].data * flux_scale
 
                 flux_u = convert_flux_u
+
+            spec_table['flux'].unit = flux_u
+            if "flux_err" in spec_table.colnames:
+                spec_table["flux_err"].unit = flux_u
             if wmin.unit == spec_table["wavelength"].unit:
                 # enforce wmin and wmax
                 spec_table = spec_table[np.bitwise_and(spec_table['wavelength'].data > wmin.value, spec_table['wavelength'].data < wmax.value)]
@@ -282,9 +325,7 @@ class BaseSpectrumClass():
                 self.max_wavelength = np.nanmax(spec_table["wavelength"])
 
             #  assign to class
-            self.data = spec_table
-            self.wavelength = spec_table["wavelength"]
-            self.flux = spec_table["flux"]
+            self._set_data(spec_table)
 
             #  If you got this far...
             self.success = True
@@ -312,13 +353,86 @@ class BaseSpectrumClass():
         else:
             spec_table.meta["plot_label_string"] = r"$\textnormal{Spectrum from table}$"
 
-        self.min_wavelength = np.nanmin(spec_table["wavelength"])
-        self.max_wavelength = np.nanmax(spec_table["wavelength"])
+        self._set_data(spec_table)
+        self.min_wavelength = np.nanmin(self.wavelength)
+        self.max_wavelength = np.nanmax(self.wavelength)
+        pass
+
+
+    def _set_data(self, spec_table):
+        """
+        Keeps `spec_table` as self.data, and sets self.wavelength and self.flux
+        to plain, contiguous float64 arrays that share memory with its columns -
+        so arithmetic on them runs at numpy speed, without unit handling. The
+        units are kept once, in self.wavelength_unit and self.flux_unit (see
+        get_quantity for Quantity versions).
+        """
+        for name in ("wavelength", "flux"):
+            column = spec_table[name]
+            values = np.ascontiguousarray(column.data, dtype = np.float64)
+            if not np.shares_memory(values, column.data):
+                ## not float64 already - swap in the converted copy, so they still share
+                spec_table.replace_column(name, Column(values, name = name, unit = column.unit, copy = False))
+                values = spec_table[name].data
+
+            setattr(self, name, values)
+            setattr(self, name + "_unit", column.unit)
+
         self.data = spec_table
-        self.wavelength = spec_table["wavelength"]
-        self.flux = spec_table["flux"]
         pass
 
+
+    def get_quantity(self, name = "flux"):
+        """
+        Returns self.flux (or self.wavelength, with name = "wavelength") as an
+        astropy Quantity in its unit, without copying it.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        return u.Quantity(getattr(self, name), getattr(self, name + "_unit"), copy = False)
+
+
+    def load_arrays(self, wavelength, flux, path = False, spectrum_name = False,
+                    wavelength_u = u.angstrom, flux_u = u.cgs.erg / u.si.cm ** 2 / u.si.s / u.angstrom,
+                    verbose = False):
+        """
+        Wraps `wavelength` and `flux` arrays (which should already be trimmed,
+        and in Angstrom and erg/s/cm^2/A) without copying them - so views of a
+        memory-mapped SpectrumArchiveClass stay views.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        spec_table = Table([wavelength, flux], names = ("wavelength", "flux"), copy = False)
+        spec_table["wavelength"].unit = wavelength_u
+        spec_table["flux"].unit = flux_u
+
+        if path:
+            spec_table.meta["filepath"] = path
+            spec_table.meta["filename"] = path.split("/")[-1]
+        if spectrum_name:
+            spec_table.meta["plot_label_string"] = r"$\textnormal{" + spectrum_name.replace("_", "\_") + "}$"
+        elif path:
+            spec_table.meta["plot_label_string"] = r'$\rm{' + spec_table.meta["filename"].replace('_', '\_') + '}$'
+        else:
+            spec_table.meta["plot_label_string"] = r"$\textnormal{Spectrum from arrays}$"
+
+        if verbose: print("Wrapping", len(spec_table), "points")
+
+        self._set_data(spec_table)
+        self.min_wavelength = np.nanmin(self.wavelength)
+        self.max_wavelength = np.nanmax(self.wavelength)
+        self.success = True
+        pass
+
+
     def plot(self, xminorticks = 250, legend = True, plot_filters=True,
              verbose = False, compare_red = True,
              return_figure=False,
@@ -461,7 +575,7 @@ class BaseSpectrumClass():
 
         if hasattr(self, "data"):
             self.flux_red = self.flux
-            self.flux = self.data['flux_dered']
+            self.flux = np.ascontiguousarray(self.data['flux_dered'], dtype = np.float64)
         else:
             warnings.warn("Doesn't seem to be any data here (empty self.data)")
         pass
@@ -480,17 +594,26 @@ class BaseSpectrumClass():
         save_table['wavelength'] = self.wavelength
         save_table['flux'] = self.flux
 
-        save_table['wavelength'].format = "5.5f"
-        save_table['flux'].format = "5.5e"
+        save_table['wavelength'].format = _spec_save_formats["wavelength"]
+        save_table['flux'].format = _spec_save_formats["flux"]
 
         return save_table
 
 
+    def _spec_columns_for_save(self):
+        """
+        The columns written by save - as _spec_format_for_save, without
+        building the Table.
+        """
+        return OrderedDict([("wavelength", self.wavelength), ("flux", self.flux)])
+
+
     def save(self, filename, path = False,
              squash = False, verbose = False, *args, **kwargs):
         """
         Output the spectrum loaded into the Class via self.load into a format
-        and location recognised by CoCo.
+        and location recognised by CoCo - written by utils.write_columns, with
+        the same bytes as astropy's ascii.fast_commented_header writer.
 
         Parameters
         ----------
@@ -513,13 +636,13 @@ class BaseSpectrumClass():
             if os.path.isfile(outpath):
                 if squash:
                     print("Overwriting " + outpath)
-                    self._spec_format_for_save().write(outpath, format = "ascii.fast_commented_header", overwrite=True)
+                    utils.write_columns(outpath, self._spec_columns_for_save(), formats = _spec_save_formats, overwrite = True)
                 else:
                     warnings.warn("Found existing file matching " + os.path.join(path,
                                                                                  filename) + ". Run with squash = True to overwrite")
             else:
                     print("Writing " + outpath)
-                    self._spec_format_for_save().write(outpath, format = "ascii.fast_commented_header")
+                    utils.write_columns(outpath, self._spec_columns_for_save(), formats = _spec_save_formats)
 
         else:
             warnings.warn("Doesn't seem to be any data here (empty self.data)")
@@ -527,15 +650,18 @@ class BaseSpectrumClass():
 
 
     def _add_to_overlapping_filters(self, filter_name, verbose=True):
+        """
+        Adds a filter name, or an array of them, to self._overlapping_filter_list.
+        """
+        filter_name = np.atleast_1d(filter_name)
         if hasattr(self, "_overlapping_filter_list"):
-            if filter_name not in self._overlapping_filter_list:
-                self._overlapping_filter_list = np.append(self._overlapping_filter_list, filter_name)
-                self._n_overlapping_filters = self._n_overlapping_filters + 1
-            else:
-                if verbose: print("filter name already in overlap list")
+            current = np.atleast_1d(self._overlapping_filter_list)
+            new = np.isin(filter_name, current, invert=True)
+            if verbose and not new.all(): print("filter name already in overlap list")
+            self._overlapping_filter_list = np.append(current, filter_name[new])
         else:
-            self._overlapping_filter_list = np.array(filter_name)
-            self._n_overlapping_filters = 1
+            self._overlapping_filter_list = filter_name
+        self._n_overlapping_filters = len(self._overlapping_filter_list)
         pass
 
 
@@ -544,15 +670,61 @@ class BaseSpectrumClass():
         pass
 
 
-    def get_specphot(self, filter_objects, correct_for_area=True, verbose = False):
+    def get_quadrature_weights(self, method = "simpson"):
+        """
+        Returns the weights w for which np.dot(w, y) is the integral of y over
+        self.wavelength - Simpson's rule as scipy.integrate.simps, or the
+        trapezium rule with method = "trapz" (see utils.calc_quadrature_weights).
+
+        They only depend on the wavelength grid, so are worked out the first
+        time they are needed and kept (read-only) until self.wavelength is
+        replaced. Because get_support_slice pairs up the intervals in the same
+        way as the whole grid, w[support] works for integrals over a slice of a
+        filter's support too.
+
+        Parameters
+        ----------
+        method : "simpson" or "trapz".
+
+        Returns
+        -------
+        weights : array, the same length as self.wavelength.
+        """
+        if not hasattr(self, "_quadrature_weights") or self._quadrature_weights[0] is not self.wavelength:
+            self._quadrature_weights = (self.wavelength, {})
+
+        weights = self._quadrature_weights[1]
+        if method not in weights:
+            weights[method] = utils.calc_quadrature_weights(self.wavelength, method = method)
+            weights[method].setflags(write = False)
+
+        return weights[method]
+
+
+    def get_specphot(self, filter_objects, correct_for_area=True, exact=False, verbose = False):
         """
         TODO - Some duplication between this and SNClass.get_specphot()
+
+        filter_objects can also be a FilterBankClass, in which case all of the
+        filters in the bank are done in one go.
+
+        With exact=True the product of the linearly interpolated spectrum and
+        filter is integrated exactly (BaseFilterClass.get_exact_weights) instead
+        of resampling the filter and using Simpson's rule.
         :param spectrum:
         :param verbose:
         :return:
         """
         if verbose: print("passed filter objects = ", type(filter_objects), filter_objects)
 
+        if isinstance(filter_objects, FilterBankClass):
+            if not hasattr(self, "_overlapping_filter_list"):
+                self.check_overlaps(filter_objects=filter_objects.filters, verbose=verbose)
+
+            flux = filter_objects.get_specphot(self, correct_for_area=correct_for_area, exact=exact, verbose=verbose)
+            self._set_specphot(filter_objects, flux)
+            return
+
         if not hasattr(self, "_overlapping_filter_list"):
             self.check_overlaps(filter_objects=filter_objects, verbose=verbose)
 
@@ -588,6 +760,10 @@ class BaseSpectrumClass():
 
         if verbose: print(type(iterator), iterator)
 
+        lambda_effective = []
+        specphot_flux = []
+        specphot_filters = []
+
         for j, filter_name in enumerate(iterator):
             if verbose: print("getting specphot for ", j, filter_name)
 
@@ -605,32 +781,59 @@ class BaseSpectrumClass():
             # flux = kcorr.calc_spectrum_filter_flux(filter_object=filter_obj,
             #                                        spectrum_object=self)
 
-            if not np.array_equal(filter_obj.wavelength, self.wavelength):
-                    filter_obj.resample_response(new_wavelength=self.wavelength)
+            if exact:
+                weights = filter_obj.get_exact_weights(self.wavelength)
+                integrated_flux = np.dot(weights, np.asarray(getattr(self.flux, "value", self.flux)))
+            else:
+                ## only integrate where the filter is non-zero
+                support = filter_obj.get_support_slice(self.wavelength)
+                throughput = filter_obj.get_resampled_throughput(self.wavelength[support])
 
-            transmitted_spec = filter_obj.throughput * self.flux
-            integrated_flux = simps(transmitted_spec, self.wavelength)
+                transmitted_spec = throughput * self.flux[support]
+                integrated_flux = np.dot(self.get_quadrature_weights()[support], transmitted_spec)
 
             if correct_for_area:
 
-                if not hasattr(filter_obj, "_effective_area"):
-                    filter_obj.calculate_filter_area()
+                if exact:
+                    filter_area = np.sum(weights)
+                else:
+                    if not hasattr(filter_obj, "_effective_area"):
+                        filter_obj.calculate_filter_area()
 
-                filter_area = filter_obj._effective_area
+                    filter_area = filter_obj._effective_area
                 flux = integrated_flux / filter_area
 
             else:
                 flux = integrated_flux
 
             if verbose: print("flux in filter", filter_name, " is ", flux)
-            if j == 0:
-                self.specphot = Table(names=("lambda_effective", "flux", "filter"), dtype=('f4', 'f4', 'S'))
 
-            self.specphot.add_row((filter_obj.lambda_effective, flux, filter_name))
+            lambda_effective.append(filter_obj.lambda_effective.value)
+            specphot_flux.append(getattr(flux, "value", flux))
+            specphot_filters.append(filter_obj.filter_name if isinstance(filter_name, FilterClass) else filter_name)
 
             # else:
             #     warnings.warn("no overlapping filters - filter_name not in filter_objects")
 
+        ## built in one go, rather than a row at a time
+        if len(specphot_filters) > 0:
+            self.specphot = Table([lambda_effective, specphot_flux, specphot_filters],
+                                  names=("lambda_effective", "flux", "filter"), dtype=('f4', 'f4', 'S'))
+        pass
+
+
+    def _set_specphot(self, filter_bank, flux, mask = None):
+        """
+        Fills self.specphot from an array of fluxes through the filters of
+        `filter_bank`, leaving out those where `mask` is True.
+        """
+        if mask is None:
+            mask = np.zeros(len(filter_bank), dtype=bool)
+        keep = np.where(~mask)[0]
+
+        lambda_effective = [filter_bank.filters[filter_bank.filter_names[j]].lambda_effective.value for j in keep]
+        self.specphot = Table([lambda_effective, np.asarray(flux)[keep], [filter_bank.filter_names[j] for j in keep]],
+                              names=("lambda_effective", "flux", "filter"), dtype=('f4', 'f4', 'S'))
         pass
 
 
@@ -647,38 +850,303 @@ class BaseSpectrumClass():
         Returns
         -------
         """
-        if isinstance(FilterClass, type(filter_objects)):
+        if isinstance(filter_objects, BaseFilterClass):
             ## if only one filter is given
             filter_objects = [filter_objects, ]
 
+        if isinstance(filter_objects, dict):
+            filter_names = list(filter_objects.keys())
+            filter_objects = list(filter_objects.values())
+        else:
+            filter_names = [filter_obj.filter_name for filter_obj in filter_objects]
 
-        for i, filter_name in enumerate(filter_objects):
-            if isinstance(FilterClass, type(filter_name)):
-                filter_obj = filter_name
-            elif isinstance(filter_objects, dict):
-                filter_obj = filter_objects[filter_name]
-            else:
-                filter_obj = filter_objects[i]
-
-            if verbose:print(i, filter_obj)
-
-            if hasattr(filter_obj, "_lower_edge") and \
-              hasattr(filter_obj, "_upper_edge") and \
-              hasattr(self, "data"):
-               blue_bool = filter_obj._lower_edge > self.min_wavelength
-               red_bool = filter_obj._upper_edge < self.max_wavelength
-
-               if blue_bool and red_bool:
-                    within = True
-               else:
-                    within = False
-               if verbose: print(within)
-               if within:
-                   self._add_to_overlapping_filters(filter_name, verbose=verbose)
-            else:
-                warnings.warn("SpectrumClass.check_overlaps - something went wrong... no overlaps or data?")
-        if self._n_overlapping_filters == 1:
-            self._overlapping_filter_list = [self._overlapping_filter_list,] ## added to fix issue #27
+        has_edges = np.array([hasattr(filter_obj, "_lower_edge") and hasattr(filter_obj, "_upper_edge")
+                              for filter_obj in filter_objects], dtype=bool)
+
+        if not hasattr(self, "data") or not has_edges.any():
+            warnings.warn("SpectrumClass.check_overlaps - something went wrong... no overlaps or data?")
+            return
+        elif not has_edges.all():
+            warnings.warn("SpectrumClass.check_overlaps - some filters have no edges")
+
+        filter_edges = [[filter_obj._lower_edge, filter_obj._upper_edge]
+                        for filter_obj, edges in zip(filter_objects, has_edges) if edges]
+        overlaps = utils.calc_overlap_matrix([self.min_wavelength, self.max_wavelength], filter_edges)[0]
+
+        if verbose: print(overlaps)
+        self._add_to_overlapping_filters(np.array(filter_names)[has_edges][overlaps], verbose=verbose)
+        pass
+
+
+## formats of the columns of a spectrum file, as written by BaseSpectrumClass.save
+_spec_save_formats = {"wavelength": "5.5f", "flux": "5.5e"}
+
+
+class PhotometryArraysClass():
+    """
+    Photometry held as plain arrays rather than astropy Tables - float64 MJD,
+    flux and flux_err, and a small integer code per point indexing
+    filter_names - sorted by (filter, MJD), so that each filter's photometry
+    is a contiguous slice. Any other columns ride along, sorted the same way.
+
+    astropy Tables (and Time) are only built when asked for, and share memory
+    with the arrays - the filter column of a single filter's table is the one
+    string, broadcast over its rows.
+    """
+
+    def __init__(self, phot_table = None, verbose = False):
+        if phot_table is not None:
+            self.load_table(phot_table, verbose = verbose)
+
+
+    def __len__(self):
+        if hasattr(self, "mjd"):
+            return len(self.mjd)
+        return 0
+
+
+    def load_arrays(self, mjd, flux, flux_err, filters, columns = False, units = False, verbose = False):
+        """
+        Loads the photometry from arrays, one value per point.
+
+        Parameters
+        ----------
+        mjd, flux, flux_err : array-likes of floats.
+
+        filters : array-like of the filter names - bytes are decoded.
+
+        columns : OrderedDict of any other columns, by name.
+
+        units : dict of the units of the columns, by name.
+
+        Returns
+        -------
+        """
+        filters = np.asarray(filters)
+        if filters.dtype.kind == "S":
+            filters = np.char.decode(filters)
+
+        filter_names, filter_code = np.unique(filters, return_inverse = True)
+        filter_code = filter_code.astype(np.min_scalar_type(max(len(filter_names) - 1, 0)))
+        mjd = np.asarray(mjd, dtype = np.float64)
+
+        ## stable, so points at the same MJD stay in the order they were in
+        order = np.lexsort((mjd, filter_code))
+
+        self.mjd = mjd[order]
+        self.flux = np.asarray(flux, dtype = np.float64)[order]
+        self.flux_err = np.asarray(flux_err, dtype = np.float64)[order]
+        self.filter_code = filter_code[order]
+        self.filter_names = filter_names
+        self.filter_starts = np.searchsorted(self.filter_code, np.arange(len(filter_names) + 1))
+
+        self.columns = OrderedDict()
+        if columns:
+            for name in columns:
+                self.columns[name] = columns[name][order]
+        self.colnames = list(_phot_arrays_columns) + list(self.columns.keys())
+        self.units = dict(units) if units else dict()
+
+        if verbose: print(len(self), "points in", len(self.filter_names), "filters")
+        pass
+
+
+    def load_table(self, phot_table, verbose = False):
+        """
+        Loads the photometry from a table with MJD, flux, flux_err and filter
+        columns (MJD can be a Time) - keeping the order of its columns.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        mjd = phot_table["MJD"]
+        units = dict()
+        if isinstance(mjd, Time):
+            mjd = mjd.mjd
+            units["MJD"] = u.day
+        for name in _phot_arrays_columns[:3]:
+            if getattr(phot_table[name], "unit", None) is not None:
+                units[name] = phot_table[name].unit
+
+        columns = OrderedDict((name, phot_table[name]) for name in phot_table.colnames
+                              if name not in _phot_arrays_columns)
+
+        self.load_arrays(mjd, phot_table["flux"], phot_table["flux_err"], phot_table["filter"],
+                         columns = columns, units = units, verbose = verbose)
+        self.colnames = list(phot_table.colnames)
+        pass
+
+
+    def get_bounds(self, filter_name):
+        """
+        (start, stop) of the points in `filter_name` - (0, 0) if there are none.
+        """
+        i = np.searchsorted(self.filter_names, filter_name)
+        if i < len(self.filter_names) and self.filter_names[i] == filter_name:
+            return int(self.filter_starts[i]), int(self.filter_starts[i + 1])
+        return 0, 0
+
+
+    def _get_rows(self, filters = False):
+        """
+        The points in `filters` (a filter name or a list of them, in that
+        order) - a slice for all of them or for one filter, else an array.
+        """
+        if not filters:
+            return slice(0, len(self))
+        if isinstance(filters, str):
+            filters = [filters]
+        if len(filters) == 1:
+            return slice(*self.get_bounds(filters[0]))
+        return np.concatenate([np.arange(*self.get_bounds(filter_name)) for filter_name in filters])
+
+
+    def get_table(self, filters = False, verbose = False):
+        """
+        Table of the points in `filters` (a filter name or a list of them, in
+        that order) - all of them, by filter, if not given. For all the points
+        or a single filter, the MJD, flux and flux_err columns are views of the
+        arrays.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        if isinstance(filters, str):
+            filters = [filters]
+        rows = self._get_rows(filters)
+
+        if filters and len(filters) == 1:
+            filter_column = np.broadcast_to(np.asarray(filters[0]), (rows.stop - rows.start,))
+        else:
+            filter_column = self.filter_names[self.filter_code[rows]]
+
+        arrays = {"MJD": self.mjd[rows], "flux": self.flux[rows], "flux_err": self.flux_err[rows],
+                  "filter": filter_column}
+        phot_table = Table([arrays[name] if name in arrays else self.columns[name][rows] for name in self.colnames],
+                           names = self.colnames, copy = False)
+        for name in self.units:
+            phot_table[name].unit = self.units[name]
+
+        if verbose: print(phot_table)
+        return phot_table
+
+
+    def get_time(self, filters = False):
+        """
+        astropy Time of the MJDs of the points in `filters` (see get_table).
+        """
+        return Time(self.mjd[self._get_rows(filters)], format = "mjd")
+
+
+    def get_nbytes(self):
+        """
+        Memory taken up by the arrays, in bytes.
+        """
+        nbytes = sum(array.nbytes for array in (self.mjd, self.flux, self.flux_err, self.filter_code,
+                                                 self.filter_names, self.filter_starts))
+        return nbytes + sum(getattr(column, "nbytes", 0) for column in self.columns.values())
+
+
+## the columns held as arrays in a PhotometryArraysClass
+_phot_arrays_columns = ("MJD", "flux", "flux_err", "filter")
+
+
+class PhotometryDataClass(MutableMapping):
+    """
+    OrderedDict-like mapping of filter name to photometry table, used for
+    BaseLightCurveClass.data. The tables of the filters in a
+    PhotometryArraysClass (see set_arrays) are views of it, only built the
+    first time they are looked up - so a light curve that is loaded but
+    never looked at per filter holds no Tables at all. Anything else put in
+    (like 'full') is kept as it is.
+    """
+
+    def __init__(self, data = False, verbose = False):
+        self._tables = OrderedDict()
+        self._views = dict()
+        if data:
+            for key in data:
+                self._tables[key] = data[key]
+
+
+    def __getitem__(self, key):
+        table = self._tables[key]
+        if table is None:
+            table = self.arrays.get_table(key)
+            self._tables[key] = table
+            self._views[key] = table
+        return table
+
+
+    def __setitem__(self, key, value):
+        self._tables[key] = value
+
+
+    def __delitem__(self, key):
+        del self._tables[key]
+
+
+    def __iter__(self):
+        return iter(self._tables)
+
+
+    def __len__(self):
+        return len(self._tables)
+
+
+    def __repr__(self):
+        return "PhotometryDataClass(" + repr(list(self._tables.keys())) + ")"
+
+
+    def set_arrays(self, arrays, verbose = False):
+        """
+        Points the filters in `arrays` (a PhotometryArraysClass) at it -
+        replacing any tables already there for them. Tables of other filters
+        are kept, built from the old arrays if they hadn't been already.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        if hasattr(self, "arrays"):
+            for key in self._tables:
+                if self._tables[key] is None and key not in arrays.filter_names:
+                    self[key]
+
+        self.arrays = arrays
+        self._views = dict()
+        for filter_name in arrays.filter_names:
+            self._tables[str(filter_name)] = None
+
+        if verbose: print(self)
+        pass
+
+
+    def is_view(self, key):
+        """
+        True if the table for `key` is still the (built or not) view of
+        self.arrays - not replaced, and with no columns added.
+        """
+        if not hasattr(self, "arrays") or key not in self._tables:
+            return False
+        table = self._tables[key]
+        return table is None or (table is self._views.get(key) and table.colnames == self.arrays.colnames)
+
+
+    def reorder(self, keys):
+        """
+        Puts the tables in the order of `keys`, dropping any not in it,
+        without building any that haven't been.
+        """
+        self._tables = OrderedDict((key, self._tables[key]) for key in keys)
         pass
 
 
@@ -763,10 +1231,15 @@ class BaseLightCurveClass():
 
                 if verbose: print(newkey)
 
-                sorted_data[newkey] = self.data[newkey]
                 sorted_data_filters[newkey] = self.data_filters[newkey]
 
-            self.data = sorted_data
+            if isinstance(self.data, PhotometryDataClass):
+                ## without building the tables
+                self.data.reorder(newkeys)
+            else:
+                for newkey in newkeys:
+                    sorted_data[newkey] = self.data[newkey]
+                self.data = sorted_data
             self.data_filters = sorted_data_filters
 
         else:
@@ -779,6 +1252,11 @@ class BaseLightCurveClass():
         If loading from preformatted file, then unpack the table into self.data
         OrderedDict and load FilterClass objects into self.data_filters OrderedDict
 
+        self.phot is loaded into a PhotometryArraysClass, self.arrays, and each
+        filter's photometry in self.data (a PhotometryDataClass) is a table
+        view of it - built when it is first looked up, and sharing its memory.
+        The filters come from the filter registry (see get_filter).
+
         Parameters
         ----------
 
@@ -788,54 +1266,39 @@ class BaseLightCurveClass():
         """
 
         if hasattr(self, "phot"):
-            filter_names = np.unique(self.phot["filter"])
-
-            self.phot.add_index('filter', unique = True)
+            self.arrays = PhotometryArraysClass(self.phot)
+            self._unpack_arrays(filter_file_type=filter_file_type, verbose=verbose)
 
+        else:
+            warnings.warn("Doesn't seem to be any data here (empty self.data)")
 
-            for filter_name in filter_names:
-
-                phot_table = self.phot.loc["filter", filter_name]
-                filter_filename = filter_name + filter_file_type
-                if verbose: print(filter_filename)
-                if verbose: print(phot_table)
-                if verbose: print(type(filter_name), type(filter_file_type))
-
-                # phot_table.meta = {"filter_filename": filter_filename}
-                phot_table.meta["filter_filename"] = filter_filename
-                if not isinstance(phot_table, Row):
-                # if len(np.unique(self.phot.loc["filter", filter_name]["MJD"])) > 1:
-                    indices = phot_table.argsort("MJD")
-                    # for column_name in phot_table.colnames:
-                    #     phot_table[column_name] = phot_table[column_name][indices]
-                    sorted_phot_table = Table([phot_table[column_name][indices] for column_name in phot_table.colnames])
-                else:
-                    sorted_phot_table = phot_table
-
-                filter_key = np.unique(phot_table["filter"])[0]
+        pass
 
-                if len(np.unique(phot_table["filter"])) > 1 or filter_key != filter_name:
-                    raise errors.FilterMismatchError("There is a more than one filterdata in here! or there is a mismatch with filename")
-                path_to_filter = os.path.join(self.filter_directory, phot_table.meta['filter_filename'])
 
-                # def load_filter(path, cmap = False, verbose = False):
-                #
-                if utils.check_file_path(os.path.abspath(path_to_filter)):
-                    filter_object = FilterClass()
-                    filter_object.read_filter_file(os.path.abspath(path_to_filter), verbose = verbose)
-                    filter_object.calculate_AB_zp()
-                else:
-                    warnings.warn("Couldn't load the filter")
+    def _unpack_arrays(self, filter_file_type=".dat", verbose=False):
+        """
+        Points self.data (made a PhotometryDataClass if it isn't one) at
+        self.arrays, and loads the FilterClass of each of its filters into
+        self.data_filters.
+        """
+        if not isinstance(getattr(self, "data", False), PhotometryDataClass):
+            self.data = PhotometryDataClass(getattr(self, "data", False))
+        self.data.set_arrays(self.arrays, verbose=verbose)
 
-                self.data_filters[filter_key] = filter_object
+        for filter_name in self.arrays.filter_names:
+            filter_name = str(filter_name)
 
-                self.data[filter_name] = sorted_phot_table
+            filter_filename = filter_name + filter_file_type
+            if verbose: print(filter_filename)
 
-            self.filter_names = filter_names
+            path_to_filter = os.path.join(self.filter_directory, filter_filename)
 
-        else:
-            warnings.warn("Doesn't seem to be any data here (empty self.data)")
+            if utils.check_file_path(os.path.abspath(path_to_filter)):
+                self.data_filters[filter_name] = get_filter(path_to_filter, verbose=verbose)
+            else:
+                warnings.warn("Couldn't load the filter")
 
+        self.filter_names = self.arrays.filter_names
         pass
 
 
@@ -867,29 +1330,58 @@ class BaseLightCurveClass():
         pass
 
 
-    def _combine_phot(self, verbose = True):
-        """
-
+    def get_full_phot(self, verbose = False):
         """
+        All of the photometry in self.data stacked into one table, in filter
+        order - built from self.data.arrays (or with a single vstack, if the tables
+        in self.data aren't its views) the first time it is asked for, and
+        kept until the tables in self.data are replaced or change length. The
+        tables themselves are kept with it, rather than their ids, so that a
+        new table can't be mistaken for an old one.
 
-        if hasattr(self, "data"):
-            if verbose: print(self.data.keys())
-
-            for i, phot_filter in enumerate(self.data.keys()):
+        Parameters
+        ----------
 
-                if verbose: print(i, phot_filter)
+        Returns
+        -------
+        """
+        if not hasattr(self, "data"):
+            warnings.warn("Cant find self.data")
+            return None
 
-                if i == 0:
+        phot_filters = [phot_filter for phot_filter in self.data.keys() if phot_filter != "full"]
+        if verbose: print(phot_filters)
 
-                    full_phot = self.data[phot_filter]
+        ## if they are all still the views, take it straight from the arrays
+        from_arrays = isinstance(self.data, PhotometryDataClass) and all(self.data.is_view(phot_filter)
+                                                                        for phot_filter in phot_filters)
+        if from_arrays:
+            sources = [self.data.arrays]
+        else:
+            sources = [self.data[phot_filter] for phot_filter in phot_filters]
+        lengths = [len(source) for source in sources]
+
+        cached = getattr(self, "_full_phot", None)
+        if cached is None or cached[0] != (phot_filters, lengths) or len(cached[1]) != len(sources) or \
+                any(source is not cached_source for source, cached_source in zip(sources, cached[1])):
+            if len(phot_filters) == 1:
+                full_phot = self.data[phot_filters[0]]
+            elif from_arrays:
+                full_phot = self.data.arrays.get_table(phot_filters)
+            else:
+                full_phot = vstack([self.data[phot_filter] for phot_filter in phot_filters])
+            self._full_phot = ((phot_filters, lengths), sources, full_phot)
 
-                else:
+        return self._full_phot[2]
 
-                    full_phot = vstack([full_phot, self.data[phot_filter]])
 
-                    pass
+    def _combine_phot(self, verbose = True):
+        """
+        Puts all of the photometry into self.data['full'] (see get_full_phot).
+        """
 
-            self.data['full'] = full_phot
+        if hasattr(self, "data"):
+            self.data['full'] = self.get_full_phot(verbose = verbose)
 
         else:
             warnings.warn("Cant find self.data")
@@ -958,7 +1450,8 @@ class BaseLightCurveClass():
              squash = False, verbose = True, sort = False, *args, **kwargs):
         """
         Output the photometry loaded into the SNClass via self.load_phot* into a format
-        and location recognised by CoCo.
+        and location recognised by CoCo - written by utils.write_table, with the
+        same bytes as astropy's ascii.fast_commented_header writer.
 
         Parameters
         ----------
@@ -988,14 +1481,14 @@ class BaseLightCurveClass():
             if os.path.isfile(outpath):
                 if squash:
                     print("Overwriting " + outpath)
-                    self._phot_format_for_save(filters = filters, names = names, formats = formats,
-                                               verbose = verbose, sort=sort).write(outpath, format = "ascii.fast_commented_header", overwrite = True, names=names)
+                    utils.write_table(outpath, self._phot_format_for_save(filters = filters, names = names, formats = formats,
+                                                                          verbose = verbose, sort=sort), names=names, overwrite = True)
                 else:
                     warnings.warn("Found existing file matching " + outpath + ". Run with squash = True to overwrite")
 
             else:
                     print("Writing " + outpath)
-                    self._phot_format_for_save(filters = filters).write(outpath, format = "ascii.fast_commented_header", names=names)
+                    utils.write_table(outpath, self._phot_format_for_save(filters = filters), names=names)
 
         else:
             warnings.warn("Doesn't seem to be any data here (empty self.data)")
@@ -1007,11 +1500,27 @@ class BaseLightCurveClass():
         pass
 
 
-    def nightaverage(self, filters=False, verbose=False):
+    def nightaverage(self, filters=False, bin_width=1., verbose=False):
         """
+        Replaces the photometry with its weighted mean in each filter over
+        each night - or each bin of bin_width days, centred on multiples of
+        bin_width, so 0.5 or 2. for survey cadences. The MJD is the mean MJD of
+        the bin, and the error that of the weighted mean.
 
-        :param verbose:
-        :return:
+        All of the points are sorted by (filter, bin) once, and the sums for
+        every bin taken together with np.add.reduceat. The averages go into
+        a new self.arrays (see unpack), with self.data views of it, along
+        with the points of any filters that aren't averaged.
+
+        Parameters
+        ----------
+        filters : filter name, or list of them, to average - all of them if
+            not given.
+
+        bin_width : width of the bins, in days.
+
+        Returns
+        -------
         """
         if hasattr(self, "phot") and hasattr(self, "data"):
 
@@ -1019,35 +1528,63 @@ class BaseLightCurveClass():
                 filters = self.data_filters
             if type(filters) == str:
                 filters = [filters]
+            filter_keys = list(filters)
+
+            tables = [self.data[filter_key] for filter_key in filter_keys]
+            mjd = np.concatenate([np.asarray(getattr(dt["MJD"], "mjd", dt["MJD"]), dtype = float) for dt in tables])
+            flux = np.concatenate([np.asarray(dt["flux"], dtype = float) for dt in tables])
+            flux_err = np.concatenate([np.asarray(dt["flux_err"], dtype = float) for dt in tables])
+            filter_index = np.repeat(np.arange(len(tables)), [len(dt) for dt in tables])
+
+            night = np.round(mjd / bin_width)
+
+            ## stable, so points stay in their original order within each bin
+            order = np.lexsort((night, filter_index))
+            mjd, flux, flux_err = mjd[order], flux[order], flux_err[order]
+            night, filter_index = night[order], filter_index[order]
+
+            new_bin = np.ones(len(order), dtype = bool)
+            new_bin[1:] = (np.diff(night) != 0) | (np.diff(filter_index) != 0)
+            starts = np.flatnonzero(new_bin)
+            counts = np.diff(np.append(starts, len(order)))
+            if verbose: print(len(order), "points in", len(starts), "bins")
+
+            weights = 1.0 / (flux_err * flux_err)
+            weight_sum = np.add.reduceat(weights, starts)
+            wmean = np.add.reduceat(flux * weights, starts) / weight_sum
+            wmean_err = np.sqrt(1. / weight_sum)
+            mean_mjd = np.add.reduceat(mjd, starts) / counts
+
+            units = dict((col, getattr(tables[0][col], "unit", None)) for col in ("MJD", "flux", "flux_err"))
+            if isinstance(tables[0]["MJD"], Time):
+                units["MJD"] = u.day
+
+            ## the filters that aren't averaged keep their points as they are
+            other_keys = [filter_key for filter_key in self.data_filters if filter_key not in filter_keys]
+            other_tables = [self.data[filter_key] for filter_key in other_keys]
+            mean_filters = np.asarray(filter_keys)[filter_index[starts]]
+            if len(other_tables) > 0:
+                mean_mjd = np.concatenate([mean_mjd] + [np.asarray(getattr(dt["MJD"], "mjd", dt["MJD"]), dtype = float)
+                                                        for dt in other_tables])
+                wmean = np.concatenate([wmean] + [np.asarray(dt["flux"], dtype = float) for dt in other_tables])
+                wmean_err = np.concatenate([wmean_err] + [np.asarray(dt["flux_err"], dtype = float)
+                                                          for dt in other_tables])
+                mean_filters = np.concatenate([mean_filters, np.repeat(np.asarray(other_keys),
+                                                                       [len(dt) for dt in other_tables])])
 
-            for i, filter_key in enumerate(filters):
+            if verbose: print("loading into phot object...")
 
-                if verbose: print(i, self.data[filter_key].__dict__)
-
-                dt = self.data[filter_key]
-
-                dt["Night"] = list(map(lambda x: np.round(x), dt["MJD"]))
-
-                dt.add_index("Night")
-                dt_grouped = dt.group_by("Night")
-                dt_grouped["weights"] = 1.0 / ((dt_grouped["flux_err"]) * (dt_grouped["flux_err"]))
-
-                if i == 0:
-                    na_table = Table(names=("MJD", "flux", "flux_err", "filter"),
-                                     dtype=(dt["MJD"].dtype, dt["flux"].dtype, dt["flux_err"].dtype, dt["filter"].dtype))
-                    for j, col in enumerate(na_table.columns):
-                        if verbose: print(j, col)
-                        na_table[col].unit = dt[col].unit
-                for group in dt_grouped.groups:
-                    wmean = np.average(group["flux"], weights=group["weights"])
-                    wmean_err = np.sqrt(1. / np.sum(1. / (group["flux_err"] * group["flux_err"])))
-                    if verbose: print(np.mean(group["MJD"]), wmean, wmean_err)
-                    na_table.add_row((np.mean(group["MJD"]), wmean, wmean_err, filter_key))
-
-            if verbose: print("loading into phot object...")
-
-            self.load_table(phot_table=na_table)
+            ## the filters are already loaded, so just point self.data at the new arrays
+            self.arrays = PhotometryArraysClass()
+            self.arrays.load_arrays(mean_mjd, wmean, wmean_err, mean_filters, units = units)
+            self.phot = self.arrays.get_table(filter_keys + other_keys)
+            if verbose: print(self.phot)
 
+            if not isinstance(self.data, PhotometryDataClass):
+                self.data = PhotometryDataClass(self.data)
+            self.data.set_arrays(self.arrays)
+            self.filter_names = self.arrays.filter_names
+            self._sort_phot()
 
         else:
             warnings.warn("Doesn't seem to be any data here (empty self.phot)")
@@ -1134,20 +1671,21 @@ class BaseFilterClass():
         """
         """
 
-
-        AB = SpectrumClass()
-        AB.load(ABpath, wmin=wmin, wmax=wmax)
+        AB = get_reference_spectrum(ABpath, wmin=wmin, wmax=wmax)
 
         if not hasattr(self, "lambda_effective"):
             self.calculate_effective_wavelength()
 
-        self.resample_response(new_wavelength=AB.wavelength)
+        throughput = self.get_resampled_throughput(AB.wavelength)
 
-        transmitted_spec = self.throughput * AB.flux
+        transmitted_spec = throughput * AB.flux
         integrated_flux = simps(transmitted_spec, AB.wavelength)
 
         if not hasattr(self, "_effective_area"):
-            self.calculate_filter_area()
+            area = simps(throughput, AB.wavelength)
+            if np.isnan(area): ## See Issue #26 on GitHub
+                area = trapz(throughput, AB.wavelength)
+            self._effective_area = area
 
         area_corr_integrated_flux = integrated_flux / self._effective_area
 
@@ -1271,12 +1809,192 @@ class BaseFilterClass():
             warnings.warn("Doesn't look like you have loaded a filter into the object")
 
 
+    def get_resampled_throughput(self, new_wavelength, k = 1, verbose=False):
+        """
+        Returns the throughput sampled onto `new_wavelength`, without changing
+        self.wavelength or self.throughput (unlike resample_response). Results
+        are kept for the last defaults._resampled_throughput_cache_size grids,
+        so applying the filter to the same grid again doesn't refit the spline.
+
+        The returned array is read-only, as it is shared between calls.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+
+        source = self._get_native_response()
+
+        new_wavelength = np.ascontiguousarray(getattr(new_wavelength, "value", new_wavelength), dtype=np.float64)
+        key = ("spline", k, new_wavelength.shape, hashlib.md5(new_wavelength.tobytes()).hexdigest())
+
+        if key in self._resampled_throughput_cache:
+            if verbose: print("using cached response for", self.filter_name if hasattr(self, "filter_name") else self)
+            self._resampled_throughput_cache.move_to_end(key)
+            return self._resampled_throughput_cache[key]
+
+        if verbose: print("resampling response")
+
+        wavelength = np.asarray(getattr(source[0], "value", source[0]), dtype=np.float64)
+        throughput = np.asarray(source[1], dtype=np.float64)
+
+        interp_func = InterpolatedUnivariateSpline(np.concatenate(([0, 1], wavelength, [24999, 25000])),
+                                                   np.concatenate(([0, 0], throughput, [0, 0])), k = k)
+        resampled_throughput = interp_func(new_wavelength)
+        resampled_throughput[np.where(resampled_throughput < 0.0)] = 0.0
+        resampled_throughput.setflags(write=False)
+
+        self._cache_response(key, resampled_throughput)
+
+        return resampled_throughput
+
+
+    def get_exact_weights(self, new_wavelength, verbose=False):
+        """
+        Returns the weights w such that np.dot(w, flux) is the exact integral of
+        (linearly interpolated flux) x (linearly interpolated throughput) over
+        `new_wavelength`, with the throughput zero outside the filter file's
+        wavelength range. np.sum(w) is the matching filter area. See
+        utils.calc_linear_product_weights.
+
+        No resampling is involved, so the answer doesn't depend on which of the
+        two grids is finer. Cached like get_resampled_throughput, and read-only.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        source = self._get_native_response()
+
+        new_wavelength = np.ascontiguousarray(getattr(new_wavelength, "value", new_wavelength), dtype=np.float64)
+        key = ("exact", new_wavelength.shape, hashlib.md5(new_wavelength.tobytes()).hexdigest())
+
+        if key in self._resampled_throughput_cache:
+            if verbose: print("using cached weights for", self.filter_name if hasattr(self, "filter_name") else self)
+            self._resampled_throughput_cache.move_to_end(key)
+            return self._resampled_throughput_cache[key]
+
+        if verbose: print("calculating weights")
+
+        weights = utils.calc_linear_product_weights(new_wavelength,
+                                                    np.asarray(getattr(source[0], "value", source[0]), dtype=np.float64),
+                                                    np.asarray(source[1], dtype=np.float64))
+        weights.setflags(write=False)
+
+        self._cache_response(key, weights)
+
+        return weights
+
+
+    def _get_native_response(self):
+        """
+        The response as read in (before any resample_response), dropping anything
+        cached by get_resampled_throughput/get_exact_weights if it has changed.
+        """
+        if not hasattr(self, "wavelength") or not hasattr(self, "throughput"):
+            raise errors.CustomValueError("Doesn't look like you have loaded a filter into the object")
+
+        if hasattr(self, "_wavelength_orig") and hasattr(self, "_throughput_orig"):
+            source = (self._wavelength_orig, self._throughput_orig)
+        else:
+            source = (self.wavelength, self.throughput)
+
+        if not hasattr(self, "_resampled_throughput_cache") or \
+                self._resampled_throughput_source[0] is not source[0] or \
+                self._resampled_throughput_source[1] is not source[1]:
+            ## new (or reloaded) response - anything cached is stale
+            self._resampled_throughput_cache = OrderedDict()
+            self._resampled_throughput_source = source
+            if hasattr(self, "_support"):
+                del self._support
+
+        return source
+
+
+    def get_support(self):
+        """
+        Returns the (lower, upper) wavelengths outside of which the resampled
+        response (get_resampled_throughput) is zero - the neighbouring zero
+        points of the first and last non-zero throughput in the filter file.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        source = self._get_native_response()
+
+        if not hasattr(self, "_support"):
+            wavelength = np.asarray(getattr(source[0], "value", source[0]), dtype=np.float64)
+            nonzero = np.where(np.asarray(source[1], dtype=np.float64) > 0.0)[0]
+
+            if len(nonzero) == 0:
+                self._support = (wavelength[0], wavelength[0])
+            else:
+                ## resample_response pads the response with zeros at 1 and 24999A
+                lower = wavelength[nonzero[0] - 1] if nonzero[0] > 0 else 1.
+                upper = wavelength[nonzero[-1] + 1] if nonzero[-1] < len(wavelength) - 1 else 24999.
+                self._support = (lower, upper)
+
+        return self._support
+
+
+    def get_support_slice(self, wavelength):
+        """
+        Returns the slice of `wavelength` (increasing) that covers get_support,
+        found with searchsorted. The slice starts on an even index and spans an
+        even number of intervals where it can, so Simpson's rule over the slice
+        pairs the intervals up in the same way as over the whole array - the
+        throughput is zero everywhere else, so the integrals agree.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        wavelength = np.asarray(getattr(wavelength, "value", wavelength))
+        lower, upper = self.get_support()
+
+        start = max(np.searchsorted(wavelength, lower, side="right") - 1, 0)
+        end = min(np.searchsorted(wavelength, upper, side="left"), len(wavelength) - 1)
+
+        start = start - start % 2
+        end = max(end, start + 2)
+        if (end - start) % 2:
+            end = end + 1
+        end = min(end, len(wavelength) - 1)
+        ## simps needs at least three points, even if the filter is off the end of the grid
+        start = max(min(start, end - 2), 0)
+
+        return slice(start, end + 1)
+
+
+    def _cache_response(self, key, value):
+        """
+        Stores `value`, dropping the least recently used entry once there are
+        more than defaults._resampled_throughput_cache_size.
+        """
+        self._resampled_throughput_cache[key] = value
+        while len(self._resampled_throughput_cache) > defaults._resampled_throughput_cache_size:
+            self._resampled_throughput_cache.popitem(last=False)
+        pass
+
+
     def resample_response(self, new_wavelength = False, k = 1, verbose=False, revert=True,
                           *args, **kwargs):
         """
         Bit dodgy - spline has weird results for poorly sampled filters.
         Now the order is by default 1, seems to be less likely to introduce artifacts
 
+        Changes self.wavelength and self.throughput - see get_resampled_throughput
+        for a version that doesn't.
+
         Parameters
         ----------
 
@@ -1291,6 +2009,14 @@ class BaseFilterClass():
             if revert:
                 self.revert(verbose=verbose)
 
+                if not args and not kwargs:
+                    self._wavelength_orig = self.wavelength
+                    self._throughput_orig = self.throughput
+
+                    self.throughput = np.array(self.get_resampled_throughput(new_wavelength, k = k, verbose = verbose))
+                    self.wavelength = new_wavelength
+                    return
+
             self._wavelength_orig = self.wavelength
             self._throughput_orig = self.throughput
 
@@ -1401,7 +2127,8 @@ class BaseFilterClass():
         Output the filter loaded into the Class into a format
         and location recognised by CoCo.
 
-        based on BaseSpectrumClass.save
+        based on BaseSpectrumClass.save - written straight from the arrays
+        by utils.write_columns.
 
         Parameters
         ----------
@@ -1425,17 +2152,13 @@ class BaseFilterClass():
                 warnings.warn("Found existing file matching " + path + ". Run with squash = True to overwrite")
                 if squash:
                     print("Overwriting " + outpath)
-                    outtable = Table([self.wavelength, self.throughput], names = ["wavelength", "throughput"])
-                    outtable.write(outpath, format = "ascii.fast_commented_header", overwrite = True)
-                    self._format_for_save = outtable
+                    utils.write_columns(outpath, OrderedDict([("wavelength", self.wavelength), ("throughput", self.throughput)]),
+                                        overwrite = True)
 
 
             else:
                     print("Writing " + outpath)
-                    outtable = Table([self.wavelength, self.throughput], names = ["wavelength", "throughput"])
-
-                    outtable.write(outpath, format = "ascii.fast_commented_header")
-                    self._format_for_save = outtable
+                    utils.write_columns(outpath, OrderedDict([("wavelength", self.wavelength), ("throughput", self.throughput)]))
 
         else:
             warnings.warn("Doesn't seem to be any data here (empty self.data)")
@@ -1558,7 +2281,9 @@ class PhotometryClass(BaseLightCurveClass):
 
         errors.StringWarning(path)
 
-        if names:
+        if format == "ascii":
+            phot_table = utils.read_columns_table(path, names = names, verbose = verbose)
+        elif names:
             phot_table = Table.read(path, format = format, names = names)
         else:
             phot_table = Table.read(path, format = format)
@@ -1612,6 +2337,9 @@ class PhotometryClass(BaseLightCurveClass):
 
         """
 
+        ## functions imports classes, so can't be imported at the top
+        from . import functions
+
         if snname:
             if not path:
                 path = self._default_data_dir_path
@@ -1619,7 +2347,9 @@ class PhotometryClass(BaseLightCurveClass):
             phot_list = find_filter_phot(path = path, snname = snname, prefix = prefix,
                               file_type = file_type, verbose = verbose)
 
-            full_phot_table = Table()
+            ## the tables as read, stacked together once they are all in
+            phot_tables = []
+            phot_meta = OrderedDict()
 
             ## Loop over files (shouldn't be that many really)
             if len(phot_list) > 0:
@@ -1628,42 +2358,24 @@ class PhotometryClass(BaseLightCurveClass):
 
                     if verbose: print(phot_file)
                     phot_table = Table.read(phot_file, names = names, format = format)
-
-                    ## NOTE astropy vstack does not support mixin columns http://docs.astropy.org/en/stable/table/mixin_columns.html
-                    # This means I might have problems joining the tables together if I don't add together as I go along.
-
-                    full_phot_table = vstack([full_phot_table, phot_table])
+                    phot_tables.append(phot_table)
 
                     filter_string = functions.get_filter_from_filename(phot_file, snname, file_type)
-                    phot_table.meta = {"filename" : phot_file,
-                                       "filter" : filter_string,
-                                       "filter_filename": filter_string + filter_file_type}
 
-                    ## Sort out units
-                    phot_table.sort("MJD")
-                    phot_table["t"] = Time(phot_table["MJD"], format = 'mjd')
+                    ## check the filter in the file matches that in its name
+                    file_filters = np.unique(phot_table["filter"])
+                    if verbose: print(len(file_filters), filter_string, file_filters[0])
 
-                    phot_table["MJD"].unit = u.day
-                    phot_table["flux"].unit = u.cgs.erg / u.si.angstrom / u.si.cm ** 2 / u.si.s
-                    phot_table["flux_err"].unit =  phot_table["flux"].unit
-
-                    ## Put in dictionary - use filter from the file
-                    filter_key = np.unique(phot_table["filter"])[0]
-                    if verbose: print(len(np.unique(phot_table["filter"])) , phot_table.meta["filter"], filter_key)
-
-                    if len(np.unique(phot_table["filter"])) > 1 or filter_key != phot_table.meta["filter"]:
+                    if len(file_filters) > 1 or file_filters[0] != filter_string:
                         raise errors.FilterMismatchError("There is a mismatch between the filter filename and that in the "
                                                    + "photometry file")
 
-                    self.data[filter_key] = phot_table
-
-                    path_to_filter = os.path.join(self.filter_directory, phot_table.meta['filter_filename'])
-                    self.data_filters[filter_key] = functions.load_filter(path_to_filter)
-
+                    phot_meta[filter_string] = {"filename" : phot_file,
+                                                "filter" : filter_string,
+                                                "filter_filename": filter_string + filter_file_type}
 
-                ## NOTE doing it this way because vstack doesn't like mixin columns (see above comment)
+                full_phot_table = vstack(phot_tables)
                 full_phot_table.sort("MJD")
-                # full_phot_table["t"] = Time(full_phot_table["MJD"], format = 'mjd')
                 full_phot_table["MJD"].unit = u.day
 
                 full_phot_table["flux"].unit = u.cgs.erg / u.si.angstrom / u.si.cm ** 2 / u.si.s
@@ -1671,6 +2383,12 @@ class PhotometryClass(BaseLightCurveClass):
 
                 self.phot = full_phot_table
 
+                ## each filter's table is a view of self.arrays - an astropy Time of
+                ## the MJDs is there if wanted, from self.arrays.get_time(filter)
+                self.unpack(filter_file_type = filter_file_type, verbose = verbose)
+                for filter_key in phot_meta:
+                    self.data[filter_key].meta = phot_meta[filter_key]
+
                 ## Sort the OrderedDict
                 self._sort_phot()
             else:
@@ -1683,32 +2401,9 @@ class PhotometryClass(BaseLightCurveClass):
 
     def _combine_phot(self, verbose = False):
         """
-
+        Puts all of the photometry into self.data['full'] (see get_full_phot).
         """
-
-        if hasattr(self, "data"):
-            if verbose: print(self.data.keys())
-
-            for i, phot_filter in enumerate(self.data.keys()):
-
-                if verbose: print(i, phot_filter)
-
-                if i == 0:
-
-                    full_phot = self.data[phot_filter]
-
-                else:
-
-
-                    full_phot = vstack([full_phot, self.data[phot_filter]])
-
-                    pass
-
-            self.data['full'] = full_phot
-
-        else:
-            warnings.warn("Cant find self.data")
-
+        BaseLightCurveClass._combine_phot(self, verbose = verbose)
         pass
 
 
@@ -1917,6 +2612,100 @@ class SpectrumClass(BaseSpectrumClass):
             pass
 
 
+class LazySpectrumClass(SpectrumClass):
+    """
+    A SpectrumClass that doesn't read its file until the data are needed.
+    Inherits from SpectrumClass.
+
+    min_wavelength and max_wavelength come from the first and last lines of
+    the file where they can (i.e. where load wouldn't trim them off), so
+    overlap checks don't read the rest. Anything else that needs data,
+    wavelength or flux calls load with the arguments given here.
+    """
+
+    _lazy_attributes = ("data", "wavelength", "flux", "min_wavelength", "max_wavelength", "success")
+
+    def __init__(self, filename, directory = False, abspath = False, verbose = False, **kwargs):
+        """
+
+        """
+        SpectrumClass.__init__(self)
+
+        if abspath:
+            path = filename
+        elif directory:
+            path = os.path.join(directory, filename)
+        else:
+            path = os.path.join(self.data_directory, filename)
+
+        self._lazy_load_args = (filename, directory, abspath, verbose, kwargs)
+
+        wmin = kwargs.get("wmin", 1500 * u.angstrom)
+        wmax = kwargs.get("wmax", 11000 * u.angstrom)
+        if kwargs.get("wavelength_u", u.angstrom) == u.angstrom and os.path.isfile(path):
+            extent = utils.read_spectrum_extent(path)
+            if extent and wmin.value < extent[0] < extent[1] < wmax.value:
+                self.min_wavelength, self.max_wavelength = extent
+                if verbose: print(path, "spans", extent)
+        pass
+
+
+    def __getattr__(self, name):
+        ## only called for attributes that aren't set yet
+        if name in LazySpectrumClass._lazy_attributes and "_lazy_load_args" in self.__dict__:
+            self.load_now()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+
+    def load_now(self):
+        """
+        Reads the file, if it hasn't been already.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        if "_lazy_load_args" in self.__dict__:
+            filename, directory, abspath, verbose, kwargs = self.__dict__.pop("_lazy_load_args")
+            self.load(filename, directory = directory, abspath = abspath, verbose = verbose, **kwargs)
+        pass
+
+
+class ReferenceSpectrumClass(BaseSpectrumClass):
+    """
+    Read-only reference spectrum (AB pseudospectrum, Vega) used for zeropoints.
+    Inherits from BaseSpectrumClass.
+
+    wavelength and flux are plain float64 arrays (Angstrom and
+    erg s^-1 cm^-2 AA^-1) that can't be written to, so one instance can be
+    shared by every filter that needs it. Get them through
+    get_reference_spectrum rather than making your own.
+    """
+
+    def __init__(self, path, wmin=1500 * u.angstrom, wmax=25000 * u.angstrom, verbose=False):
+        """
+
+        """
+        spec = SpectrumClass()
+        spec.load(path, abspath=True, wmin=wmin, wmax=wmax, verbose=verbose)
+
+        self.data = spec.data
+        self.wavelength = np.array(spec.wavelength, dtype=np.float64)
+        self.flux = np.array(spec.flux, dtype=np.float64)
+        self.wavelength.flags.writeable = False
+        self.flux.flags.writeable = False
+
+        self.min_wavelength = np.nanmin(self.wavelength)
+        self.max_wavelength = np.nanmax(self.wavelength)
+
+        self._reference_path = path
+        self.success = True
+        pass
+
+
 class LCfitClass(BaseLightCurveClass):
     """
     Small class to hold the output from CoCo LCfit.
@@ -2278,12 +3067,19 @@ class FilterClass(BaseFilterClass):
 
     def read_filter_file(self, path, fmt = "ascii",
                          names = ("wavelength", "throughput"),
-                         wavelength_u = u.angstrom, verbose = False):
+                         wavelength_u = u.angstrom, use_table = True, verbose = False):
         """
         Assumes Response function is fractional rather than %.
+
+        If the filter has an up to date entry in the zeropoint table of its
+        directory (see utils.make_zeropoint_table) the zeropoints are taken from
+        there, unless `use_table = False`.
         """
         if utils.check_file_path(os.path.abspath(path), verbose = verbose):
-            self.data = Table.read(path, format = fmt, names = names)
+            if fmt == "ascii":
+                self.data = utils.read_columns_table(path, names = names, verbose = verbose)
+            else:
+                self.data = Table.read(path, format = fmt, names = names)
             self.wavelength = self.data["wavelength"] * wavelength_u
             if verbose: print("1", np.nanmax(self.wavelength))
             self.wavelength = self.wavelength.to(u.angstrom)
@@ -2305,7 +3101,7 @@ class FilterClass(BaseFilterClass):
             if verbose: print("6", np.nanmax(self.wavelength))
             self.calculate_edges()
             if verbose: print("7", np.nanmax(self.wavelength))
-            self.get_zeropoint()
+            self.get_zeropoint(use_table = use_table, verbose = verbose)
             if verbose: print("8", np.nanmax(self.wavelength))
 
         else:
@@ -2346,19 +3142,30 @@ class FilterClass(BaseFilterClass):
         self._lower_edge = self.wavelength[w_low]
 
 
-    def calculate_edges(self, pc = 3., verbose = False):
+    def calculate_edges(self, pc = 3., verbose = False, new_wavelength = False):
         """
         calculates edges by defining the region that contains (100 - pc)% of the
         flux.
 
+        With new_wavelength, the edges are those of the response resampled onto
+        it (see get_resampled_throughput) - self.wavelength and self.throughput
+        are left as they are.
+
         Parameters
         ----------
 
         Returns
         -------
         """
-        self._cumulative_throughput = np.cumsum(self.throughput)/np.sum(self.throughput)
-        self._cumulative_throughput_spline = interp1d(self._cumulative_throughput, self.wavelength)
+        if new_wavelength is not False:
+            wavelength = new_wavelength
+            throughput = self.get_resampled_throughput(new_wavelength, verbose = verbose)
+        else:
+            wavelength = self.wavelength
+            throughput = self.throughput
+
+        self._cumulative_throughput = np.cumsum(throughput)/np.sum(throughput)
+        self._cumulative_throughput_spline = interp1d(self._cumulative_throughput, wavelength)
 
         self._upper_edge = self._cumulative_throughput_spline(1.0 - 0.5*(0.01*pc))
         self._lower_edge = self._cumulative_throughput_spline(0.0 + 0.5*(0.01*pc))
@@ -2420,15 +3227,28 @@ class FilterClass(BaseFilterClass):
         pass
 
 
-    def get_zeropoint(self, abpath=os.path.join(defaults._default_kcorr_data_path, "AB_pseudospectrum.dat")):
+    def get_zeropoint(self, abpath=os.path.join(defaults._default_kcorr_data_path, "AB_pseudospectrum.dat"),
+                      use_table = True, verbose = False):
         """
 
         :return:
         """
 
         if hasattr(self, "filter_name"):
-            # self.zp_AB = self.calculate_AB_zp()
-            self.calculate_AB_zp(ABpath=abpath)
+            row = None
+            if use_table and hasattr(self, "_filter_file_path") and \
+                    abpath == os.path.join(defaults._default_kcorr_data_path, "AB_pseudospectrum.dat"):
+                row = utils.get_zeropoint_table_row(self._filter_file_path, verbose = verbose)
+
+            if row is not None and np.isfinite(row["zp_AB"]):
+                if verbose: print("using tabulated zeropoints for", self.filter_name)
+                self.zp_AB = float(row["zp_AB"])
+                self._effective_area = float(row["area"])
+                if np.isfinite(row["zp_vega"]):
+                    self.zp_vega = float(row["zp_vega"])
+            else:
+                # self.zp_AB = self.calculate_AB_zp()
+                self.calculate_AB_zp(ABpath=abpath)
             # self.zp_vega = self.calc_vega_zp(filter_name)
         else:
             warnings.warn("No filter name - have you loaded in a bandpass?")
@@ -2537,11 +3357,14 @@ class SNClass():
 
 
     def load_phot(self, phot_table = False, snname = False, path = False, file_type = '.dat',
-                  verbose = False):
+                  store = False, verbose = False):
         """
 
         Parameters
         ----------
+        store : a PhotometryStoreClass, or the path to one, to take the
+            photometry of snname from rather than reading its file - raises
+            errors.CustomValueError if snname isn't in it.
 
         Returns
         -------
@@ -2551,6 +3374,12 @@ class SNClass():
             snname = self.name
         if phot_table:
             self.phot.load_table(phot_table=phot_table, verbose=verbose)
+        elif store:
+            if not isinstance(store, PhotometryStoreClass):
+                store = PhotometryStoreClass(store, verbose = verbose)
+            if snname not in store.snnames:
+                raise errors.CustomValueError(str(snname) + " isn't in the photometry store " + store.path)
+            self.phot.load_table(phot_table=store.get_phot(snname = snname, verbose = verbose), verbose=verbose)
         else:
             if not path:
                 path = os.path.join(self.phot._default_data_dir_path, snname + file_type)
@@ -2588,10 +3417,16 @@ class SNClass():
         self.list  = listdata
 
 
-    def load_spec(self, snname = False, spec_dir_path = False, verbose = False):
+    def load_spec(self, snname = False, spec_dir_path = False, lazy = False, max_workers = False, verbose = False):
         """
         Parameters
         ----------
+        lazy : if True, self.spec holds LazySpectrumClass objects, which only
+            read their files when the data are first needed - the MJDs come
+            from the list, and the wavelength ranges from the ends of the files.
+
+        max_workers : read the spectra with a pool of this many threads (see
+            utils.map_ordered). They end up in self.spec in the same order.
 
         Returns
         -------
@@ -2610,15 +3445,24 @@ class SNClass():
 
 
         if hasattr(self, 'coco_directory') and hasattr(self, 'list'):
-            for i, path in enumerate(self.list['spec_path']):
+            def _load(path):
                 spec_fullpath = os.path.join(self.coco_directory, path)
                 spec_filename = path.split('/')[-1]
                 spec_dir_path = spec_fullpath.replace(spec_filename, '')
                 if verbose: print(spec_fullpath, spec_dir_path, spec_filename)
 
-                self.spec[spec_filename] = SpectrumClass()
-                self.spec[spec_filename].load(spec_filename, directory = spec_dir_path,
-                                              verbose = verbose)
+                if lazy:
+                    return LazySpectrumClass(spec_filename, directory = spec_dir_path, verbose = verbose)
+
+                spectrum = SpectrumClass()
+                spectrum.load(spec_filename, directory = spec_dir_path, verbose = verbose)
+                return spectrum
+
+            spectra = utils.map_ordered(_load, self.list['spec_path'], max_workers = max_workers)
+
+            for i, path in enumerate(self.list['spec_path']):
+                spec_filename = path.split('/')[-1]
+                self.spec[spec_filename] = spectra[i]
                 self.spec[spec_filename].set_infile(spec_filename)
                 self.spec[spec_filename].set_MJD_obs(self.list['mjd_obs'][i])
                 # self.spec[spec_filename].data.add_index('wavelength')
@@ -2628,10 +3472,16 @@ class SNClass():
         pass
 
 
-    def load_mangledspec(self, snname = False, spec_dir_path = False, verbose = False):
+    def load_mangledspec(self, snname = False, spec_dir_path = False, max_workers = False, verbose = False):
         """
         Parameters
         ----------
+        spec_dir_path : directory to find and read the mangled spectra in -
+            otherwise they are found in the specphase directory, and read
+            from self.recon_directory.
+
+        max_workers : read the spectra with a pool of this many threads (see
+            utils.map_ordered). They end up in self.mangledspec in the same order.
 
         Returns
         -------
@@ -2641,17 +3491,26 @@ class SNClass():
             snname = self.name
 
         # self._mangledspeclist = functions.find_recon_spec(snname)
-        self._mangledspeclist = find_specphase_spec(self.name)
+        if spec_dir_path:
+            self._mangledspeclist = find_specphase_spec(self.name, dir_path = spec_dir_path)
+        else:
+            self._mangledspeclist = find_specphase_spec(self.name)
         self.mangledspec = OrderedDict()
         if verbose: print("loading mangledspec")
         if hasattr(self, 'recon_directory') and hasattr(self, '_mangledspeclist') and hasattr(self, "mangledspec"):
+            def _load(spec_filename):
+                # spectrum = SpectrumClass()
+                spectrum = specfitClass()
+                spectrum.load(spec_filename, directory = spec_dir_path if spec_dir_path else self.recon_directory,
+                              verbose = verbose)
+                return spectrum
+
+            spectra = utils.map_ordered(_load, self._mangledspeclist, max_workers = max_workers)
+
             for i, spec_filename in enumerate(self._mangledspeclist):
 
                 if verbose: print(i, spec_filename)
-                # self.mangledspec[spec_filename] = SpectrumClass()
-                self.mangledspec[spec_filename] = specfitClass()
-                self.mangledspec[spec_filename].load(spec_filename, directory = self.recon_directory,
-                                              verbose = verbose)
+                self.mangledspec[spec_filename] = spectra[i]
 
                 orig_specpath = self.mangledspec[spec_filename].data.meta['comments']
                 orig_specname = orig_specpath
@@ -2668,9 +3527,10 @@ class SNClass():
         pass
 
 
-    def load_simspec(self, spec_dir_path=defaults._default_specphase_dir_path, verbose=False):
+    def load_simspec(self, spec_dir_path=defaults._default_specphase_dir_path, max_workers=False, verbose=False):
         """
-
+        max_workers : read the spectra with a pool of this many threads (see
+            utils.map_ordered). They end up in self.sim_spec in the same order.
         """
 
         if hasattr(self, "name"):
@@ -2680,10 +3540,11 @@ class SNClass():
 
             self.sim_spec = OrderedDict()
 
-            for specfile in dir_contents:
-                self.sim_spec[specfile.replace(".spec", "")] = SpectrumClass()
+            spectra = utils.map_ordered(lambda specfile: _load_spectrum(specfile, spec_dir_path, verbose=verbose),
+                                        dir_contents, max_workers=max_workers)
 
-                self.sim_spec[specfile.replace(".spec", "")].load(specfile, directory=spec_dir_path, verbose=verbose,)
+            for specfile, spectrum in zip(dir_contents, spectra):
+                self.sim_spec[specfile.replace(".spec", "")] = spectrum
 
             if verbose: print(self.sim_spec.keys())
         else:
@@ -2691,10 +3552,13 @@ class SNClass():
         pass
 
 
-    def load_reconspec(self, snname = False, spec_dir_path = defaults._default_recon_dir_path, verbose = False):
+    def load_reconspec(self, snname = False, spec_dir_path = defaults._default_recon_dir_path, max_workers = False,
+                       verbose = False):
         """
         Parameters
         ----------
+        max_workers : read the spectra with a pool of this many threads (see
+            utils.map_ordered). They end up in self.recon_spec in the same order.
 
         Returns
         -------
@@ -2706,10 +3570,11 @@ class SNClass():
 
             self.recon_spec = OrderedDict()
 
-            for specfile in dir_contents:
-                self.recon_spec[specfile.replace(".spec", "")] = SpectrumClass()
+            spectra = utils.map_ordered(lambda specfile: _load_spectrum(specfile, spec_dir_path, verbose=verbose),
+                                        dir_contents, max_workers=max_workers)
 
-                self.recon_spec[specfile.replace(".spec", "")].load(specfile, directory=spec_dir_path, verbose=verbose,)
+            for specfile, spectrum in zip(dir_contents, spectra):
+                self.recon_spec[specfile.replace(".spec", "")] = spectrum
 
             if verbose: print(self.recon_spec.keys())
         else:
@@ -2744,6 +3609,55 @@ class SNClass():
         pass
 
 
+    def deredden_spec(self, EBV_host, EBV_MW = False, z = False, verbose = False):
+        """
+        Dereddens every spectrum in self.spec (see BaseSpectrumClass.deredden),
+        with the spectra that share a wavelength grid done as one stack by
+        extinction.deredden, so the extinction curve is found once per grid.
+
+        Parameters
+        ----------
+        EBV_host : host E(B-V), applied in the rest frame
+        EBV_MW : Milky Way E(B-V), applied in the observer frame - as for
+            BaseSpectrumClass.deredden, each spectrum's EBV (see set_EBV) if
+            not given
+        z : redshift - self.z (see load_sndist) if not given
+
+        Returns
+        -------
+        """
+        if z is False:
+            if hasattr(self, "z"):
+                z = self.z
+            else:
+                warnings.warn("No redshift given, and self.z not set - try load_sndist")
+                return
+
+        if not hasattr(self, "spec") or len(self.spec) == 0:
+            warnings.warn("No spectra loaded - try load_spec")
+            return
+
+        all_spec_keys = list(self.spec.keys())
+        grids = utils.group_by_grid([self.spec[spec_key].wavelength for spec_key in all_spec_keys])
+
+        if verbose: print(len(self.spec), "spectra on", len(grids), "wavelength grids")
+
+        for wavelength, rows in grids:
+            spec_keys = [all_spec_keys[i] for i in rows]
+            flux = np.vstack([self.spec[spec_key].flux for spec_key in spec_keys])
+            ## one E(B-V) per row of the stack
+            spec_EBV_MW = [self.spec[spec_key].EBV if hasattr(self.spec[spec_key], "EBV") and not EBV_MW else EBV_MW
+                           for spec_key in spec_keys]
+            flux_dered = extinction.deredden(wavelength, flux, z,
+                                             EBV_MW = np.asarray(spec_EBV_MW, dtype = np.float64),
+                                             EBV_host = EBV_host)
+
+            for spec_key, spectrum_flux_dered in zip(spec_keys, flux_dered):
+                self.spec[spec_key].flux_dered = spectrum_flux_dered
+                self.spec[spec_key].data["flux_dered"] = spectrum_flux_dered
+        pass
+
+
     def plot_lc(self, filters = False, legend = True, xminorticks = 10, mark_spectra = True,
                 simplespecphot = False, fade = False, xlims = False, insidelegend = True,
                 fit = True, enforce_zero = True, multiplot = True, yaxis_lim_multiplier = 1.1,
@@ -3347,10 +4261,12 @@ class SNClass():
         pass
 
 
-    def get_specfit(self, verbose = False):
+    def get_specfit(self, max_workers = False, verbose = False):
         """
         Parameters
         ----------
+        max_workers : read the spectra with a pool of this many threads (see
+            utils.map_ordered). They end up in self.specfit in the same order.
 
         Returns
         -------
@@ -3359,15 +4275,23 @@ class SNClass():
         self.specfit = OrderedDict()
 
         if hasattr(self, "name"):
-            specfit_list = functions.find_recon_spec(self.recon_directory, self.name, verbose = verbose)
+            recon_list = utils.find_recon_spec(self.recon_directory, verbose = verbose)
+            if recon_list is False:
+                recon_list = []
+            specfit_list = [i for i in recon_list if i.startswith(self.name)]
             # if verbose: print(specfit_list)
 
+            def _load(specfit_file):
+                specfit = specfitClass()
+                specfit.load(filename = specfit_file, directory = self.recon_directory, verbose = verbose)
+                specfit.set_orig_specpath()
+                return specfit
+
+            specfits = utils.map_ordered(_load, specfit_list, max_workers = max_workers)
+
             for i, specfit_file in enumerate(specfit_list):
                 if verbose: print(i, specfit_file)
-                self.specfit[specfit_file] = specfitClass()
-                self.specfit[specfit_file].load(filename = specfit_file,
-                            directory = self.recon_directory, verbose = verbose)
-                self.specfit[specfit_file].set_orig_specpath()
+                self.specfit[specfit_file] = specfits[i]
 
         else:
             warnings.warn("This SNClass object has no name")
@@ -3454,6 +4378,32 @@ class SNClass():
         pass
 
 
+    def _check_overlaps(self, spectra, verbose = False):
+        """
+        Adds the filters in self.phot.data_filters that lie within each of
+        `spectra` (a dict of SpectrumClass) to their _overlapping_filter_list,
+        working out every spectrum/filter pair in one go.
+        """
+        filter_names = np.array([filter_name for filter_name in self.phot.data_filters
+                                 if hasattr(self.phot.data_filters[filter_name], "_lower_edge") and
+                                 hasattr(self.phot.data_filters[filter_name], "_upper_edge")])
+        filter_edges = [[self.phot.data_filters[filter_name]._lower_edge, self.phot.data_filters[filter_name]._upper_edge]
+                        for filter_name in filter_names]
+
+        ## (the wavelength range is all that's needed - lazy spectra can know it without reading the file)
+        spectrum_names = [spectrum for spectrum in spectra if hasattr(spectra[spectrum], "min_wavelength")
+                          and hasattr(spectra[spectrum], "max_wavelength")]
+        spectrum_limits = [[spectra[spectrum].min_wavelength, spectra[spectrum].max_wavelength]
+                           for spectrum in spectrum_names]
+
+        overlaps = utils.calc_overlap_matrix(spectrum_limits, filter_edges)
+
+        for i, spectrum in enumerate(spectrum_names):
+            if verbose: print(i, spectrum, filter_names[overlaps[i]])
+            spectra[spectrum]._add_to_overlapping_filters(filter_names[overlaps[i]], verbose=verbose)
+        pass
+
+
     def check_overlaps(self, verbose = False):
         """
         Checks the filters that the spectrum overlaps with.
@@ -3466,25 +4416,7 @@ class SNClass():
         -------
         """
         if hasattr(self.phot, "data") and hasattr(self, 'spec'):
-            for i, spectrum in enumerate(self.spec):
-                if verbose:print(i, spectrum)
-                for j, filtername in enumerate(self.phot.data_filters):
-                    if verbose:print(j, filtername)
-
-                    if hasattr(self.phot.data_filters[filtername], "_lower_edge") and \
-                      hasattr(self.phot.data_filters[filtername], "_upper_edge") and \
-                      hasattr(self.spec[spectrum], "data"):
-                       blue_bool = self.phot.data_filters[filtername]._lower_edge > self.spec[spectrum].min_wavelength
-                       red_bool = self.phot.data_filters[filtername]._upper_edge < self.spec[spectrum].max_wavelength
-
-                       if blue_bool and red_bool:
-                            within = True
-                       else:
-                            within = False
-
-                    if verbose:print(within)
-                    if within:
-                        self.spec[spectrum]._add_to_overlapping_filters(filtername, verbose=verbose)
+            self._check_overlaps(self.spec, verbose=verbose)
         else:
             warnings.warn("SNClass.check_overlaps - something went wrong... no data?")
         pass
@@ -3501,26 +4433,8 @@ class SNClass():
         Returns
         -------
         """
-        if hasattr(self.phot, "data") and hasattr(self, 'spec'):
-            for i, spectrum in enumerate(self.sim_spec):
-                if verbose:print(i, spectrum)
-                for j, filtername in enumerate(self.phot.data_filters):
-                    if verbose:print(j, filtername)
-
-                    if hasattr(self.phot.data_filters[filtername], "_lower_edge") and \
-                      hasattr(self.phot.data_filters[filtername], "_upper_edge") and \
-                      hasattr(self.sim_spec[spectrum], "data"):
-                       blue_bool = self.phot.data_filters[filtername]._lower_edge > self.sim_spec[spectrum].min_wavelength
-                       red_bool = self.phot.data_filters[filtername]._upper_edge < self.sim_spec[spectrum].max_wavelength
-
-                       if blue_bool and red_bool:
-                            within = True
-                       else:
-                            within = False
-
-                    if verbose:print(within)
-                    if within:
-                        self.sim_spec[spectrum]._add_to_overlapping_filters(filtername, verbose=verbose)
+        if hasattr(self.phot, "data") and hasattr(self, 'sim_spec'):
+            self._check_overlaps(self.sim_spec, verbose=verbose)
         else:
             warnings.warn("SNClass.check_sim_overlaps - something went wrong... no data?")
         pass
@@ -3538,27 +4452,9 @@ class SNClass():
         -------
         """
         if hasattr(self.phot, "data") and hasattr(self, 'recon_spec'):
-            for i, spectrum in enumerate(self.recon_spec):
-                if verbose:print(i, spectrum)
-                for j, filtername in enumerate(self.phot.data_filters):
-                    if verbose:print(j, filtername)
-
-                    if hasattr(self.phot.data_filters[filtername], "_lower_edge") and \
-                      hasattr(self.phot.data_filters[filtername], "_upper_edge") and \
-                      hasattr(self.recon_spec[spectrum], "data"):
-                       blue_bool = self.phot.data_filters[filtername]._lower_edge > self.recon_spec[spectrum].min_wavelength
-                       red_bool = self.phot.data_filters[filtername]._upper_edge < self.recon_spec[spectrum].max_wavelength
-
-                       if blue_bool and red_bool:
-                            within = True
-                       else:
-                            within = False
-
-                    if verbose:print(within)
-                    if within:
-                        self.recon_spec[spectrum]._add_to_overlapping_filters(filtername)
+            self._check_overlaps(self.recon_spec, verbose=verbose)
         else:
-            warnings.warn("SNClass.check_sim_overlaps - something went wrong... no data?")
+            warnings.warn("SNClass.check_recon_overlaps - something went wrong... no data?")
         pass
 
 
@@ -3577,9 +4473,17 @@ class SNClass():
                 spec_list = self.spec
             if not filter_objects:
                 filter_objects = self.phot.data_filters
+            if not isinstance(filter_objects, FilterBankClass):
+                filter_objects = FilterBankClass(filter_objects, verbose=verbose)
 
+            flux, mask = filter_objects.get_batch_specphot([self.spec[spec] for spec in spec_list], verbose=verbose)
             for i, spec in enumerate(spec_list):
-                self.spec[spec].get_specphot(filter_objects=filter_objects, verbose=verbose)
+                ## the overlaps come from the same test as check_overlaps, so
+                ## fill in the list that BaseSpectrumClass.get_specphot would
+                if not hasattr(self.spec[spec], "_overlapping_filter_list"):
+                    self.spec[spec]._add_to_overlapping_filters(np.array(filter_objects.filter_names)[~mask[i]],
+                                                                verbose=verbose)
+                self.spec[spec]._set_specphot(filter_objects, flux[i])
 
         else:
             warnings.warn("object has no spectra")
@@ -3604,19 +4508,17 @@ class SNClass():
 
             if not filter_objects:
                 filter_objects = self.phot.data_filters
+            if not isinstance(filter_objects, FilterBankClass):
+                filter_objects = FilterBankClass(filter_objects, verbose=verbose)
 
+            ## all the spectra through all the filters at once, dropping the filters that don't overlap
+            flux, mask = filter_objects.get_batch_specphot([self.sim_spec[spec] for spec in spec_list], verbose=verbose)
             for i, spec in enumerate(spec_list):
-                valid_filter_objects = dict(filter_objects)
-
-                for filter_name in filter_objects.keys():
-                    if filter_name not in self.sim_spec[spec]._overlapping_filter_list:
-                        if verbose: print("No overlap. removing ", filter_name)
-                        valid_filter_objects.pop(filter_name, None)
-
-                self.sim_spec[spec].get_specphot(filter_objects=valid_filter_objects, verbose=verbose)
+                if verbose: print("No overlap. removing ", np.array(filter_objects.filter_names)[mask[i]])
+                self.sim_spec[spec]._set_specphot(filter_objects, flux[i], mask[i])
 
             ## Stack all specphot
-            specphot = Table(names=("MJD", "flux", "flux_err", "filter"), dtype=('f', 'f', 'f', 'S'))
+            specphot_tables = [Table(names=("MJD", "flux", "flux_err", "filter"), dtype=('f', 'f', 'f', 'S'))]
             for i, spec in enumerate(self.sim_spec):
 
                 mjd = np.ones(len(self.sim_spec[spec].specphot["flux"])) * float(spec.split("_")[-1])
@@ -3624,7 +4526,8 @@ class SNClass():
                 this_spec_table = Table(
                     [mjd, self.sim_spec[spec].specphot["flux"], flux_err, self.sim_spec[spec].specphot["filter"]],
                     names=("MJD", "flux", "flux_err", "filter"))
-                specphot = vstack([specphot, this_spec_table])
+                specphot_tables.append(this_spec_table)
+            specphot = vstack(specphot_tables)
 
             specphot["flux_err"] = np.ones(len(specphot["flux"]))*err_size*np.nanmax(specphot["flux"])
 
@@ -3654,25 +4557,24 @@ class SNClass():
 
             if not filter_objects:
                 filter_objects = self.phot.data_filters
+            if not isinstance(filter_objects, FilterBankClass):
+                filter_objects = FilterBankClass(filter_objects, verbose=verbose)
 
+            ## all the spectra through all the filters at once, dropping the filters that don't overlap
+            flux, mask = filter_objects.get_batch_specphot([self.recon_spec[spec] for spec in spec_list], verbose=verbose)
             for i, spec in enumerate(spec_list):
-                valid_filter_objects = dict(filter_objects)
-
-                for filter_name in filter_objects.keys():
-                    if filter_name not in self.recon_spec[spec]._overlapping_filter_list:
-                        if verbose: print("No overlap. removing ", filter_name)
-                        valid_filter_objects.pop(filter_name, None)
-
-                self.recon_spec[spec].get_specphot(filter_objects=valid_filter_objects, verbose=verbose)
+                if verbose: print("No overlap. removing ", np.array(filter_objects.filter_names)[mask[i]])
+                self.recon_spec[spec]._set_specphot(filter_objects, flux[i], mask[i])
 
             ## Stack all specphot
-            specphot = Table(names=("MJD", "flux", "flux_err", "filter"), dtype=('f', 'f', 'f', 'S'))
+            specphot_tables = [Table(names=("MJD", "flux", "flux_err", "filter"), dtype=('f', 'f', 'f', 'S'))]
             for i, spec in enumerate(self.recon_spec):
                 mjd = np.ones(len(self.recon_spec[spec].specphot["flux"])) * float(spec.split("_")[-1])
                 flux_err = np.zeros(len(self.recon_spec[spec].specphot["flux"]))
                 this_spec_table = Table([mjd, self.recon_spec[spec].specphot["flux"], flux_err, self.recon_spec[spec].specphot["filter"]],
                                         names=("MJD", "flux", "flux_err", "filter"))
-                specphot = vstack([specphot, this_spec_table])
+                specphot_tables.append(this_spec_table)
+            specphot = vstack(specphot_tables)
 
             specphot["flux_err"] = np.ones(len(specphot["flux"]))*err_size*np.nanmax(specphot["flux"])
 
@@ -3726,54 +4628,1078 @@ class InfoClass():
         return self.table[w]
 
 
+class FilterRegistryClass():
+    """
+    Process-wide cache of initialised FilterClass objects.
 
-#  #----------------------------------------------------------------------------#  #
-#  #  /CODE                                                                     #  #
-#  #----------------------------------------------------------------------------#  #
-
-## FUNCTIONS THAT ITS A PAIN TO SHIFT
-
-def find_specphase_spec(snname, dir_path = defaults._default_specphase_dir_path, file_type = ".spec",
-                        verbose = False):
+    Filters are keyed by (filter_name, absolute path) and re-read only if the
+    modification time of the file has changed since it was last loaded, so the
+    same bandpass is parsed (and has its zeropoint calculated) once per process.
+    The objects handed out are shared - don't edit them in place.
     """
 
-    Parameters
-    ----------
+    def __init__(self):
+        self._filters = OrderedDict()
+        self._mtimes = OrderedDict()
+        self._paths = OrderedDict()
 
-    Returns
-    -------
-    """
-    if verbose: print(dir_path)
-    errors.StringWarning(dir_path)
-    errors.StringWarning(snname)
-    if type(snname) is not str and type(snname) is not np.string_:
-        raise(errors.PathError)
 
-    if not utils.check_dir_path(dir_path):
-        print("utils.check_dir_path failed")
-        return False
+    def __len__(self):
+        return len(self._filters)
 
-    try:
-        ls = np.array(os.listdir(dir_path))
 
-        # wspec = np.where(np.char.find(ls, file_type, start = -len(file_type)) > -1)
-        # spec_list = ls[wspec]
-        spec_list = [i for i in ls if i[-5:] == ".spec"]
-        ## The last 18 chars are for the MJD and file_type
-        # wsn = np.where([i[:-18] == snname for i in spec_list])
-        # snmatch_list = spec_list[wsn]
-        snmatch_list = [i for i in spec_list if i[:len(snname)] == snname ]
+    def __contains__(self, filter_name):
+        return filter_name in self._paths
 
-        if verbose:
-            print("Found: ")
-            print(ls)
-            print("Spec:")
-            print(spec_list)
-            print("Matched:")
-            print(snmatch_list)
-        if len(snmatch_list) is 0:
-            warnings.warn("No matches found.")
-        return snmatch_list
+
+    def get_filter(self, path, verbose=False):
+        """
+        Returns the shared FilterClass for the filter file at `path`, reading
+        it in (and registering it) if it hasn't been seen or has changed on disk.
+
+        :param path:
+        :param verbose:
+        :return:
+        """
+        path = os.path.abspath(path)
+        utils.check_file_path(path)
+
+        filter_name = path.split('/')[-1].split('.')[0]
+        key = (filter_name, path)
+        mtime = os.path.getmtime(path)
+
+        if key in self._filters and self._mtimes[key] == mtime:
+            if verbose: print("found", filter_name, "in the filter registry")
+            return self._filters[key]
+
+        if verbose: print("reading", path, "into the filter registry")
+        filter_object = FilterClass()
+        filter_object.read_filter_file(path, verbose=verbose)
+        ## read_filter_file leaves the response sampled on the AB grid - hand out the native one
+        filter_object.revert(verbose=verbose)
+
+        self._filters[key] = filter_object
+        self._mtimes[key] = mtime
+        self._paths[filter_name] = path
+
+        return filter_object
+
+
+    def get_filter_by_name(self, filter_name, filter_dir=False, file_type=".dat", verbose=False):
+        """
+        Looks `filter_name` up in `filter_dir` ($PYCOCO_FILTER_DIR by default)
+        and returns the shared FilterClass.
+
+        :param filter_name:
+        :param filter_dir:
+        :param file_type:
+        :param verbose:
+        :return:
+        """
+        if not filter_dir:
+            filter_dir = utils._get_filter_directory()
+
+        return self.get_filter(os.path.join(filter_dir, filter_name + file_type), verbose=verbose)
+
+
+    def clear(self):
+        """
+        Empties the registry - the next request for each filter re-reads it from disk.
+        """
+        self._filters.clear()
+        self._mtimes.clear()
+        self._paths.clear()
+        pass
+
+
+class FilterBankClass():
+    """
+    A set of filters held as one 2D array of throughputs (filter x wavelength)
+    on a shared wavelength grid - by default 1A steps from 1500A to 25000A.
+
+    The effective wavelengths, areas, edges and zeropoints of every filter
+    are calculated in one go, and get_specphot integrates a spectrum through
+    all of the filters at once rather than looping over them.
+
+    Effective wavelengths and edges come from the shared grid, so can differ
+    slightly from the FilterClass values for coarsely sampled filters. Areas
+    and zeropoints are calculated on the AB pseudospectrum grid, as they are
+    for FilterClass, and match them.
+    """
+
+    def __init__(self, filters = False, wavelength = False, verbose = False):
+        self._throughput_cache = OrderedDict()
+
+        if filters:
+            self.load_filters(filters, wavelength = wavelength, verbose = verbose)
+
+
+    def __len__(self):
+        if hasattr(self, "filter_names"):
+            return len(self.filter_names)
+        return 0
+
+
+    def __contains__(self, filter_name):
+        return hasattr(self, "filter_names") and filter_name in self.filter_names
+
+
+    def index(self, filter_name):
+        """
+        Row of self.throughput belonging to `filter_name`.
+        """
+        return self.filter_names.index(filter_name)
+
+
+    def load_filters(self, filters, wavelength = False, verbose = False):
+        """
+        Builds the bank.
+
+        Parameters
+        ----------
+        filters : a dict of FilterClass (e.g. sn.phot.data_filters), a list of
+            FilterClass or filter names (looked up in the filter registry), or
+            the path to a directory of filter files, all of which are used.
+
+        wavelength : the shared grid, in Angstroms.
+
+        Returns
+        -------
+        """
+        if isinstance(filters, str):
+            filter_dir = filters
+            filters = []
+            for filter_file in sorted(utils._get_filters(filter_dir)):
+                try:
+                    filters.append(get_filter(os.path.join(filter_dir, filter_file), verbose = verbose))
+                except Exception:
+                    warnings.warn("Couldn't read " + filter_file + ", leaving it out of the bank")
+        elif isinstance(filters, dict):
+            filters = list(filters.values())
+        elif isinstance(filters, FilterClass):
+            filters = [filters, ]
+
+        filters = [filter_object if isinstance(filter_object, BaseFilterClass)
+                   else get_filter(filter_name = filter_object, verbose = verbose)
+                   for filter_object in filters]
+
+        if wavelength is False:
+            wavelength = np.arange(1500., 25001., 1.)
+
+        self.filters = OrderedDict([(filter_object.filter_name, filter_object) for filter_object in filters])
+        self.filter_names = list(self.filters.keys())
+        self.wavelength = np.asarray(getattr(wavelength, "value", wavelength), dtype = np.float64)
+        self.throughput = self._stack_throughput(self.wavelength, verbose = verbose)
+        self._throughput_cache.clear()
+
+        ## the filters' own edges, for deciding which spectra they are within
+        ## in the same way as the check_overlaps methods do
+        self._filter_edges = np.array([[float(filter_object._lower_edge), float(filter_object._upper_edge)]
+                                       for filter_object in self.filters.values()]).reshape(-1, 2)
+
+        ## resampling ramps the response down to zero at 1 and 24999A - ignore
+        ## that when working out where each filter actually is
+        self._native_range = np.empty((len(self), 2))
+        for i, filter_object in enumerate(self.filters.values()):
+            if hasattr(filter_object, "_wavelength_orig"):
+                native_wavelength = filter_object._wavelength_orig
+            else:
+                native_wavelength = filter_object.wavelength
+            native_wavelength = np.asarray(getattr(native_wavelength, "value", native_wavelength))
+            self._native_range[i] = np.nanmin(native_wavelength), np.nanmax(native_wavelength)
+
+        self.calculate_support()
+        self.calculate_effective_wavelength()
+        self.calculate_filter_area()
+        self.calculate_edges()
+        self.get_zeropoint()
+        pass
+
+
+    def _stack_throughput(self, wavelength, exact = False, verbose = False):
+        """
+        Throughputs of all the filters on `wavelength`, as an (n_filters, n_wavelength)
+        array - or their exact integration weights (see BaseFilterClass.get_exact_weights).
+        """
+        throughput = np.empty((len(self.filter_names), len(wavelength)))
+        for i, filter_object in enumerate(self.filters.values()):
+            if exact:
+                throughput[i] = filter_object.get_exact_weights(wavelength, verbose = verbose)
+            else:
+                throughput[i] = filter_object.get_resampled_throughput(wavelength, verbose = verbose)
+        return throughput
+
+
+    def get_throughput(self, wavelength, verbose = False):
+        """
+        Returns the (n_filters, n_wavelength) throughput array of the bank on
+        `wavelength`. Arrays for grids other than the bank's own are kept for the
+        last defaults._resampled_throughput_cache_size grids, and are read-only.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        return self._get_cached_array(wavelength, kind = "throughput", verbose = verbose)
+
+
+    def get_weighted_throughput(self, wavelength, verbose = False):
+        """
+        Returns get_throughput(wavelength) times the Simpson's rule weights of
+        `wavelength` (see utils.calc_quadrature_weights), so that the integral of
+        a spectrum on that grid through each filter is a dot product. Cached in
+        the same way as get_throughput.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        return self._get_cached_array(wavelength, kind = "weighted", verbose = verbose)
+
+
+    def get_exact_weights(self, wavelength, verbose = False):
+        """
+        Returns the (n_filters, n_wavelength) array of exact integration weights
+        of the bank on `wavelength` (see BaseFilterClass.get_exact_weights),
+        cached in the same way as get_throughput.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        return self._get_cached_array(wavelength, kind = "exact", verbose = verbose)
+
+
+    def _get_cached_array(self, wavelength, kind = "throughput", verbose = False):
+        """
+        Does the work for get_throughput, get_weighted_throughput and
+        get_exact_weights.
+        """
+        wavelength = np.ascontiguousarray(getattr(wavelength, "value", wavelength), dtype = np.float64)
+
+        if kind == "throughput" and np.array_equal(wavelength, self.wavelength):
+            return self.throughput
+
+        key = (kind, wavelength.shape, hashlib.md5(wavelength.tobytes()).hexdigest())
+        if key in self._throughput_cache:
+            self._throughput_cache.move_to_end(key)
+            return self._throughput_cache[key]
+
+        if kind == "weighted":
+            throughput = self.get_throughput(wavelength, verbose = verbose) * utils.calc_quadrature_weights(wavelength)
+        else:
+            throughput = self._stack_throughput(wavelength, exact = kind == "exact", verbose = verbose)
+        throughput.setflags(write = False)
+
+        self._throughput_cache[key] = throughput
+        while len(self._throughput_cache) > defaults._resampled_throughput_cache_size:
+            self._throughput_cache.popitem(last = False)
+
+        return throughput
+
+
+    def calculate_support(self):
+        """
+        Finds the range of the shared grid each filter is non-zero over, stored
+        as self.support - (first, last + 1) indices, one row per filter.
+        """
+        nonzero = self.throughput > 0.0
+        first = np.argmax(nonzero, axis = 1)
+        last = self.throughput.shape[1] - np.argmax(nonzero[:, ::-1], axis = 1)
+        last[~nonzero.any(axis = 1)] = 0
+
+        self.support = np.column_stack((first, last))
+        pass
+
+
+    def _native_throughput(self):
+        """
+        self.throughput, zeroed outside the wavelength range of each filter file.
+        """
+        in_range = np.logical_and(self.wavelength >= self._native_range[:, 0][:, np.newaxis],
+                                  self.wavelength <= self._native_range[:, 1][:, np.newaxis])
+        return np.where(in_range, self.throughput, 0.0)
+
+
+    def _invert_cumulative(self, cumulative, value):
+        """
+        Wavelength at which each row of `cumulative` reaches `value`,
+        interpolating linearly as interp1d does in the FilterClass methods.
+        """
+        rows = np.arange(cumulative.shape[0])
+        upper = np.clip(np.sum(cumulative < value, axis = 1), 1, cumulative.shape[1] - 1)
+        lower = upper - 1
+
+        c_lower = cumulative[rows, lower]
+        c_upper = cumulative[rows, upper]
+        w_lower = self.wavelength[lower]
+        w_upper = self.wavelength[upper]
+
+        return w_lower + (value - c_lower) * (w_upper - w_lower) / (c_upper - c_lower)
+
+
+    def calculate_effective_wavelength(self):
+        """
+        Vectorised FilterClass.calculate_effective_wavelength, on the shared grid.
+        """
+        weighted = np.cumsum(self.wavelength * self._native_throughput(), axis = 1)
+        cumulative = weighted / weighted[:, -1][:, np.newaxis]
+
+        self.lambda_effective = self._invert_cumulative(cumulative, 0.5) * u.angstrom
+        pass
+
+
+    def calculate_filter_area(self, abpath = os.path.join(defaults._default_kcorr_data_path, "AB_pseudospectrum.dat")):
+        """
+        Vectorised FilterClass.calculate_filter_area. Like FilterClass._effective_area,
+        this is the area on the grid of the AB pseudospectrum.
+        """
+        wavelength = get_reference_spectrum(abpath).wavelength
+
+        area = np.sum(self.get_weighted_throughput(wavelength), axis = 1)
+
+        w = np.isnan(area) ## See Issue #26 on GitHub
+        if w.any():
+            area[w] = trapz(self.get_throughput(wavelength)[w], wavelength, axis = 1)
+
+        self.area = area
+        pass
+
+
+    def calculate_edges(self, pc = 3.):
+        """
+        Vectorised FilterClass.calculate_edges, on the shared grid.
+        """
+        cumulative = np.cumsum(self._native_throughput(), axis = 1)
+        cumulative = cumulative / cumulative[:, -1][:, np.newaxis]
+
+        self.upper_edge = self._invert_cumulative(cumulative, 1.0 - 0.5*(0.01*pc))
+        self.lower_edge = self._invert_cumulative(cumulative, 0.0 + 0.5*(0.01*pc))
+        pass
+
+
+    def get_zeropoint(self, abpath = os.path.join(defaults._default_kcorr_data_path, "AB_pseudospectrum.dat")):
+        """
+        AB zeropoints for every filter in the bank, as self.zp_AB.
+        """
+        AB = get_reference_spectrum(abpath)
+
+        self.zp_AB = -2.5 * np.log10(self.get_specphot(AB))
+        pass
+
+
+    def get_specphot(self, spectrum, correct_for_area = True, exact = False, verbose = False):
+        """
+        Integrates `spectrum` through every filter in the bank at once, on the
+        spectrum's own wavelength grid.
+
+        Parameters
+        ----------
+        spectrum : a SpectrumClass (or anything with wavelength and flux).
+
+        correct_for_area : divide by the area of each filter, as
+            BaseSpectrumClass.get_specphot does.
+
+        exact : integrate the product of the linearly interpolated spectrum and
+            filter exactly, rather than resampling the filters and using
+            Simpson's rule. The area is then the exact filter area within the
+            spectrum (see BaseFilterClass.get_exact_weights).
+
+        Returns
+        -------
+        numpy array of fluxes, one per filter, in the order of self.filter_names.
+        """
+        wavelength = np.asarray(getattr(spectrum.wavelength, "value", spectrum.wavelength), dtype = np.float64)
+        flux = np.asarray(getattr(spectrum.flux, "value", spectrum.flux), dtype = np.float64)
+
+        if exact:
+            weights = self.get_exact_weights(wavelength, verbose = verbose)
+            integrated_flux = np.dot(weights, flux)
+            area = np.sum(weights, axis = 1)
+        else:
+            integrated_flux = self._integrate(wavelength, np.atleast_2d(flux), verbose = verbose)[0]
+            area = self.area
+
+        if correct_for_area:
+            integrated_flux = integrated_flux / area
+
+        if verbose: print("flux in filters", self.filter_names, " is ", integrated_flux)
+        return integrated_flux
+
+
+    def _integrate(self, wavelength, flux, verbose = False):
+        """
+        Simpson's rule integral of each row of `flux` times each filter, over
+        just the part of `wavelength` each filter is non-zero in (see
+        BaseFilterClass.get_support_slice) - a dot product with the weighted
+        throughput. Returns (n_spectra, n_filters).
+        """
+        weighted = self.get_weighted_throughput(wavelength, verbose = verbose)
+
+        integrated_flux = np.empty((flux.shape[0], len(self)))
+        for j, filter_object in enumerate(self.filters.values()):
+            support = filter_object.get_support_slice(wavelength)
+            integrated_flux[:, j] = np.dot(flux[:, support], weighted[j, support])
+
+        return integrated_flux
+
+
+    def get_batch_specphot(self, spectra, wavelength = False, correct_for_area = True, exact = False,
+                           verbose = False):
+        """
+        Synthetic photometry of many spectra through every filter in the bank.
+
+        Spectra that share a wavelength grid are stacked and integrated
+        together, so the cost is one vectorised integral per filter per grid
+        rather than per filter per spectrum.
+
+        Parameters
+        ----------
+        spectra : a list or dict of SpectrumClass (which can be on different
+            grids), or a 2D (n_spectra, n_wavelength) array of fluxes on the
+            common grid `wavelength`.
+
+        wavelength : the grid of `spectra`, only needed if it is an array.
+
+        correct_for_area : divide by the area of each filter, as
+            BaseSpectrumClass.get_specphot does.
+
+        exact : see get_specphot.
+
+        Returns
+        -------
+        flux : (n_spectra, n_filters) array, columns in the order of
+            self.filter_names.
+
+        mask : (n_spectra, n_filters) boolean array, True where the filter
+            isn't within the spectrum (the same test as check_overlaps).
+        """
+        if isinstance(spectra, dict):
+            spectra = list(spectra.values())
+
+        if isinstance(spectra, np.ndarray):
+            wavelength = np.asarray(getattr(wavelength, "value", wavelength), dtype = np.float64)
+            grids = [wavelength]
+            groups = [np.arange(spectra.shape[0])]
+            fluxes = [np.atleast_2d(spectra).astype(np.float64)]
+            limits = np.tile([np.nanmin(wavelength), np.nanmax(wavelength)], (spectra.shape[0], 1))
+        else:
+            grouped = utils.group_by_grid([spectrum.wavelength for spectrum in spectra])
+            grids = [grid for grid, group in grouped]
+            groups = [group for grid, group in grouped]
+            fluxes = [np.vstack([np.asarray(getattr(spectra[i].flux, "value", spectra[i].flux), dtype = np.float64)
+                                 for i in group]) for group in groups]
+
+            limits = np.empty((len(spectra), 2))
+            for grid, group in zip(grids, groups):
+                for i in group:
+                    if hasattr(spectra[i], "min_wavelength") and hasattr(spectra[i], "max_wavelength"):
+                        limits[i] = spectra[i].min_wavelength, spectra[i].max_wavelength
+                    else:
+                        limits[i] = np.nanmin(grid), np.nanmax(grid)
+
+        if verbose: print(len(limits), "spectra on", len(grids), "wavelength grids")
+
+        integrated_flux = np.empty((len(limits), len(self)))
+        area = np.empty((len(limits), len(self)))
+        for grid, group, flux in zip(grids, groups, fluxes):
+            if exact:
+                weights = self.get_exact_weights(grid, verbose = verbose)
+                integrated_flux[group] = np.dot(flux, weights.T)
+                area[group] = np.sum(weights, axis = 1)
+            else:
+                integrated_flux[group] = self._integrate(grid, flux, verbose = verbose)
+                area[group] = self.area
+
+        if correct_for_area:
+            integrated_flux = integrated_flux / area
+
+        mask = np.logical_not(utils.calc_overlap_matrix(limits, self._filter_edges))
+
+        return integrated_flux, mask
+
+
+
+class SpectrumStackClass():
+    """
+    Many spectra rebinned onto one shared wavelength grid - evenly spaced in
+    wavelength or in log-wavelength - held as a 2D array of flux (spectrum x
+    wavelength) with a mask of where each spectrum covers the grid, so that
+    specphot, dereddening and scaling of a whole SN or template library are
+    array operations rather than loops over spectra.
+
+    The rebinning is flux conserving (see utils.rebin_flux), and flux is NaN
+    wherever a spectrum doesn't cover the grid.
+    """
+
+    def __init__(self, spectra = False, wavelength = False, log = False, verbose = False):
+        if spectra:
+            self.load_spectra(spectra, wavelength = wavelength, log = log, verbose = verbose)
+
+
+    def __len__(self):
+        if hasattr(self, "names"):
+            return len(self.names)
+        return 0
+
+
+    def index(self, name):
+        """
+        Row of self.flux belonging to the spectrum `name`.
+        """
+        return self.names.index(name)
+
+
+    def make_grid(self, spectra, log = False, verbose = False):
+        """
+        A grid spanning all of `spectra`, with the median of their median
+        steps - in wavelength, or in log-wavelength if log = True.
+
+        Parameters
+        ----------
+        spectra : a list of SpectrumClass.
+
+        Returns
+        -------
+        wavelength : array, in Angstroms.
+        """
+        wavelengths = [np.asarray(spectrum.wavelength, dtype = np.float64) for spectrum in spectra]
+        wmin = np.nanmin([np.nanmin(wavelength) for wavelength in wavelengths])
+        wmax = np.nanmax([np.nanmax(wavelength) for wavelength in wavelengths])
+
+        if log:
+            step = np.median([np.median(np.diff(np.log(wavelength))) for wavelength in wavelengths])
+            wavelength = np.exp(np.arange(np.log(wmin), np.log(wmax) + 0.5*step, step))
+        else:
+            step = np.median([np.median(np.diff(wavelength)) for wavelength in wavelengths])
+            wavelength = np.arange(wmin, wmax + 0.5*step, step)
+
+        if verbose: print("grid of", len(wavelength), "points from", wmin, "to", wmax)
+        return wavelength
+
+
+    def load_spectra(self, spectra, wavelength = False, log = False, verbose = False):
+        """
+        Rebins `spectra` onto the shared grid. Spectra already sharing a grid
+        are rebinned together.
+
+        Parameters
+        ----------
+        spectra : a dict of SpectrumClass (e.g. sn.spec), whose keys are used
+            as self.names, or a list of them, named by filename.
+
+        wavelength : the shared grid, in Angstroms. If not given, see make_grid.
+
+        log : if making the grid, space it evenly in log-wavelength.
+
+        Returns
+        -------
+        """
+        if isinstance(spectra, dict):
+            names = list(spectra.keys())
+            spectra = list(spectra.values())
+        else:
+            spectra = list(spectra)
+            names = [spectrum.data.meta.get("filename", i) if hasattr(spectrum, "data") else i
+                     for i, spectrum in enumerate(spectra)]
+
+        if wavelength is False:
+            wavelength = self.make_grid(spectra, log = log, verbose = verbose)
+
+        self.names = names
+        self.wavelength = np.ascontiguousarray(getattr(wavelength, "value", wavelength), dtype = np.float64)
+        self.flux = np.full((len(spectra), len(self.wavelength)), np.nan)
+        self.mask = np.zeros((len(spectra), len(self.wavelength)), dtype = bool)
+
+        grids = utils.group_by_grid([spectrum.wavelength for spectrum in spectra])
+
+        if verbose: print(len(spectra), "spectra on", len(grids), "wavelength grids")
+
+        for spectrum_wavelength, rows in grids:
+            flux = np.vstack([spectra[i].flux for i in rows])
+            self.flux[rows], self.mask[rows] = utils.rebin_flux(spectrum_wavelength, flux, self.wavelength)
+
+        self.limits = self._get_limits()
+        pass
+
+
+    def _get_limits(self):
+        """
+        (n_spectra, 2) array of the first and last covered grid wavelength of
+        each spectrum - NaN if there aren't any.
+        """
+        covered = self.mask.any(axis = 1)
+        first = np.argmax(self.mask, axis = 1)
+        last = self.mask.shape[1] - 1 - np.argmax(self.mask[:, ::-1], axis = 1)
+
+        limits = np.column_stack((self.wavelength[first], self.wavelength[last]))
+        limits[~covered] = np.nan
+        return limits
+
+
+    def get_specphot(self, filters, correct_for_area = True, exact = False, verbose = False):
+        """
+        Synthetic photometry of every spectrum in the stack through every
+        filter (see FilterBankClass.get_batch_specphot), on the shared grid.
+
+        Parameters
+        ----------
+        filters : a FilterBankClass, or anything FilterBankClass.load_filters
+            takes.
+
+        Returns
+        -------
+        flux : (n_spectra, n_filters) array, columns in the order of the
+            bank's filter_names.
+
+        mask : (n_spectra, n_filters) boolean array, True where the filter
+            isn't within the part of the grid the spectrum covers.
+        """
+        if not isinstance(filters, FilterBankClass):
+            filters = FilterBankClass(filters, verbose = verbose)
+
+        flux, _ = filters.get_batch_specphot(np.where(self.mask, self.flux, 0.), wavelength = self.wavelength,
+                                             correct_for_area = correct_for_area, exact = exact, verbose = verbose)
+        mask = np.logical_not(utils.calc_overlap_matrix(self.limits, filters._filter_edges))
+
+        return flux, mask
+
+
+    def deredden(self, z, EBV_host, EBV_MW = False, verbose = False):
+        """
+        Dereddens every spectrum at once (see extinction.deredden), as
+        self.flux_dered.
+
+        Parameters
+        ----------
+        z : redshift
+
+        EBV_host : host E(B-V), a scalar or one per spectrum.
+
+        EBV_MW : Milky Way E(B-V), a scalar or one per spectrum.
+
+        Returns
+        -------
+        """
+        self.flux_dered = extinction.deredden(self.wavelength, self.flux, z, EBV_MW = EBV_MW, EBV_host = EBV_host)
+        if verbose: print("dereddened", len(self), "spectra")
+        pass
+
+
+    def scale(self, factor):
+        """
+        Multiplies the flux by `factor` - a scalar, or one per spectrum.
+        """
+        self.flux = self.flux * np.reshape(factor, (-1, 1))
+        pass
+
+
+    def get_spectrum(self, key, verbose = False):
+        """
+        The covered part of the spectrum `key` - a row number or one of
+        self.names - as a SpectrumClass (see BaseSpectrumClass.load_arrays).
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        i = self.index(key) if key in self.names else key
+
+        S = SpectrumClass()
+        S.load_arrays(self.wavelength[self.mask[i]], self.flux[i][self.mask[i]],
+                      spectrum_name = str(self.names[i]), verbose = verbose)
+        return S
+
+
+
+def get_spectrum_archive_index_path(path):
+    """
+    Path of the index of the SpectrumArchiveClass file at `path`.
+    """
+    return path + ".index"
+
+
+class SpectrumArchiveClass():
+    """
+    Many spectra packed into one flat file of float64s (written by
+    functions.make_spectrum_archive), with an index of where each one is.
+
+    The file is memory-mapped read-only, and get_spectrum wraps the slices
+    belonging to a spectrum in a SpectrumClass without copying them - so
+    processes working on the same archive share one page-cached copy rather
+    than each parsing and holding their own.
+
+    Each spectrum is stored as its wavelengths followed by its fluxes, as
+    BaseSpectrumClass.load would leave them (trimmed, Angstrom and
+    erg/s/cm^2/A) - any flux_err column isn't kept. The index (path + ".index") has a row per spectrum, with
+    columns snname, mjd_obs (NaN where unknown), filename, kind ("spec",
+    "recon" or "specphase"), offset and length.
+    """
+
+    def __init__(self, path = False, verbose = False):
+        if path:
+            self.load(path, verbose = verbose)
+
+
+    def __len__(self):
+        if hasattr(self, "index"):
+            return len(self.index)
+        return 0
+
+
+    def load(self, path, verbose = False):
+        """
+        Maps the archive at `path` and reads its index.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        utils.check_file_path(path)
+        utils.check_file_path(get_spectrum_archive_index_path(path))
+
+        self.path = os.path.abspath(path)
+        self.index = Table.read(get_spectrum_archive_index_path(path), format = "ascii.commented_header")
+        if verbose: print("Read index of", len(self.index), "spectra")
+
+        if os.path.getsize(path) > 0:
+            self.data = np.memmap(path, dtype = "<f8", mode = "r")
+        else:
+            self.data = np.zeros(0, dtype = "<f8")
+        pass
+
+
+    def _get_row(self, key, kind = False):
+        """
+        Index of the row for `key` - an int, or a filename (the first match, of
+        `kind` if given).
+        """
+        if isinstance(key, (int, np.integer)):
+            return int(key)
+
+        w = np.where(self.index["filename"] == key)[0]
+        if kind:
+            w = w[self.index["kind"][w] == kind]
+        if len(w) == 0:
+            raise errors.CustomValueError(str(key) + " isn't in " + self.path)
+        return w[0]
+
+
+    def get_arrays(self, key, kind = False):
+        """
+        Returns (wavelength, flux) for the spectrum `key` (see get_spectrum)
+        as read-only views of the archive.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        row = self.index[self._get_row(key, kind = kind)]
+        offset, length = int(row["offset"]), int(row["length"])
+
+        return self.data[offset:offset + length], self.data[offset + length:offset + 2 * length]
+
+
+    def get_spectrum(self, key, kind = False, verbose = False):
+        """
+        Returns the spectrum `key` - a row number of self.index or a filename -
+        as a SpectrumClass wrapping the archive (see BaseSpectrumClass.load_arrays).
+        The arrays are read-only.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        i = self._get_row(key, kind = kind)
+        row = self.index[i]
+        wavelength, flux = self.get_arrays(i)
+
+        S = SpectrumClass()
+        S.load_arrays(wavelength, flux, path = str(row["filename"]), verbose = verbose)
+        S.set_infile(str(row["filename"]))
+        if np.isfinite(row["mjd_obs"]):
+            S.set_MJD_obs(row["mjd_obs"])
+
+        return S
+
+
+    def get_spectra(self, snname = False, kind = False, verbose = False):
+        """
+        OrderedDict of filename: SpectrumClass (see get_spectrum) for every
+        spectrum of `snname` and/or `kind` in the archive, in index order.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        w = np.ones(len(self.index), dtype = bool)
+        if snname:
+            w &= self.index["snname"] == snname
+        if kind:
+            w &= self.index["kind"] == kind
+
+        spectra = OrderedDict()
+        for i in np.where(w)[0]:
+            spectra[str(self.index["filename"][i])] = self.get_spectrum(int(i), verbose = verbose)
+
+        return spectra
+
+
+class PhotometryStoreClass():
+    """
+    Photometry of many SNe in one columnar store (written by
+    functions.make_phot_store) - a directory with a .npy file per column
+    (snname, filter, MJD, flux, flux_err), the rows sorted by (snname,
+    filter, MJD), plus indices of where each SN starts, and of the rows in
+    (filter, snname, MJD) and MJD order.
+
+    The columns are memory-mapped read-only, and the rows of a SN, a filter
+    across all SNe or an MJD window are found by binary search on the sorted
+    columns and indices - so a query only reads the rows it returns, rather
+    than parsing every light curve.
+    """
+
+    def __init__(self, path = False, verbose = False):
+        if path:
+            self.load(path, verbose = verbose)
+
+
+    def __len__(self):
+        if hasattr(self, "columns"):
+            return len(self.columns["MJD"])
+        return 0
+
+
+    def load(self, path, verbose = False):
+        """
+        Maps the store in the directory `path`.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        utils.check_dir_path(path)
+
+        self.path = os.path.abspath(path)
+        self.columns = OrderedDict((name, np.load(os.path.join(path, name + ".npy"), mmap_mode = "r"))
+                                   for name in _phot_store_columns)
+        self.snnames = np.load(os.path.join(path, "snnames.npy"))
+        self.sn_starts = np.load(os.path.join(path, "sn_starts.npy"))
+        self.filter_names = np.load(os.path.join(path, "filter_names.npy"))
+        self.filter_starts = np.load(os.path.join(path, "filter_starts.npy"))
+        self.filter_order = np.load(os.path.join(path, "filter_order.npy"), mmap_mode = "r")
+        self.mjd_order = np.load(os.path.join(path, "mjd_order.npy"), mmap_mode = "r")
+        self.mjd_sorted = np.load(os.path.join(path, "mjd_sorted.npy"), mmap_mode = "r")
+
+        if verbose: print("Mapped", len(self), "points of", len(self.snnames), "SNe in", len(self.filter_names), "filters")
+        pass
+
+
+    def _get_group(self, names, starts, name):
+        """
+        (start, stop) of the group `name` in the sorted `names`, with
+        `starts` one longer than names - (0, 0) if it isn't there.
+        """
+        i = np.searchsorted(names, name)
+        if i < len(names) and names[i] == name:
+            return int(starts[i]), int(starts[i + 1])
+        return 0, 0
+
+
+    def get_rows(self, snname = False, filter_name = False, mjd_min = False, mjd_max = False):
+        """
+        Rows of the store (in store order) for `snname` and/or `filter_name`,
+        between mjd_min and mjd_max - any of which can be left out.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        numpy array of row numbers.
+        """
+        lower = -np.inf if mjd_min is False else mjd_min
+        upper = np.inf if mjd_max is False else mjd_max
+
+        if snname:
+            start, stop = self._get_group(self.snnames, self.sn_starts, snname)
+            if filter_name:
+                filters = self.columns["filter"][start:stop]
+                stop = start + np.searchsorted(filters, filter_name, side = "right")
+                start = start + np.searchsorted(filters, filter_name, side = "left")
+                mjd = self.columns["MJD"][start:stop]
+                return np.arange(start + np.searchsorted(mjd, lower, side = "left"),
+                                 start + np.searchsorted(mjd, upper, side = "right"))
+            rows = np.arange(start, stop)
+
+        elif filter_name:
+            start, stop = self._get_group(self.filter_names, self.filter_starts, filter_name)
+            rows = np.asarray(self.filter_order[start:stop])
+
+        else:
+            rows = np.sort(self.mjd_order[np.searchsorted(self.mjd_sorted, lower, side = "left"):
+                                          np.searchsorted(self.mjd_sorted, upper, side = "right")])
+            return rows
+
+        if mjd_min is not False or mjd_max is not False:
+            mjd = self.columns["MJD"][rows]
+            rows = rows[np.logical_and(mjd >= lower, mjd <= upper)]
+        return rows
+
+
+    def get_phot(self, snname = False, filter_name = False, mjd_min = False, mjd_max = False, verbose = False):
+        """
+        Table of the photometry matching the query (see get_rows), with the
+        columns and units of utils.load_formatted_phot, plus snname if the
+        query isn't for a single SN.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        rows = self.get_rows(snname = snname, filter_name = filter_name, mjd_min = mjd_min, mjd_max = mjd_max)
+        if verbose: print(len(rows), "points")
+
+        names = ("MJD", "flux", "flux_err", "filter")
+        if not snname:
+            names = ("snname",) + names
+
+        phot_table = Table([self.columns[name][rows] for name in names], names = names)
+        phot_table.meta = {"filename": self.path}
+
+        phot_table["MJD"].unit = u.day
+        phot_table["flux"].unit = u.cgs.erg / u.si.angstrom / u.si.cm ** 2 / u.si.s
+        phot_table["flux_err"].unit = phot_table["flux"].unit
+
+        return phot_table
+
+
+    def get_photometry(self, snname, filter_name = False, mjd_min = False, mjd_max = False, verbose = False):
+        """
+        PhotometryClass of the photometry of `snname` (see get_phot).
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        P = PhotometryClass()
+        P.load_table(self.get_phot(snname = snname, filter_name = filter_name, mjd_min = mjd_min,
+                                   mjd_max = mjd_max, verbose = verbose), verbose = verbose)
+        return P
+
+
+    def get_photometries(self, snnames = False, filter_name = False, mjd_min = False, mjd_max = False,
+                         verbose = False):
+        """
+        OrderedDict of snname: PhotometryClass (see get_photometry) for each of
+        `snnames` - every SN in the store if not given - that has any points
+        matching the query.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        """
+        if not snnames:
+            snnames = self.snnames
+
+        photometries = OrderedDict()
+        for snname in snnames:
+            phot_table = self.get_phot(snname = str(snname), filter_name = filter_name, mjd_min = mjd_min,
+                                       mjd_max = mjd_max, verbose = verbose)
+            if len(phot_table) > 0:
+                photometries[str(snname)] = PhotometryClass()
+                photometries[str(snname)].load_table(phot_table, verbose = verbose)
+
+        return photometries
+
+
+## the columns of a PhotometryStoreClass, each stored as name.npy
+_phot_store_columns = ("snname", "filter", "MJD", "flux", "flux_err")
+## and its indices, each also stored as name.npy
+_phot_store_index = ("snnames", "sn_starts", "filter_names", "filter_starts", "filter_order", "mjd_order",
+                     "mjd_sorted")
+
+
+#  #----------------------------------------------------------------------------#  #
+#  #  /CODE                                                                     #  #
+#  #----------------------------------------------------------------------------#  #
+
+## FUNCTIONS THAT ITS A PAIN TO SHIFT
+
+def _load_spectrum(filename, directory, verbose = False):
+    """
+    A SpectrumClass of `filename` in `directory` - for utils.map_ordered.
+    """
+    spectrum = SpectrumClass()
+    spectrum.load(filename, directory = directory, verbose = verbose)
+    return spectrum
+
+
+def find_specphase_spec(snname, dir_path = defaults._default_specphase_dir_path, file_type = ".spec",
+                        verbose = False):
+    """
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    """
+    if verbose: print(dir_path)
+    errors.StringWarning(dir_path)
+    errors.StringWarning(snname)
+    if type(snname) is not str and type(snname) is not np.string_:
+        raise(errors.PathError)
+
+    if not utils.check_dir_path(dir_path):
+        print("utils.check_dir_path failed")
+        return False
+
+    try:
+        ls = np.array(os.listdir(dir_path))
+
+        # wspec = np.where(np.char.find(ls, file_type, start = -len(file_type)) > -1)
+        # spec_list = ls[wspec]
+        spec_list = [i for i in ls if i[-5:] == ".spec"]
+        ## The last 18 chars are for the MJD and file_type
+        # wsn = np.where([i[:-18] == snname for i in spec_list])
+        # snmatch_list = spec_list[wsn]
+        snmatch_list = [i for i in spec_list if i[:len(snname)] == snname ]
+
+        if verbose:
+            print("Found: ")
+            print(ls)
+            print("Spec:")
+            print(spec_list)
+            print("Matched:")
+            print(snmatch_list)
+        if len(snmatch_list) is 0:
+            warnings.warn("No matches found.")
+        return snmatch_list
 
     except:
         warnings.warn("Something went wrong")
@@ -3847,3 +5773,62 @@ def find_filter_phot(path = defaults._default_data_dir_path, snname = False,
     if len(phot_list) is 0:
         warnings.warn("No matches found.")
     return phot_list
+
+
+_filter_registry = FilterRegistryClass()
+
+
+def get_filter(path=False, filter_name=False, filter_dir=False, file_type=".dat", verbose=False):
+    """
+    Returns a shared, initialised FilterClass from the process-wide filter
+    registry. Pass either the path to the filter file, or the filter name
+    (which is looked for in `filter_dir`, $PYCOCO_FILTER_DIR by default).
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    """
+    if path:
+        return _filter_registry.get_filter(path, verbose=verbose)
+    elif filter_name:
+        return _filter_registry.get_filter_by_name(filter_name, filter_dir=filter_dir, file_type=file_type,
+                                                   verbose=verbose)
+    else:
+        warnings.warn("Provide a path or a filter name")
+        return None
+
+
+def clear_filter_registry():
+    """
+    Empties the process-wide filter registry.
+    """
+    _filter_registry.clear()
+    pass
+
+
+_reference_spectra = OrderedDict()
+
+
+def get_reference_spectrum(path=os.path.join(defaults._default_kcorr_data_path, "AB_pseudospectrum.dat"),
+                           wmin=1500 * u.angstrom, wmax=25000 * u.angstrom, verbose=False):
+    """
+    Returns the shared, read-only ReferenceSpectrumClass for the spectrum at
+    `path` trimmed to wmin < wavelength < wmax. The file is only read the first
+    time a given (path, wmin, wmax) is asked for in this process.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    """
+    path = os.path.abspath(path)
+    key = (path, wmin.to(u.angstrom).value, wmax.to(u.angstrom).value)
+
+    if key not in _reference_spectra:
+        if verbose: print("reading reference spectrum", path)
+        _reference_spectra[key] = ReferenceSpectrumClass(path, wmin=wmin, wmax=wmax, verbose=verbose)
+
+    return _reference_spectra[key]
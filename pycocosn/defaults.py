@@ -22,7 +22,10 @@ __all__ = ["_default_data_dir_path",
            "_colour_lower_lambda_limit",
            "_default_info_path",
            "_default_kcorr_data_path",
-           "_default_lsst_throughputs_path"]
+           "_default_lsst_throughputs_path",
+           "_resampled_throughput_cache_size",
+           "_default_spectrum_cache_dir_path",
+           "_extinction_curve_cache_size"]
 
 ## Important variables
 
@@ -54,6 +57,12 @@ else:
 
 _default_dust_dir = os.path.abspath(SFD_DIR)
 
+## Binary copies of spectra read by BaseSpectrumClass.load go here - off unless set
+if "PYCOCO_SPEC_CACHE_DIR" in os.environ:
+    _default_spectrum_cache_dir_path = os.environ["PYCOCO_SPEC_CACHE_DIR"]
+else:
+    _default_spectrum_cache_dir_path = False
+
 # _colormap_name = 'jet'
 # _colourmap_name = 'rainbow'
 _spec_colourmap_name = 'viridis'
@@ -66,3 +75,9 @@ spec_colourmap = plt.get_cmap(_spec_colourmap_name)
 
 _colour_upper_lambda_limit = 11000 * u.angstrom
 _colour_lower_lambda_limit = 3500 * u.angstrom
+
+## Number of wavelength grids each filter keeps resampled throughputs for
+_resampled_throughput_cache_size = 32
+
+## Number of (grid, R_V, law) extinction curves extinction.get_extinction_curve keeps
+_extinction_curve_cache_size = 64
@@ -3,9 +3,18 @@ This contains the extinction sub-module for pycoco
 """
 from __future__ import print_function
 
+import hashlib
+from collections import OrderedDict
+
 import numpy as np
 
-__all__ = ["extinction_law", "unred", "deredden"]
+from . import defaults
+
+__all__ = ["extinction_law", "get_extinction_curve", "unred", "deredden"]
+
+## A_lambda/A_V for the last defaults._extinction_curve_cache_size
+## (law, R_V, grid) combinations - see get_extinction_curve
+_extinction_curve_cache = OrderedDict()
 
 def extinction_law(a, b, Rv = 3.1):
     """Eqn 1 from Cardelli 1989"""
@@ -15,64 +24,71 @@ def extinction_law(a, b, Rv = 3.1):
     return a_lam_aV
 
 
-def coeffs(x, wavl = False, verbose = False, cardelli = True, odonnell = False):
-    """ x = 1 / lambda """
+## Optical/near-IR polynomials in y = x - 1.82, highest power first
+_cardelli_a_coefficients = np.array([1., 0.17699, -0.50447, -0.02427, 0.72085, 0.01979, -0.77530, 0.32999][::-1]) ## use [::-1] to reverse
+_cardelli_b_coefficients = np.array([0., 1.41338, 2.28305, 1.07233, -5.38434, -0.62251, 5.30260, -2.09002][::-1])
+_odonnell_a_coefficients = np.array([1., 0.104, -0.609, 0.701, 1.137, -1.718, -0.827, 1.647, -0.505][::-1])        ##from O'Donnell
+_odonnell_b_coefficients = np.array([0., 1.952, 2.908, -3.989, -7.985, 11.102, 5.491, -10.805, 3.347][::-1])
 
-    # wavl = np.array(wavl)
-    # x = np.array(1./wavl)
-    x = np.array(x)
-    if verbose: print(x)
 
-    a = np.array([])
-    b = np.array([])
+def _horner(coefficients, y):
+    """
+    Evaluates the polynomial with `coefficients` (highest power first) at y,
+    in the same order of operations as np.poly1d.
+    """
+    result = np.zeros_like(y)
+    for coefficient in coefficients:
+        result = result * y + coefficient
+    return result
 
-    pass_x = np.array([])
 
-    for i in enumerate(x):
+def coeffs(x, wavl = False, verbose = False, cardelli = True, odonnell = False):
+    """ x = 1 / lambda
 
-        ## IR
-        if 0.3 <= i[1] <= 1.1:
-            if verbose: print('IR')
-            a = np.append(a, 0.574*np.power(i[1], 1.61))
-            b = np.append(b, -0.527*np.power(i[1], 1.61))
+    a and b of the Cardelli, Clayton & Mathis (1989) law (or O'Donnell 1994 in
+    the optical, if odonnell = True) for the x between 0.3 and 8 inverse
+    microns, found for all of them at once. x outside that range are dropped,
+    so 'x' in the returned dict is the x that 'a' and 'b' belong to.
+    """
 
-            pass_x= np.append(pass_x, i[1])
+    # wavl = np.array(wavl)
+    # x = np.array(1./wavl)
+    x = np.atleast_1d(np.asarray(x, dtype = np.float64))
+    if verbose: print(x)
 
-        ## Near-IR/OPT
-        if 1.1 < i[1] <= 3.3:
-            if verbose: print('Near-IR/Optical')
-            y = i[1] - 1.82
-            if cardelli:
-                a_coefficients = np.array([1., 0.17699, -0.50447, -0.02427, 0.72085, 0.01979, -0.77530, 0.32999][::-1]) ## use [::-1] to reverse
-                b_coefficients = np.array([0., 1.41338, 2.28305, 1.07233, -5.38434, -0.62251, 5.30260, -2.09002][::-1])
-            if odonnell:
-                a_coefficients = np.array([1., 0.104, -0.609, 0.701, 1.137, -1.718, -0.827, 1.647, -0.505][::-1])        ##from O'Donnell
-                b_coefficients = np.array([0., 1.952, 2.908, -3.989, -7.985, 11.102, 5.491, -10.805, 3.347][::-1])
+    ## IR, Near-IR/OPT and Near-UV
+    ir = np.logical_and(0.3 <= x, x <= 1.1)
+    optical = np.logical_and(1.1 < x, x <= 3.3)
+    uv = np.logical_and(3.3 < x, x <= 8.0)
 
-            apoly = np.poly1d(a_coefficients)
-            bpoly = np.poly1d(b_coefficients)
+    keep = ir | optical | uv
+    pass_x = x[keep]
+    ir, optical, uv = ir[keep], optical[keep], uv[keep]
+    if verbose: print("IR:", np.sum(ir), "Near-IR/Optical:", np.sum(optical), "Near-UV:", np.sum(uv))
 
-            a = np.append(a, apoly(y))
-            b = np.append(b, bpoly(y))
-            # a_i = 1. + 0.17699 - 0.50447 - 0.02427 + 0.72085 + 0.01979 - 0.77530 + 0.32999
-            pass_x= np.append(pass_x, i[1])
+    a = np.empty(len(pass_x))
+    b = np.empty(len(pass_x))
 
-        ## Near-UV
-        if 3.3 < i[1] <= 8.0:
-            if verbose: print('Near-UV')
+    x_ir = pass_x[ir]
+    a[ir] = 0.574*np.power(x_ir, 1.61)
+    b[ir] = -0.527*np.power(x_ir, 1.61)
 
-            if i[1] >= 5.9:
-                y = i[1] - 5.9
-                F_a_coefficients = np.array([0., 0., -0.04473, -0.009779])
-                # pass
-            # a_coefficients = [1.752, -0.0316, ]
-            a_x = 1.752 - 0.316*i[1] - 0.104/((i[1]-4.7)*(i[1]-4.7) + 0.341)
-            b_x = -3.090 + 1.825*i[1] + 1.206/((i[1] - 4.62)*(i[1] - 4.62) + 0.263)
+    if optical.any():
+        if odonnell:
+            a_coefficients, b_coefficients = _odonnell_a_coefficients, _odonnell_b_coefficients
+        elif cardelli:
+            a_coefficients, b_coefficients = _cardelli_a_coefficients, _cardelli_b_coefficients
+        else:
+            raise ValueError("one of cardelli or odonnell needs to be True")
 
-            a = np.append(a, a_x)
-            b = np.append(b, b_x)
+        y = pass_x[optical] - 1.82
+        a[optical] = _horner(a_coefficients, y)
+        b[optical] = _horner(b_coefficients, y)
 
-            pass_x= np.append(pass_x, i[1])
+    ## (the far-UV curvature terms for x >= 5.9 aren't applied)
+    x_uv = pass_x[uv]
+    a[uv] = 1.752 - 0.316*x_uv - 0.104/((x_uv-4.7)*(x_uv-4.7) + 0.341)
+    b[uv] = -3.090 + 1.825*x_uv + 1.206/((x_uv - 4.62)*(x_uv - 4.62) + 0.263)
 
     return {'a': a, 'b': b, 'x': pass_x}
 
@@ -88,30 +104,70 @@ def inv_micron_to_angstrom(x):
     return 10000./x
 
 
-def unred(wave, flux, wav_in_m = False, r_v = 3.1, EBV = False, verbose=False):
+def get_extinction_curve(wave, wav_in_m = False, r_v = 3.1, cardelli = True, odonnell = False):
     """
+    A_lambda/A_V on the wavelength grid `wave` (see coeffs and extinction_law).
+    Kept for the last defaults._extinction_curve_cache_size combinations of
+    grid, r_v and law, keyed on the md5 of the grid, so repeated calls on the
+    same grid don't redo the curve. The returned array is read-only.
 
     Parameters
     ----------
+    wave : array of wavelengths, in Angstrom (or m if wav_in_m = True)
+
     Returns
     -------
-
+    A_lambda_A_V : array
     """
+    wave = np.ascontiguousarray(getattr(wave, "value", wave), dtype = np.float64)
+
+    key = ("odonnell" if odonnell else "cardelli" if cardelli else None, float(r_v), bool(wav_in_m),
+           wave.shape, hashlib.md5(wave.tobytes()).hexdigest())
+    if key in _extinction_curve_cache:
+        _extinction_curve_cache.move_to_end(key)
+        return _extinction_curve_cache[key]
 
     if wav_in_m:
         wav_inv = 1./(1e6*wave)
     else:
         wav_inv = angstrom_to_inv_micron(wave)
 
+    vals = coeffs(wav_inv, cardelli = cardelli, odonnell = odonnell)
+    A_lambda_A_V = vals['a'] + vals['b']/r_v
+    A_lambda_A_V.setflags(write = False)
+
+    _extinction_curve_cache[key] = A_lambda_A_V
+    while len(_extinction_curve_cache) > defaults._extinction_curve_cache_size:
+        _extinction_curve_cache.popitem(last = False)
+
+    return A_lambda_A_V
+
+
+def unred(wave, flux, wav_in_m = False, r_v = 3.1, EBV = False, verbose=False):
+    """
+    Corrects flux for E(B-V) of CCM extinction. EBV can be an array, in which
+    case the result has a row per EBV - (len(EBV), len(wave)) - found in one
+    go, with the curve coming from get_extinction_curve.
+
+    Parameters
+    ----------
+    Returns
+    -------
+
+    """
+
     # EBV = EBV_MW + EBV_host ## THIS IS WRONG. HOST EXTINCTION DONE AT REST FRAME
     #                         ## THEN MW DONE IN OBSERVER FRAME
 
-    A_V = r_v*EBV
-    vals = coeffs(wav_inv)
-    if verbose: print(len(vals))
+    if np.ndim(EBV):
+        A_V = r_v*np.asarray(EBV, dtype = np.float64)[:, np.newaxis]
+    else:
+        A_V = r_v*EBV
+    A_lambda_A_V = get_extinction_curve(wave, wav_in_m = wav_in_m, r_v = r_v)
+    if verbose: print(len(A_lambda_A_V))
     if verbose: print(A_V)
 
-    A_lambda = A_V *  (vals['a'] + vals['b']/r_v)
+    A_lambda = A_V * A_lambda_A_V
     if verbose: print(len(A_lambda))
     if verbose: print(len(flux))
 
@@ -162,7 +218,10 @@ def ccm(wave, wav_in_m = False, r_v = 3.1, EBV=0, return_frac = True):
 def deredden(wave, flux, z, wav_in_m = False, r_v = 3.1, EBV_MW = False, EBV_host = False):
     """
 
-    For dereddining spectra for the effect of dust
+    For dereddining spectra for the effect of dust. EBV_MW and EBV_host can be
+    arrays of equal length (or one an array, the other a scalar), and flux a
+    stack of spectra on the grid wave, to deredden for a grid of E(B-V) in one
+    go - see unred.
 
     Parameters
     ----------
@@ -4,6 +4,7 @@
 
 import os
 import re
+import shutil
 import subprocess
 import warnings
 
@@ -53,6 +54,8 @@ __all__ = ["load_filter",
            "read_sndist_file",
            "load_sndist",
            "load_info",
+           "make_spectrum_archive",
+           "make_phot_store",
            "plot_mangle",
            "test_LCfit",
            "run_LCfit",
@@ -84,10 +87,14 @@ __all__ = ["load_filter",
 #  #  Functions                         #  #
 #  #------------------------------------#  #
 
-def load_filter(path, cmap = False, verbose = False):
+def load_filter(path, cmap = False, use_registry = True, verbose = False):
     """
     Loads a filter response into FilterClass and returns it.
 
+    By default the filter comes from the process-wide registry
+    (see classes.get_filter), so is shared with everything else that has
+    asked for it. Use `use_registry = False` for a private copy.
+
     Parameters
     ----------
     Returns
@@ -95,8 +102,11 @@ def load_filter(path, cmap = False, verbose = False):
     """
 
     if utils.check_file_path(os.path.abspath(path)):
-        filter_object = classes.FilterClass()
-        filter_object.read_filter_file(os.path.abspath(path), verbose = verbose)
+        if use_registry:
+            filter_object = classes.get_filter(os.path.abspath(path), verbose = verbose)
+        else:
+            filter_object = classes.FilterClass()
+            filter_object.read_filter_file(os.path.abspath(path), verbose = verbose)
 
         if cmap:
             filter_object.calculate_plot_colour(verbose = verbose)
@@ -767,6 +777,226 @@ def load_info(path = defaults._default_info_path, verbose = False):
     return i
 
 
+def _get_archive_sources(data_dir, list_dir, recon_dir, specphase_dir, coco_dir = defaults._default_coco_dir_path,
+                         verbose = False):
+    """
+    (path, snname, mjd_obs, kind) for every spectrum make_spectrum_archive packs.
+    The spec_paths in the list files are relative to coco_dir.
+    """
+    sources = []
+
+    ## observed spectra - the SN and MJD come from the list files where there is one
+    listed = {}
+    if list_dir and os.path.isdir(list_dir):
+        for listfile in sorted(os.listdir(list_dir)):
+            if not listfile.endswith(".list"):
+                continue
+            try:
+                listdata = utils.read_list_file(os.path.join(list_dir, listfile), verbose = verbose)
+            except Exception as e:
+                warnings.warn("couldn't read " + listfile + ": " + str(e))
+                continue
+            for row in listdata:
+                spec_path = os.path.realpath(os.path.join(coco_dir, str(row["spec_path"])))
+                listed[spec_path] = (str(row["snname"]), float(row["mjd_obs"]))
+
+    spec_dir = os.path.join(data_dir, "spec")
+    if os.path.isdir(spec_dir):
+        for snname in sorted(os.listdir(spec_dir)):
+            sn_dir = os.path.join(spec_dir, snname)
+            if not os.path.isdir(sn_dir):
+                continue
+            for spec_filename in sorted(os.listdir(sn_dir)):
+                if spec_filename.startswith("."):
+                    continue
+                spec_path = os.path.join(sn_dir, spec_filename)
+                name, mjd_obs = listed.get(os.path.realpath(spec_path), (snname, np.nan))
+                sources.append((spec_path, name, mjd_obs, "spec"))
+    elif verbose: print("no", spec_dir)
+
+    ## CoCo outputs, named <snname>_<mjd>.spec
+    for kind, directory in [("recon", recon_dir), ("specphase", specphase_dir)]:
+        if not directory or not os.path.isdir(directory):
+            if verbose: print("no", directory)
+            continue
+        for spec_filename in sorted(os.listdir(directory)):
+            if not spec_filename.endswith(".spec"):
+                continue
+            snname, _, mjd_string = spec_filename[:-len(".spec")].rpartition("_")
+            try:
+                mjd_obs = float(mjd_string)
+            except ValueError:
+                snname, mjd_obs = spec_filename[:-len(".spec")], np.nan
+            sources.append((os.path.join(directory, spec_filename), snname, mjd_obs, kind))
+
+    return sources
+
+
+def make_spectrum_archive(path, data_dir = defaults._default_data_dir_path, list_dir = defaults._default_list_dir_path,
+                          recon_dir = defaults._default_recon_dir_path, specphase_dir = defaults._default_specphase_dir_path,
+                          coco_dir = defaults._default_coco_dir_path, verbose = False):
+    """
+    Packs every spectrum in a CoCo tree - data_dir/spec/*/*, recon_dir/*.spec
+    and specphase_dir/*.spec - into one flat file of float64s at `path`, with
+    an index alongside (see classes.SpectrumArchiveClass). Each spectrum is
+    read with SpectrumClass.load, and written as its wavelengths then fluxes -
+    flux_err, where a spectrum has it, is left out.
+    Pass False for any directory to leave it out. The paths in the list
+    files in list_dir are relative to coco_dir.
+
+    Both files are written alongside and swapped in with renames, the index
+    first.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    classes.SpectrumArchiveClass of the new archive.
+    """
+    sources = _get_archive_sources(data_dir, list_dir, recon_dir, specphase_dir, coco_dir = coco_dir, verbose = verbose)
+
+    index = Table(names = ("snname", "mjd_obs", "filename", "kind", "offset", "length"),
+                  dtype = ("U64", "f8", "U256", "U16", "i8", "i8"))
+
+    index_path = classes.get_spectrum_archive_index_path(path)
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    tmp_index_path = index_path + "." + str(os.getpid()) + ".tmp"
+    try:
+        offset = 0
+        with open(tmp_path, "wb") as f:
+            for spec_path, snname, mjd_obs, kind in sources:
+                S = classes.SpectrumClass()
+                try:
+                    S.load(spec_path, abspath = True, verbose = verbose)
+                except Exception as e:
+                    warnings.warn("couldn't read " + spec_path + ": " + str(e))
+                    continue
+                if not hasattr(S, "data"):
+                    continue
+
+                wavelength = np.asarray(S.wavelength, dtype = "<f8")
+                flux = np.asarray(S.flux, dtype = "<f8")
+                wavelength.tofile(f)
+                flux.tofile(f)
+
+                index.add_row((snname, mjd_obs, os.path.basename(spec_path), kind, offset, len(wavelength)))
+                offset += 2 * len(wavelength)
+                if verbose: print(kind, snname, spec_path, len(wavelength))
+
+        index.write(tmp_index_path, format = "ascii.commented_header", overwrite = True)
+        os.replace(tmp_index_path, index_path)
+        os.replace(tmp_path, path)
+    finally:
+        for leftover in (tmp_path, tmp_index_path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    return classes.SpectrumArchiveClass(path, verbose = verbose)
+
+
+def make_phot_store(path, lc_dir = os.path.join(defaults._default_data_dir_path, "lc/"), overwrite = False,
+                    verbose = False):
+    """
+    Puts the photometry of every SN in lc_dir (each SNname.dat, read with
+    utils.load_formatted_phot) into one columnar store in the directory
+    `path` (see classes.PhotometryStoreClass). Single filter files
+    (SNname_filter.dat) of SNe that have a SNname.dat are left out.
+
+    An existing store at `path` is replaced - the new one is written
+    alongside and swapped in with renames. Anything else already at `path`
+    is only replaced with overwrite = True.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    classes.PhotometryStoreClass of the new store.
+    """
+    utils.check_dir_path(lc_dir)
+
+    path = os.path.abspath(path).rstrip("/")
+    if os.path.exists(path) and not overwrite:
+        is_store = os.path.isdir(path) and all(os.path.isfile(os.path.join(path, name + ".npy"))
+                                               for name in classes._phot_store_columns + classes._phot_store_index)
+        if not is_store:
+            raise errors.PathError(path + " exists and isn't a photometry store. Run with overwrite = True to replace it")
+
+    phot_files = sorted(i for i in os.listdir(lc_dir) if i.endswith(".dat"))
+    snnames = []
+    phot_tables = []
+    for phot_file in phot_files:
+        snname = phot_file[:-len(".dat")]
+        if "_" in snname and snname.split("_")[0] + ".dat" in phot_files:
+            if verbose: print("leaving out", phot_file)
+            continue
+
+        try:
+            phot_table = utils.load_formatted_phot(os.path.join(lc_dir, phot_file), verbose = False)
+        except Exception as e:
+            warnings.warn("couldn't read " + phot_file + ": " + str(e))
+            continue
+        if verbose: print(snname, len(phot_table))
+
+        snnames.append(snname)
+        phot_tables.append(phot_table)
+
+    if len(phot_tables) == 0:
+        raise errors.PathError("Couldn't find any photometry to read in " + lc_dir)
+
+    columns = {"snname": np.repeat(np.array(snnames, dtype = str), [len(t) for t in phot_tables]),
+               "filter": np.concatenate([np.asarray(t["filter"], dtype = str) for t in phot_tables]),
+               "MJD": np.concatenate([np.asarray(t["MJD"], dtype = "<f8") for t in phot_tables]),
+               "flux": np.concatenate([np.asarray(t["flux"], dtype = "<f8") for t in phot_tables]),
+               "flux_err": np.concatenate([np.asarray(t["flux_err"], dtype = "<f8") for t in phot_tables])}
+
+    order = np.lexsort((columns["MJD"], columns["filter"], columns["snname"]))
+    columns = dict((name, column[order]) for name, column in columns.items())
+
+    sorted_snnames, sn_starts = np.unique(columns["snname"], return_index = True)
+    filter_order = np.lexsort((columns["MJD"], columns["snname"], columns["filter"]))
+    filter_names, filter_starts = np.unique(columns["filter"][filter_order], return_index = True)
+    mjd_order = np.argsort(columns["MJD"], kind = "stable")
+
+    index = {"snnames": sorted_snnames,
+             "sn_starts": np.append(sn_starts, len(order)),
+             "filter_names": filter_names,
+             "filter_starts": np.append(filter_starts, len(order)),
+             "filter_order": filter_order,
+             "mjd_order": mjd_order,
+             "mjd_sorted": columns["MJD"][mjd_order]}
+
+    ## write it all alongside, then swap it in
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    old_path = path + "." + str(os.getpid()) + ".old"
+    try:
+        os.makedirs(tmp_path)
+        for name in classes._phot_store_columns:
+            np.save(os.path.join(tmp_path, name + ".npy"), columns[name])
+        for name in classes._phot_store_index:
+            np.save(os.path.join(tmp_path, name + ".npy"), index[name])
+
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            if os.path.exists(old_path):
+                os.rename(old_path, path)
+            raise
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+
+    if os.path.isdir(old_path):
+        shutil.rmtree(old_path)
+    elif os.path.exists(old_path):
+        os.remove(old_path)
+
+    return classes.PhotometryStoreClass(path, verbose = verbose)
+
+
 def combine_spectra(s1, s2, wmin, wmax, scale=False, report=False, showplot=False, verbose=True):
     """
 
@@ -1365,9 +1595,9 @@ def plot_mangledata(S, data_table, mS=False, xminorticks=250, yminorticks=0.1, s
     # ax.set_ylim([0, default_axylims[1]])
     # ax.set_ylim([0, 7.01e-16])
     if mS:
-        ax_uplim = np.nanmax(np.append(mS.flux.data,np.append(S.flux.data*norm_factor, np.nanmax([data_table["fitflux"],data_table["spec_filterflux"]*norm_factor,data_table["mangledspec_filterflux"]]))))
+        ax_uplim = np.nanmax(np.append(np.asarray(mS.flux),np.append(np.asarray(S.flux)*norm_factor, np.nanmax([data_table["fitflux"],data_table["spec_filterflux"]*norm_factor,data_table["mangledspec_filterflux"]]))))
     else:
-        ax_uplim = np.nanmax(np.append(S.flux.data*norm_factor, np.nanmax([data_table["fitflux"],data_table["spec_filterflux"]*norm_factor,data_table["mangledspec_filterflux"]])))
+        ax_uplim = np.nanmax(np.append(np.asarray(S.flux)*norm_factor, np.nanmax([data_table["fitflux"],data_table["spec_filterflux"]*norm_factor,data_table["mangledspec_filterflux"]])))
 
     if spl:
         # ax1_uplim = np.nanmax(data_table["weights"]) * 1.25
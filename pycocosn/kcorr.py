@@ -35,6 +35,7 @@ from scipy.integrate import simps, trapz
 from . import classes
 from . import colours
 from . import defaults
+from . import errors
 from . import functions
 from . import utils
 from . import extinction
@@ -44,6 +45,7 @@ __all__ = ["offset",
             # "convert_Vega_to_AB",
             "calc_AB_zp",
             "calc_vega_zp",
+            "calc_filter_properties",
             "load_dark_sky_spectrum",
             "calc_spectrum_filter_flux",
             "load_atmosphere",
@@ -104,23 +106,35 @@ offset = {
 
 
 def load_vega(path = os.path.join(defaults._default_kcorr_data_path, "alpha_lyr_stis_002.dat"), wmin = 1500*u.angstrom,
-              *args, **kwargs):
+              wmax = 11000*u.angstrom, *args, **kwargs):
     """
     returns spectrum of Vega as a SpectrumClass instance
+
+    With no extra arguments this is the shared, read-only copy from
+    classes.get_reference_spectrum - the file is only read once per process.
     """
-    vega = classes.SpectrumClass()
-    vega.load(path, wmin = wmin, *args, **kwargs)
+    if args or kwargs:
+        vega = classes.SpectrumClass()
+        vega.load(path, wmin = wmin, wmax = wmax, *args, **kwargs)
+    else:
+        vega = classes.get_reference_spectrum(path, wmin = wmin, wmax = wmax)
 
     return vega
 
 
 def load_AB(path = os.path.join(defaults._default_kcorr_data_path, "AB_pseudospectrum.dat"), wmin = 1500*u.angstrom,
-            *args, **kwargs):
+            wmax = 11000*u.angstrom, *args, **kwargs):
     """
     returns 'spectrum' as a SpectrumClass instance
+
+    With no extra arguments this is the shared, read-only copy from
+    classes.get_reference_spectrum - the file is only read once per process.
     """
-    AB = classes.SpectrumClass()
-    AB.load(path, wmin = wmin, *args, **kwargs)
+    if args or kwargs:
+        AB = classes.SpectrumClass()
+        AB.load(path, wmin = wmin, wmax = wmax, *args, **kwargs)
+    else:
+        AB = classes.get_reference_spectrum(path, wmin = wmin, wmax = wmax)
 
     return AB
 
@@ -177,18 +191,52 @@ def calc_filter_area(filter_name = False, filter_object=False, filter_path = def
         utils.check_file_path(os.path.join(filter_path, filter_name + ".dat"))
 
         filter_object = functions.load_filter(os.path.join(filter_path, filter_name + ".dat"))
-        filter_object.calculate_effective_wavelength()
-        filter_area = simps(filter_object.throughput, filter_object.wavelength)
+        filter_area = filter_object._effective_area
 
     return filter_area
 
 
+def calc_filter_properties(path, verbose = False):
+    """
+    Calculates the entry for the filter file at `path` in the zeropoint table
+    (see utils.make_zeropoint_table).
+
+    :param path:
+    :param verbose:
+    :return: OrderedDict with the utils._zeropoint_table_names as keys
+    """
+    filter_object = classes.FilterClass()
+    filter_object.read_filter_file(os.path.abspath(path), use_table=False, verbose=verbose)
+
+    properties = OrderedDict()
+    properties["filename"] = path.split("/")[-1]
+    properties["filter_name"] = filter_object.filter_name
+    properties["md5"] = utils._get_file_hash(path)
+    properties["lambda_effective"] = filter_object.lambda_effective.value
+    properties["area"] = filter_object._effective_area
+    properties["lower_edge"] = filter_object._lower_edge
+    properties["upper_edge"] = filter_object._upper_edge
+    properties["zp_AB"] = filter_object.zp_AB
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning) ## filters that miss Vega entirely
+        properties["zp_vega"] = -2.5 * np.log10(calc_vega_flux(filter_object.filter_name, filter_object=filter_object)
+                                                / properties["area"])
+
+    return properties
+
+
 def calc_spectrum_filter_flux(filter_name=False, filter_object=False, spectrum_object=False,
                               filter_path = defaults._default_filter_dir_path, spectrum_dir=None,
-                              spectrum_filename=None, correct_for_area=True, verbose = True):
+                              spectrum_filename=None, correct_for_area=True, exact=False, verbose = True):
     """
     returns flux in units of
 
+    With exact=True the product of the linearly interpolated spectrum and filter
+    is integrated exactly over the spectrum (see BaseFilterClass.get_exact_weights),
+    rather than resampling the filter and using Simpson's rule.
+
+    :param exact:
     :param filter_object:
     :param spectrum_dir:
     :param spectrum_filename:
@@ -220,27 +268,43 @@ def calc_spectrum_filter_flux(filter_name=False, filter_object=False, spectrum_o
         print("min wavelength = ", np.nanmin(filter_object.wavelength))
         print("max wavelength = ", np.nanmax(filter_object.wavelength))
 
-    if not np.array_equal(filter_object.wavelength, spectrum_object.wavelength):
-        if verbose: print("resampling the response")
-        filter_object.resample_response(new_wavelength = spectrum_object.wavelength)
+    if exact:
+        weights = filter_object.get_exact_weights(spectrum_object.wavelength, verbose = verbose)
+        filter_area = np.sum(weights)
+        integrated_flux = np.dot(weights, np.asarray(getattr(spectrum_object.flux, "value", spectrum_object.flux)))
+        if verbose: print("Filter_area = ", filter_area, "Integrated flux = ", integrated_flux)
+
+        if correct_for_area:
+            return integrated_flux/filter_area
+        else:
+            return integrated_flux
 
-        if verbose:
-            print("min wavelength = ", np.nanmin(filter_object.wavelength))
-            print("max wavelength = ", np.nanmax(filter_object.wavelength))
+    ## the filter is zero outside this bit of the spectrum
+    support = filter_object.get_support_slice(spectrum_object.wavelength)
+    wavelength = spectrum_object.wavelength[support]
+
+    throughput = filter_object.get_resampled_throughput(wavelength, verbose = verbose)
+
+    ## Simpson's rule is a dot product with weights that only depend on the grid,
+    ## which the spectrum keeps - so repeat calls (e.g. mangling) are cheap
+    if hasattr(spectrum_object, "get_quadrature_weights"):
+        quadrature_weights = spectrum_object.get_quadrature_weights()[support]
+    else:
+        quadrature_weights = utils.calc_quadrature_weights(wavelength)
 
     if hasattr(filter_object, "_effective_area"):
-        filter_object.calculate_filter_area()
-        filter_area = filter_object._effective_area
-        # filter_area = simps(filter_object.throughput, filter_object.wavelength)
+        filter_area = np.dot(quadrature_weights, throughput)
+        if np.isnan(filter_area):  ## See Issue #26 on GitHub
+            filter_area = trapz(throughput, wavelength)
 
         if verbose: print("Filter_area = ", filter_area)
 
-    transmitted_spec = filter_object.throughput * spectrum_object.flux
-    integrated_flux = simps(transmitted_spec, spectrum_object.wavelength)
+    transmitted_spec = throughput * spectrum_object.flux[support]
+    integrated_flux = np.dot(quadrature_weights, transmitted_spec)
     if verbose: print("Integrated flux = ", integrated_flux)
 
     if np.isnan(integrated_flux):   ## See Issue #26 on GitHub
-        integrated_flux = trapz(transmitted_spec, spectrum_object.wavelength)
+        integrated_flux = trapz(transmitted_spec, wavelength)
         if verbose: print("New integrated flux = ",integrated_flux)
 
     if correct_for_area:
@@ -259,9 +323,9 @@ def calc_AB_flux(filter_name, filter_path = defaults._default_filter_dir_path,
         filter_object = functions.load_filter(os.path.join(filter_path, filter_name + ".dat"))
 
     filter_object.calculate_effective_wavelength()
-    filter_object.resample_response(new_wavelength = AB.wavelength)
+    throughput = filter_object.get_resampled_throughput(AB.wavelength)
 
-    transmitted_spec = filter_object.throughput * AB.flux
+    transmitted_spec = throughput * AB.flux
 
     integrated_flux = simps(transmitted_spec, AB.wavelength)
 
@@ -273,6 +337,11 @@ def calc_AB_zp(filter_name=False, filter_object = False,
     """
 
     """
+    if abpath == os.path.join(defaults._default_kcorr_data_path, "AB_pseudospectrum.dat"):
+        zp = _get_tabulated_zeropoint(filter_name, filter_object, "zp_AB")
+        if zp is not None:
+            return zp
+
     if not filter_object and filter_name:
         filter_object = functions.load_filter(os.path.join(defaults._default_filter_dir_path, filter_name + ".dat"))
 
@@ -282,6 +351,28 @@ def calc_AB_zp(filter_name=False, filter_object = False,
     return -2.5 * np.log10(area_corr_integrated_flux)
 
 
+def _get_tabulated_zeropoint(filter_name=False, filter_object=False, column="zp_AB"):
+    """
+    Looks the zeropoint up in the zeropoint table, returns None if it isn't there
+    (or is out of date) so it can be calculated the long way.
+    """
+    if filter_object and hasattr(filter_object, "_filter_file_path"):
+        path = filter_object._filter_file_path
+    elif filter_name:
+        path = os.path.join(defaults._default_filter_dir_path, filter_name + ".dat")
+    else:
+        return None
+
+    if not os.path.isfile(path):
+        return None
+
+    row = utils.get_zeropoint_table_row(path)
+    if row is None or not np.isfinite(row[column]):
+        return None
+
+    return float(row[column])
+
+
 def calc_vega_flux(filter_name, filter_object = False,):
     """
 
@@ -293,9 +384,9 @@ def calc_vega_flux(filter_name, filter_object = False,):
         filter_object = functions.load_filter(os.path.join(defaults._default_filter_dir_path, filter_name + ".dat"))
     # else if hasattr(filter_object, "wavelength"):
 
-    filter_object.resample_response(new_wavelength = vega.wavelength)
+    throughput = filter_object.get_resampled_throughput(vega.wavelength)
 
-    transmitted_spec = filter_object.throughput * vega.flux
+    transmitted_spec = throughput * vega.flux
 
     integrated_flux = simps(transmitted_spec, vega.wavelength)
 
@@ -306,6 +397,9 @@ def calc_vega_zp(filter_name, filter_object = False, vega_Vmag = 0.03):
     """
 
     """
+    zp = _get_tabulated_zeropoint(filter_name, filter_object, "zp_vega")
+    if zp is not None:
+        return zp
 
     if not filter_object:
         filter_object = functions.load_filter(os.path.join(defaults._default_filter_dir_path, filter_name + ".dat"))
@@ -402,6 +496,20 @@ def lambda_to_nu(wavelength):
 
 ## Mangling
 
+def _get_mangle_filter(filter_name):
+    """
+    A copy of the registry filter `filter_name` with its edges found on the
+    grid of the AB pseudospectrum, as FilterClass.calculate_AB_zp samples it -
+    where mangle and fit_bb have always taken them from. The shared filter
+    keeps the edges of its native grid.
+    """
+    filter_object = copy.copy(classes.get_filter(filter_name=filter_name, filter_dir=defaults._default_filter_dir_path))
+    AB = classes.get_reference_spectrum()
+    filter_object.calculate_edges(new_wavelength=AB.wavelength)
+
+    return filter_object
+
+
 def mangle(sn, S, spec_mjd, filters, staticfilter=False, anchor_distance=100, verbose=False):
     """
 
@@ -421,13 +529,11 @@ def mangle(sn, S, spec_mjd, filters, staticfilter=False, anchor_distance=100, ve
         filter_dict = OrderedDict()
 
         for i, f in enumerate(filters):
-            filter_dict[f] = functions.load_filter(os.path.join(defaults._default_filter_dir_path, f + ".dat"))
-            filter_dict[f].calculate_edges()
+            filter_dict[f] = _get_mangle_filter(f)
             #     filter_dict[f].calculate_edges_zero()
 
             fit_flux = sn.lcfit.spline[f](spec_mjd)
 
-            sn.phot.data_filters[f].resample_response(new_wavelength=S.wavelength)
             S_filter_flux = calc_spectrum_filter_flux(filter_object=sn.phot.data_filters[f], spectrum_object=S, verbose=verbose)
             S_filter_flux_no_area = calc_spectrum_filter_flux(filter_object=sn.phot.data_filters[f],
                                                                   spectrum_object=S,
@@ -559,6 +665,10 @@ def manglespec3(SpectrumObject, spec_mjd, wanted_filters, wanted_flux, data_tabl
     weights = np.append(np.append(weight_l, paramlist), weight_u)
     data_table["weights"] = weights
 
+    ## manglemin integrates deep copies of the spectrum on the same grid, which
+    ## carry the quadrature weights with them if they are already worked out
+    SpectrumObject.get_quadrature_weights()
+
     ## Do the fit
     out = minimize(manglemin, params, args=(SpectrumObject, data_table), kws=({"verbose": verbose}))
     # out = minimize(manglemin, params, args=(SpectrumObject, data_table), epsfcn=1e-5)
@@ -591,9 +701,19 @@ def manglespec3(SpectrumObject, spec_mjd, wanted_filters, wanted_flux, data_tabl
     return fit_dict
 
 
+def _get_mangle_columns(mS):
+    """
+    The columns of a mangled spectrum's .spec file.
+    """
+    return OrderedDict([("wavelength", mS.wavelength), ("flux", mS.flux)])
+
+
 def save_mangle(mS, filename, orig_filename, path=False,
                 squash=False, verbose=True, *args, **kwargs):
     """
+    Writes mangled spectrum mS to filename (in path, the recon directory by
+    default) - with utils.write_columns, which writes the same bytes as
+    astropy's ascii.no_header writer, straight from the arrays.
 
     :param mS:
     :param filename:
@@ -618,26 +738,18 @@ def save_mangle(mS, filename, orig_filename, path=False,
 
         utils.check_dir_path(path)
 
-        save_table = Table()
-
-        save_table['wavelength'] = mS.wavelength
-        save_table['flux'] = mS.flux
-
-        save_table['wavelength'].format = "5.5f"
-        save_table['flux'].format = "5.5e"
-
-        save_table.meta["comments"] = [orig_filename, ]
-
         if os.path.isfile(outpath):
             if squash:
                 print("Overwriting " + outpath)
-                save_table.write(outpath, format="ascii.no_header", overwrite=True)
+                utils.write_columns(outpath, _get_mangle_columns(mS), formats=classes._spec_save_formats,
+                                    comments=[orig_filename, ], header=False, overwrite=True)
             else:
                 warnings.warn("Found existing file matching " + os.path.join(path,
                                                                              filename) + ". Run with squash = True to overwrite")
         else:
             print("Writing " + outpath)
-            save_table.write(outpath, format="ascii.no_header")
+            utils.write_columns(outpath, _get_mangle_columns(mS), formats=classes._spec_save_formats,
+                                comments=[orig_filename, ], header=False)
 
     else:
         warnings.warn("Doesn't seem to be any data here (empty self.data)")
@@ -805,8 +917,7 @@ def fit_bb(S, new_wavelength=False, new_min_wavelength=2000, new_max_wavelength=
     if not filter_dict:
         filter_dict = OrderedDict()
         for i, filter_name in enumerate(S._overlapping_filter_list):
-            filter_dict[filter_name] = load_filter(os.path.join(defaults._default_filter_dir_path, filter_name + ".dat"))
-            filter_dict[filter_name].calculate_edges()
+            filter_dict[filter_name] = _get_mangle_filter(filter_name)
 
     if not hasattr(S, "specphot"):
         warnings.warn("Spectrum has no specphot - calculating")
@@ -10,6 +10,8 @@ except NameError:
         from imp import reload  # Python 3.0 - 3.3
 
 import os
+import shutil
+import tempfile
 import unittest
 
 import pycoco as pcc
@@ -166,12 +168,147 @@ class TestClass(unittest.TestCase):
 
         self.assertEqual(len(x.phot), 607)
 
+    def test_PhotometryClass_unpack_splits_sorted_phot(self):
+        x = pcc.classes.PhotometryClass()
+        x.load(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"))
+
+        self.assertEqual(sum(len(x.data[filter_name]) for filter_name in x.filter_names), len(x.phot))
+        for filter_name in x.filter_names:
+            self.assertTrue(np.all(x.data[filter_name]["filter"] == filter_name))
+            self.assertTrue(np.all(np.diff(x.data[filter_name]["MJD"]) >= 0))
+            self.assertIs(x.data_filters[filter_name], pcc.classes.get_filter(filter_name=filter_name))
+
+        ## views of the one set of arrays, rather than copies
+        B = np.asarray(x.data["BessellB"]["flux"])
+        V = np.asarray(x.data["BessellV"]["flux"])
+        while B.base is not None:
+            B = B.base
+        while V.base is not None:
+            V = V.base
+        self.assertIs(B, V)
+
+    def test_PhotometryClass_combine_phot_is_cached(self):
+        x = pcc.classes.PhotometryClass()
+        x.load(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"))
+
+        full_phot = x.get_full_phot()
+        self.assertEqual(len(full_phot), len(x.phot))
+        self.assertIs(x.get_full_phot(), full_phot)
+
+        x._combine_phot()
+        x._combine_phot()
+        self.assertIs(x.data["full"], full_phot)
+
+        x.nightaverage()
+        self.assertEqual(len(x.get_full_phot()), len(x.phot))
+
+        ## tables that aren't views are noticed when they are replaced, even by one of the same length
+        x.load_phot_dict(dict((filter_name, x.data[filter_name].copy()) for filter_name in x.data_filters))
+        full_phot = x.get_full_phot()
+        self.assertIs(x.get_full_phot(), full_phot)
+        B = x.data["BessellB"].copy()
+        B["flux"] = 2. * B["flux"]
+        x.data["BessellB"] = B
+        self.assertTrue(np.isclose(np.sum(x.get_full_phot()["flux"]), np.sum(full_phot["flux"]) + np.sum(B["flux"]) / 2.,
+                                   rtol=1e-12, atol=0.))
+
+    def test_PhotometryArraysClass_tables_are_views(self):
+        x = pcc.classes.PhotometryClass()
+        x.load(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"))
+
+        ## nothing built until it is looked up, then sharing the arrays' memory
+        self.assertIsInstance(x.data, pcc.classes.PhotometryDataClass)
+        self.assertIsNone(x.data._tables["BessellB"])
+        self.assertTrue(np.shares_memory(x.data["BessellB"]["flux"], x.arrays.flux))
+        self.assertEqual(x.arrays.filter_code.dtype, np.uint8)
+
+        order = np.lexsort((x.phot["MJD"], x.phot["filter"]))
+        all_phot = x.arrays.get_table()
+        for name in ("MJD", "flux", "flux_err", "filter"):
+            self.assertTrue(np.array_equal(all_phot[name], x.phot[name][order]))
+            self.assertEqual(all_phot[name].unit, x.phot[name].unit)
+        self.assertTrue(np.array_equal(x.arrays.get_time("BessellV").mjd, x.data["BessellV"]["MJD"]))
+
+    def test_PhotometryStoreClass_matches_files(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            store = pcc.functions.make_phot_store(os.path.join(store_dir, "phot"))
+
+            x = pcc.classes.PhotometryClass()
+            x.load(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"))
+            y = store.get_photometry("SN1993J")
+            self.assertEqual(list(x.data.keys()), list(y.data.keys()))
+            for filter_name in x.data:
+                self.assertTrue(np.array_equal(np.sort(x.data[filter_name]["flux"]), np.sort(y.data[filter_name]["flux"])))
+
+            mjd = np.asarray(store.columns["MJD"])
+            in_band = np.asarray(store.columns["filter"]) == "BessellV"
+            in_window = np.logical_and(mjd >= 49100., mjd <= 49200.)
+            self.assertEqual(len(store.get_phot(filter_name="BessellV")), np.sum(in_band))
+            self.assertEqual(len(store.get_phot(mjd_min=49100., mjd_max=49200.)), np.sum(in_window))
+            self.assertEqual(len(store.get_phot(filter_name="BessellV", mjd_min=49100., mjd_max=49200.)),
+                             np.sum(in_band & in_window))
+
+    def test_make_phot_store_only_replaces_stores(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            lc_dir = os.path.join(store_dir, "lc")
+            os.makedirs(lc_dir)
+            self.assertRaises(pcc.errors.PathError, pcc.functions.make_phot_store, os.path.join(store_dir, "phot"),
+                              lc_dir=lc_dir)
+
+            shutil.copy(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"), lc_dir)
+            other_dir = os.path.join(store_dir, "other")
+            os.makedirs(other_dir)
+            open(os.path.join(other_dir, "keep.txt"), "w").close()
+            self.assertRaises(pcc.errors.PathError, pcc.functions.make_phot_store, other_dir, lc_dir=lc_dir)
+            self.assertTrue(os.path.isfile(os.path.join(other_dir, "keep.txt")))
+
+            ## an existing store is swapped for the new one
+            pcc.functions.make_phot_store(os.path.join(store_dir, "phot"), lc_dir=lc_dir)
+            store = pcc.functions.make_phot_store(os.path.join(store_dir, "phot"), lc_dir=lc_dir)
+            self.assertEqual(len(store), 607)
+            self.assertEqual(sorted(os.listdir(store_dir)), ["lc", "other", "phot"])
+
+            sn = pcc.classes.SNClass("SN1993J")
+            sn.load_phot(store=store)
+            self.assertEqual(len(sn.phot.phot), 607)
+            self.assertRaises(pcc.errors.CustomValueError, pcc.classes.SNClass("SN2005bf").load_phot, store=store)
+
     def test_PhotometryClass_get_and_plot_1993J(self):
         x = pcc.classes.PhotometryClass()
         x.load(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"))
         fig = x.plot(return_figure=True)
         self.assertIsInstance(fig, mpl.figure.Figure)
 
+    def test_PhotometryClass_nightaverage_matches_weighted_mean(self):
+        x = pcc.classes.PhotometryClass()
+        x.load(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"))
+        B = x.data["BessellB"]
+        nights = np.round(np.asarray(B["MJD"]))
+        first = nights == nights[0]
+        weights = 1. / np.asarray(B["flux_err"][first])**2
+
+        x.nightaverage()
+        self.assertEqual(len(x.data["BessellB"]), len(np.unique(nights)))
+        self.assertAlmostEqual(x.data["BessellB"]["MJD"][0], np.mean(B["MJD"][first]))
+        self.assertAlmostEqual(x.data["BessellB"]["flux"][0] / np.average(B["flux"][first], weights=weights), 1.)
+        self.assertAlmostEqual(x.data["BessellB"]["flux_err"][0] / np.sqrt(1. / np.sum(weights)), 1.)
+
+        n_nights = len(x.phot)
+        x.nightaverage(bin_width=2.)
+        self.assertLess(len(x.phot), n_nights)
+
+    def test_PhotometryClass_nightaverage_one_filter_keeps_the_rest(self):
+        x = pcc.classes.PhotometryClass()
+        x.load(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"))
+        V = np.asarray(x.data["BessellV"]["flux"])
+        n_B = len(x.data["BessellB"])
+
+        x.nightaverage(filters="BessellB")
+        self.assertLess(len(x.data["BessellB"]), n_B)
+        self.assertTrue(np.array_equal(np.asarray(x.data["BessellV"]["flux"]), V))
+        self.assertEqual(sorted(x.filter_names), sorted(x.data_filters.keys()))
+        self.assertEqual(len(x.phot), sum(len(x.data[filter_key]) for filter_key in x.data_filters))
+
     # def LOAD FROM FILE
 
     # classes.SpectrumClass
@@ -188,6 +325,72 @@ class TestClass(unittest.TestCase):
         self.assertEqual(os.path.abspath(os.path.join(x._get_data_directory(), os.pardir)),
                          os.path.abspath(pcc.defaults._default_data_dir_path))
 
+    def test_SpectrumClass_load_cache_matches_text(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            x = pcc.classes.SpectrumClass()
+            x.load("SN1993J/1993J_-3.0.txt", cache_dir=False)
+            for i in range(2):
+                y = pcc.classes.SpectrumClass()
+                y.load("SN1993J/1993J_-3.0.txt", cache_dir=cache_dir)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+                self.assertTrue(np.array_equal(x.wavelength, y.wavelength))
+                self.assertTrue(np.array_equal(x.flux, y.flux))
+                self.assertEqual(x.flux_unit, y.flux_unit)
+
+    def test_spectrum_archive_matches_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, "spec", "SN1993J"))
+            shutil.copy(os.path.join(pcc.defaults._default_data_dir_path, "spec/SN1993J/1993J_-3.0.txt"),
+                        os.path.join(tmp_dir, "spec", "SN1993J"))
+            archive = pcc.functions.make_spectrum_archive(os.path.join(tmp_dir, "spec.arc"), data_dir=tmp_dir,
+                                                          list_dir=False, recon_dir=False, specphase_dir=False)
+            self.assertEqual(len(archive), 1)
+
+            x = pcc.classes.SpectrumClass()
+            x.load("SN1993J/1993J_-3.0.txt")
+            S = archive.get_spectrum("1993J_-3.0.txt")
+            self.assertTrue(np.array_equal(x.wavelength, S.wavelength))
+            self.assertTrue(np.array_equal(x.flux, S.flux))
+            self.assertTrue(np.shares_memory(S.flux, archive.data))
+            del archive, S
+
+    def test_spectrum_archive_matches_list_on_full_path(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for snname in ("SN1993J", "SN1993Jcopy"):
+                os.makedirs(os.path.join(tmp_dir, "data", "spec", snname))
+                shutil.copy(os.path.join(pcc.defaults._default_data_dir_path, "spec/SN1993J/1993J_-3.0.txt"),
+                            os.path.join(tmp_dir, "data", "spec", snname))
+            os.makedirs(os.path.join(tmp_dir, "lists"))
+            with open(os.path.join(tmp_dir, "lists", "SN1993J.list"), "w") as f:
+                f.write("data/spec/SN1993J/1993J_-3.0.txt SN1993J 49071.0 0.0\n")
+
+            path = os.path.join(tmp_dir, "spec.arc")
+            archive = pcc.functions.make_spectrum_archive(path, data_dir=os.path.join(tmp_dir, "data"),
+                                                          list_dir=os.path.join(tmp_dir, "lists"), recon_dir=False,
+                                                          specphase_dir=False, coco_dir=tmp_dir)
+            mjd_obs = dict(zip(archive.index["snname"], archive.index["mjd_obs"]))
+            self.assertEqual(mjd_obs["SN1993J"], 49071.0)
+            self.assertTrue(np.isnan(mjd_obs["SN1993Jcopy"]))
+            self.assertEqual(sorted(i for i in os.listdir(tmp_dir) if i.startswith("spec.arc")),
+                             ["spec.arc", "spec.arc.index"])
+            del archive
+
+    def test_SpectrumClass_arrays_are_plain_and_share_memory_with_data(self):
+        x = pcc.classes.SpectrumClass()
+        x.load("SN1993J/1993J_-3.0.txt")
+        self.assertIs(type(x.flux), np.ndarray)
+        self.assertEqual(x.flux.dtype, np.float64)
+        self.assertTrue(np.shares_memory(x.flux, x.data["flux"]))
+        self.assertEqual(x.get_quantity("wavelength").unit, u.angstrom)
+
+    def test_LazySpectrumClass_matches_SpectrumClass(self):
+        x = pcc.classes.SpectrumClass()
+        x.load("SN1993J/1993J_-3.0.txt")
+        y = pcc.classes.LazySpectrumClass("SN1993J/1993J_-3.0.txt")
+        self.assertEqual((x.min_wavelength, x.max_wavelength), (y.min_wavelength, y.max_wavelength))
+        self.assertFalse("data" in y.__dict__)
+        self.assertTrue(np.array_equal(x.flux, y.flux))
+
     # def test_SpectrumClass_get_data_dir_returns_default_spec_dir(self):
     #     x = pcc.classes.SpectrumClass()
     #     self.assertEqual(os.path.abspath(x._get_data_directory()),
@@ -244,6 +447,86 @@ class TestClass(unittest.TestCase):
             self.assertAlmostEqual(i[0], i[1])
             # self.assertAlmostEqual(expected, np.array(S.specphot["flux"]), 3)
 
+    def test_SNClass_load_spec_with_max_workers_keeps_order(self):
+        snname = "SN1993J"
+
+        listfile = os.path.join(pcc.defaults._default_list_dir_path, snname + ".list")
+
+        sn = pcc.classes.SNClass(snname)
+        sn.load_list(listfile)
+        sn.load_spec()
+
+        sn_threaded = pcc.classes.SNClass(snname)
+        sn_threaded.load_list(listfile)
+        sn_threaded.load_spec(max_workers=4)
+
+        self.assertEqual(list(sn.spec.keys()), list(sn_threaded.spec.keys()))
+        for spec_key in sn.spec:
+            self.assertEqual(sn.spec[spec_key].mjd_obs, sn_threaded.spec[spec_key].mjd_obs)
+            self.assertTrue(np.array_equal(sn.spec[spec_key].flux, sn_threaded.spec[spec_key].flux))
+
+    def test_SNClass_recon_loaders_with_max_workers_keep_order(self):
+        snname = "SN1993J"
+        wavelength = np.arange(3000., 9000., 10.)
+        coco_root_dir = os.environ.get("COCO_ROOT_DIR")
+
+        with tempfile.TemporaryDirectory() as coco_dir:
+            recon_dir = os.path.join(coco_dir, "recon")
+            os.makedirs(recon_dir)
+            for i in range(4):
+                np.savetxt(os.path.join(recon_dir, snname + "_4907" + str(i) + ".000000.spec"),
+                           np.column_stack((wavelength, (i + 1.) * np.ones(len(wavelength)), np.zeros(len(wavelength)))),
+                           header="data/spec/" + snname + "/1993J_" + str(i) + ".txt", fmt="%.5e")
+
+            os.environ["COCO_ROOT_DIR"] = coco_dir
+            try:
+                sn = pcc.classes.SNClass(snname)
+                sn.list = {"spec_path": np.array(["data/spec/" + snname + "/1993J_0.txt"]),
+                           "mjd_obs": np.array([49070.])}
+                sn_threaded = pcc.classes.SNClass(snname)
+                sn_threaded.list = sn.list
+
+                sn.get_specfit()
+                sn_threaded.get_specfit(max_workers=4)
+                sn.load_mangledspec(spec_dir_path=recon_dir)
+                sn_threaded.load_mangledspec(spec_dir_path=recon_dir, max_workers=4)
+                sn.load_simspec(spec_dir_path=recon_dir)
+                sn_threaded.load_simspec(spec_dir_path=recon_dir, max_workers=4)
+                sn.load_reconspec(spec_dir_path=recon_dir)
+                sn_threaded.load_reconspec(spec_dir_path=recon_dir, max_workers=4)
+            finally:
+                if coco_root_dir is None:
+                    del os.environ["COCO_ROOT_DIR"]
+                else:
+                    os.environ["COCO_ROOT_DIR"] = coco_root_dir
+
+        self.assertEqual(sorted(sn.specfit.keys())[0].split("_")[0], snname)
+        for name in ("specfit", "mangledspec", "sim_spec", "recon_spec"):
+            spectra, spectra_threaded = getattr(sn, name), getattr(sn_threaded, name)
+            self.assertEqual(len(spectra), 4)
+            self.assertEqual(list(spectra.keys()), list(spectra_threaded.keys()))
+            for spec_key in spectra:
+                self.assertTrue(np.array_equal(spectra[spec_key].flux, spectra_threaded[spec_key].flux))
+        self.assertEqual([sn.specfit[spec_key].orig_specpath for spec_key in sn.specfit],
+                         ["1993J_" + spec_key.split("_")[1][4] + ".txt" for spec_key in sn.specfit])
+
+    def test_SpectrumStackClass_matches_individual_spectra(self):
+        snname = "SN1993J"
+
+        sn = pcc.classes.SNClass(snname)
+        sn.load_list(os.path.join(pcc.defaults._default_list_dir_path, snname + ".list"))
+        sn.load_spec()
+
+        stack = pcc.classes.SpectrumStackClass(sn.spec)
+        self.assertEqual(stack.names, list(sn.spec.keys()))
+        self.assertEqual(stack.flux.shape, (len(sn.spec), len(stack.wavelength)))
+
+        bank = pcc.classes.FilterBankClass(["BessellB", "BessellV", "BessellR"])
+        flux, mask = stack.get_specphot(bank)
+        expected, expected_mask = bank.get_batch_specphot(sn.spec)
+        self.assertTrue(np.array_equal(mask, expected_mask))
+        np.testing.assert_allclose(flux[~mask], expected[~mask], rtol = 1e-3)
+
     # specfitClass
 
     # def test_specfitClass
@@ -306,8 +589,231 @@ class TestClass(unittest.TestCase):
 
         self.assertEqual(sum(success), 6)
 
+    def test_filter_registry_returns_shared_filter(self):
+        path_to_filter = os.path.join(os.path.abspath(pcc.defaults._default_filter_dir_path), "BessellV.dat")
+        V1 = pcc.functions.load_filter(path_to_filter)
+        V2 = pcc.classes.get_filter(filter_name="BessellV", filter_dir=pcc.defaults._default_filter_dir_path)
+        self.assertIs(V1, V2)
+
+    def test_filter_registry_reloads_changed_filter(self):
+        with tempfile.TemporaryDirectory() as filter_dir:
+            path_to_filter = os.path.join(filter_dir, "BessellB.dat")
+            shutil.copy(os.path.join(pcc.defaults._default_filter_dir_path, "BessellB.dat"), path_to_filter)
+            B1 = pcc.classes.get_filter(path_to_filter)
+            mtime = os.path.getmtime(path_to_filter)
+            os.utime(path_to_filter, (mtime + 10, mtime + 10))
+            B2 = pcc.classes.get_filter(path_to_filter)
+        self.assertIsNot(B1, B2)
+        self.assertEqual(round(float(B1._upper_edge), 2), round(float(B2._upper_edge), 2))
+
+    def test_get_resampled_throughput_does_not_change_filter(self):
+        B = pcc.functions.load_filter(os.path.join(pcc.defaults._default_filter_dir_path, "BessellB.dat"),
+                                      use_registry=False)
+        wavelength = np.array(B.wavelength)
+        new_wavelength = np.arange(3000., 6000., 10.)
+        throughput = B.get_resampled_throughput(new_wavelength)
+        self.assertTrue(np.array_equal(np.array(B.wavelength), wavelength))
+        self.assertIs(throughput, B.get_resampled_throughput(new_wavelength.copy()))
+        B.resample_response(new_wavelength=new_wavelength)
+        self.assertTrue(np.array_equal(B.throughput, throughput))
+
+    def test_filter_bank_matches_filters(self):
+        bank = pcc.classes.FilterBankClass(["BessellB", "BessellV"])
+        self.assertEqual(bank.throughput.shape, (2, len(bank.wavelength)))
+        for i, filter_name in enumerate(bank.filter_names):
+            filter_object = pcc.classes.get_filter(filter_name=filter_name)
+            self.assertAlmostEqual(bank.zp_AB[i], filter_object.zp_AB)
+            self.assertAlmostEqual(bank.area[i], filter_object._effective_area)
+
+    def test_filter_bank_batch_specphot(self):
+        bank = pcc.classes.FilterBankClass(["BessellB", "BessellV"])
+        wavelength = np.arange(4500., 9000., 5.)
+        flux, mask = bank.get_batch_specphot(np.vstack((np.ones(len(wavelength)), 2.*np.ones(len(wavelength)))),
+                                             wavelength=wavelength)
+        self.assertEqual(flux.shape, (2, 2))
+        self.assertTrue(np.allclose(flux[1], 2.*flux[0]))
+        self.assertEqual(mask.tolist(), [[True, False], [True, False]])
+
+    def test_SNClass_get_specphot_sets_overlapping_filters(self):
+        sn = pcc.classes.SNClass("SN2005bf")
+        sn.load_phot()
+        sn.load_list(os.path.join(pcc.defaults._default_list_dir_path, "SN2005bf.list"))
+        sn.load_spec()
+        sn.get_specphot()
+        for spec in sn.spec:
+            self.assertEqual(sn.spec[spec]._n_overlapping_filters, len(sn.spec[spec]._overlapping_filter_list))
+            self.assertIn("BessellV", sn.spec[spec]._overlapping_filter_list)
+        sn.get_simplespecphot()
+
+    def test_calc_overlap_matrix(self):
+        overlaps = pcc.utils.calc_overlap_matrix([[3000., 9000.], [5000., 10000.]],
+                                                 [[3500., 5500.], [5500., 7000.], [8000., 9500.]])
+        self.assertEqual(overlaps.tolist(), [[True, True, False], [False, True, True]])
+
+    def test_group_by_grid(self):
+        wavelength = np.arange(3000., 9000., 10.)
+        grids = pcc.utils.group_by_grid([wavelength, wavelength * u.angstrom, wavelength[1:], wavelength.copy()])
+        self.assertEqual([group for grid, group in grids], [[0, 1, 3], [2]])
+        self.assertTrue(np.array_equal(grids[1][0], wavelength[1:]))
+
+    def test_calc_linear_product_weights_is_grid_independent(self):
+        wavelength = np.array([4000., 5000., 6000., 7000.])
+        flux = np.array([1., 3., 2., 4.])
+        filter_wavelength = np.array([4500., 5500., 6500.])
+        filter_throughput = np.array([0.0, 1.0, 0.0])
+        weights = pcc.utils.calc_linear_product_weights(wavelength, filter_wavelength, filter_throughput)
+        self.assertAlmostEqual(np.sum(weights), 1000.)
+
+        fine_wavelength = np.arange(4000., 7001., 10.)
+        fine_weights = pcc.utils.calc_linear_product_weights(fine_wavelength, filter_wavelength, filter_throughput)
+        self.assertAlmostEqual(np.dot(weights, flux), np.dot(fine_weights, np.interp(fine_wavelength, wavelength, flux)))
+
+    def test_support_slice_integral_matches_full_grid(self):
+        from scipy.integrate import simps
+        V = pcc.classes.get_filter(filter_name="BessellV")
+        wavelength = np.arange(3001., 10000., 2.)
+        flux = np.exp(-wavelength/5000.)
+        support = V.get_support_slice(wavelength)
+        self.assertLess(support.stop - support.start, len(wavelength)/2)
+        self.assertAlmostEqual(simps(V.get_resampled_throughput(wavelength) * flux, wavelength),
+                               simps(V.get_resampled_throughput(wavelength[support]) * flux[support], wavelength[support]))
+
+    def test_read_columns_matches_ascii_reader(self):
+        from astropy.table import Table
+        path = os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat")
+        self.assertEqual(pcc.utils.sniff_columns(path), (4, ("MJD", "flux", "flux_err", "filter")))
+        old = Table.read(path, format="ascii")
+        new = pcc.utils.read_columns_table(path)
+        self.assertEqual(old.colnames, new.colnames)
+        for colname in old.colnames:
+            self.assertTrue(np.array_equal(old[colname], new[colname]))
+        self.assertEqual(old.meta["comments"], new.meta["comments"])
+
+    def test_write_columns_matches_ascii_writer(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            x = pcc.classes.PhotometryClass()
+            x.load(os.path.join(pcc.defaults._default_data_dir_path, "lc/SN1993J.dat"))
+            save_table = x._phot_format_for_save()
+            save_table["flux"][:3] = [np.nan, np.inf, -0.]
+            save_table.meta["comments"] = ["a comment"]
+
+            for header, fmt in [(True, "ascii.fast_commented_header"), (False, "ascii.no_header")]:
+                save_table.write(os.path.join(out_dir, "astropy.dat"), format=fmt, overwrite=True)
+                pcc.utils.write_table(os.path.join(out_dir, "fast.dat"), save_table, header=header, overwrite=True)
+                with open(os.path.join(out_dir, "astropy.dat"), "rb") as f, open(os.path.join(out_dir, "fast.dat"), "rb") as g:
+                    self.assertEqual(f.read(), g.read())
+
+            ## nothing is written if any of the files are already there
+            paths = [os.path.join(out_dir, "new.dat"), os.path.join(out_dir, "fast.dat")]
+            columns = [pcc.utils.read_columns(path)[0] for path in paths[1:] * 2]
+            self.assertRaises(OSError, pcc.utils.write_columns_files, paths, columns)
+            self.assertFalse(os.path.isfile(paths[0]))
+
+    def test_calc_quadrature_weights_matches_simps(self):
+        from scipy.integrate import simps, trapz
+        wavelength = np.cumsum(np.linspace(1., 3., 20))
+        flux = np.sin(wavelength)
+        for n in [19, 20]:
+            self.assertAlmostEqual(np.dot(pcc.utils.calc_quadrature_weights(wavelength[:n]), flux[:n]),
+                                   simps(flux[:n], wavelength[:n]))
+            self.assertAlmostEqual(np.dot(pcc.utils.calc_quadrature_weights(wavelength[:n], method="trapz"), flux[:n]),
+                                   trapz(flux[:n], wavelength[:n]))
+
+    def test_rebin_flux_conserves_flux(self):
+        wavelength = np.cumsum(np.linspace(1., 3., 200)) + 3000.
+        flux = np.sin(wavelength/100.) + 2.
+        new_wavelength = np.linspace(3100., 3300., 37)
+
+        new_flux, covered = pcc.utils.rebin_flux(wavelength, flux, new_wavelength)
+        self.assertTrue(covered.all())
+
+        edges = pcc.utils.calc_bin_edges(wavelength)
+        new_edges = pcc.utils.calc_bin_edges(new_wavelength)
+        overlap = np.clip(np.minimum(edges[1:], new_edges[-1]) - np.maximum(edges[:-1], new_edges[0]), 0., None)
+        self.assertAlmostEqual(np.sum(new_flux * np.diff(new_edges)), np.sum(flux * overlap))
+
+        flux[100] = np.nan
+        new_flux, covered = pcc.utils.rebin_flux(wavelength, np.vstack((flux, flux)), new_wavelength)
+        self.assertEqual(new_flux.shape, (2, 37))
+        self.assertTrue(np.array_equal(np.isnan(new_flux), ~covered))
+        self.assertTrue(0 < np.sum(~covered[0]) < 37)
+
+    def test_zeropoint_table_matches_calculated_zeropoint(self):
+        with tempfile.TemporaryDirectory() as filter_dir:
+            path_to_filter = os.path.join(filter_dir, "BessellB.dat")
+            shutil.copy(os.path.join(pcc.defaults._default_filter_dir_path, "BessellB.dat"), path_to_filter)
+            pcc.utils.make_zeropoint_table(filter_dir=filter_dir)
+            row = pcc.utils.get_zeropoint_table_row(path_to_filter)
+
+            B = pcc.classes.FilterClass()
+            B.read_filter_file(path_to_filter, use_table=False)
+            self.assertEqual(row["zp_AB"], B.zp_AB)
+            self.assertEqual(row["area"], B._effective_area)
+
+            with open(path_to_filter, "a") as outfile:
+                outfile.write("\n")
+            self.assertIsNone(pcc.utils.get_zeropoint_table_row(path_to_filter))
+
+    ## extinction tests
+
+    def test_extinction_coeffs_matches_ccm_formulae(self):
+        x = np.array([0.2, 0.5, 1.82, 2.5, 3.3, 5., 9.])
+        for odonnell in [False, True]:
+            coeffs = pcc.extinction.coeffs(x, odonnell=odonnell)
+            self.assertTrue(np.array_equal(coeffs["x"], x[1:-1]))
+            self.assertEqual(coeffs["a"][0], 0.574*np.power(0.5, 1.61))
+            self.assertEqual(coeffs["b"][0], -0.527*np.power(0.5, 1.61))
+            self.assertEqual(coeffs["a"][1], 1.)
+            self.assertEqual(coeffs["b"][1], 0.)
+            a = np.poly1d(pcc.extinction._odonnell_a_coefficients if odonnell else pcc.extinction._cardelli_a_coefficients)
+            self.assertEqual(coeffs["a"][2], a(2.5 - 1.82))
+            self.assertEqual(coeffs["a"][4], 1.752 - 0.316*5. - 0.104/((5.-4.7)**2 + 0.341))
+
+    def test_extinction_deredden_EBV_grid_matches_loop(self):
+        wavelength = np.linspace(3000., 10000., 500)
+        flux = np.linspace(1., 2., 500)
+        self.assertIs(pcc.extinction.get_extinction_curve(wavelength), pcc.extinction.get_extinction_curve(wavelength))
+
+        EBV_host = np.linspace(0., 1., 5)
+        grid = pcc.extinction.deredden(wavelength, flux, 0.05, EBV_MW=0.03, EBV_host=EBV_host)
+        self.assertEqual(grid.shape, (5, 500))
+        for i, EBV in enumerate(EBV_host):
+            self.assertTrue(np.array_equal(grid[i], pcc.extinction.deredden(wavelength, flux, 0.05, EBV_MW=0.03,
+                                                                             EBV_host=EBV)))
+
+    def test_SNClass_deredden_spec_matches_each_spectrum(self):
+        import copy
+        sn = pcc.classes.SNClass("SN2005bf")
+        sn.load_list(os.path.join(pcc.defaults._default_list_dir_path, "SN2005bf.list"))
+        sn.load_spec()
+        spec_keys = list(sn.spec)
+        sn.spec[spec_keys[0]].set_EBV(0.2)
+        expected = {}
+        for spec_key in spec_keys:
+            spectrum = copy.deepcopy(sn.spec[spec_key])
+            spectrum.deredden(0., 0.1)
+            expected[spec_key] = spectrum.flux_dered
+
+        ## z = 0 is a redshift, rather than falling back on self.z
+        sn.deredden_spec(0.1, z=0.)
+        for spec_key in spec_keys:
+            self.assertTrue(np.allclose(sn.spec[spec_key].flux_dered, expected[spec_key]))
+
     ## kcorr tests
 
+    def test_kcorr_mangle_anchors_use_AB_grid_edges(self):
+        ## the anchors are anchor_distance outside the outermost edges, found on the AB grid
+        filters = ["BessellB", "SDSS_g", "BessellV", "SDSS_r"]
+        mangle_filters = [pcc.kcorr._get_mangle_filter(filter_name) for filter_name in filters]
+        anchor_distance = 100.
+        self.assertAlmostEqual(np.nanmin([f._lower_edge for f in mangle_filters]) - anchor_distance, 3701.3298147, places=5)
+        self.assertAlmostEqual(np.nanmax([f._upper_edge for f in mangle_filters]) + anchor_distance, 6856.0488779, places=5)
+
+        ## the shared filter keeps the edges of its own grid
+        B = pcc.classes.get_filter(filter_name="BessellB")
+        self.assertIsNot(mangle_filters[0], B)
+        self.assertAlmostEqual(float(B._lower_edge), 3785.0, places=1)
+
     def test_kcorr_load_AB_pseudospectrum(self):
         ABspec = pcc.kcorr.load_AB()
         self.assertEqual(ABspec.success, True)
@@ -316,6 +822,11 @@ class TestClass(unittest.TestCase):
         Vegaspec = pcc.kcorr.load_vega()
         self.assertEqual(Vegaspec.success, True)
 
+    def test_kcorr_AB_pseudospectrum_is_shared_and_read_only(self):
+        ABspec = pcc.kcorr.load_AB()
+        self.assertIs(ABspec, pcc.kcorr.load_AB())
+        self.assertFalse(ABspec.flux.flags.writeable)
+
     def test_dark_sky_spectrum_exists(self):
         dark_sky_path = os.path.join(os.environ["LSST_THROUGHPUTS_BASELINE"], "darksky.dat")
         print(dark_sky_path)
@@ -7,30 +7,62 @@ date: 28-02-2016
 
 from __future__ import print_function
 
+import hashlib
+import itertools
 import os
+import re
 import sys
 import warnings
 import urllib
 import tarfile
+from collections import OrderedDict
 
 import matplotlib.pyplot as plt
+import numpy as np
 from astropy import units as u
 from astropy.table import Table, Column
-from numpy import savetxt, array, arange, where, array_equiv, exp, sort, asarray, zeros, nanmin, nanmax, unique, char
+from numpy import savetxt, array, arange, where, array_equiv, exp, sort, asarray, zeros, nanmin, nanmax, unique, char, \
+    logical_and, newaxis
 
 # from .defaults import *
 # from .errors import *
 from . import defaults
 from . import errors
 
+_zeropoint_table_filename = "zeropoints.dat"
+_zeropoint_table_names = ("filename", "filter_name", "md5", "lambda_effective", "area",
+                          "lower_edge", "upper_edge", "zp_AB", "zp_vega")
+_zeropoint_tables = {}
+
 __all__ = ["setup_plot_defaults",
            "relist",
+           "make_zeropoint_table",
+           "read_zeropoint_table",
+           "get_zeropoint_table_row",
            "load_coords",
            "check_dir_path",
            "check_file_path",
            "read_list_file",
            "load_formatted_phot",
            "strictly_increasing",
+           "map_ordered",
+           "sniff_columns",
+           "read_columns",
+           "read_columns_table",
+           "format_columns",
+           "write_columns",
+           "write_columns_files",
+           "write_table",
+           "read_spectrum_extent",
+           "get_spectrum_cache_path",
+           "read_spectrum_cache",
+           "write_spectrum_cache",
+           "calc_overlap_matrix",
+           "group_by_grid",
+           "calc_linear_product_weights",
+           "calc_bin_edges",
+           "rebin_flux",
+           "calc_quadrature_weights",
            "check_list",
            "check_all_lists",
            "specphot_out_to_ap_table",
@@ -75,15 +107,10 @@ def _get_filters(filter_dir=False):
     if not filter_dir:
         filter_dir = _get_filter_directory()
 
-    file_list = os.listdir(filter_dir)
-
-    for filter_file in file_list:
-        if not os.path.isfile(os.path.join(filter_dir, filter_file)):
-            file_list.remove(filter_file)
-        elif filter_file[0] == ".":
-            file_list.remove(filter_file)
-        elif filter_file == "list.txt":
-            file_list.remove(filter_file)
+    file_list = [filter_file for filter_file in os.listdir(filter_dir)
+                 if os.path.isfile(os.path.join(filter_dir, filter_file))
+                 and filter_file[0] != "."
+                 and filter_file not in ["list.txt", _zeropoint_table_filename]]
 
     return asarray(file_list)
 
@@ -135,8 +162,11 @@ def _check_filters(filter_dir=False, verbose = False):
     return array_equiv(current_arr, filter_arr)
 
 
-def make_list_dot_txt():
+def make_list_dot_txt(zeropoints = True, verbose = False):
     """
+    Writes list.txt for the filter directory and, by default, brings the
+    zeropoint table (see make_zeropoint_table) up to date alongside it.
+
     Parameters
     ----------
 
@@ -147,6 +177,9 @@ def make_list_dot_txt():
     outpath = os.path.join(filter_dir, "list.txt")
     new_list = _get_filters()
     savetxt(outpath, new_list, fmt = "%s")
+
+    if zeropoints:
+        make_zeropoint_table(filter_dir = filter_dir, verbose = verbose)
     pass
 
 
@@ -158,15 +191,148 @@ def relist(force = False, verbose = False):
     Returns
     -------
     """
-    if verbose: print(force, _check_filters())
-    if force or not _check_filters():
+    if verbose: print(force, _check_filters(), _check_zeropoint_table())
+    if force or not _check_filters() or not _check_zeropoint_table():
         if verbose: print("updating list.txt")
-        make_list_dot_txt()
+        make_list_dot_txt(verbose = verbose)
     else:
         print("current list.txt is up to date. re run with force = True to force.")
     pass
 
 
+def _get_file_hash(path):
+    """
+    md5 of the file contents - used to spot filter files that have changed.
+    """
+    with open(path, "rb") as infile:
+        return hashlib.md5(infile.read()).hexdigest()
+
+
+def read_zeropoint_table(filter_dir = False, verbose = False):
+    """
+    Reads the zeropoint table written by make_zeropoint_table for `filter_dir`
+    ($PYCOCO_FILTER_DIR by default). The table is kept in memory, and only
+    re-read if the file is rewritten.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    AstroPy Table, or None if there isn't one.
+    """
+    if not filter_dir:
+        filter_dir = _get_filter_directory()
+
+    path = os.path.abspath(os.path.join(filter_dir, _zeropoint_table_filename))
+
+    if not os.path.isfile(path):
+        if verbose: print("no zeropoint table at", path)
+        return None
+
+    mtime = os.path.getmtime(path)
+    if path not in _zeropoint_tables or _zeropoint_tables[path][0] != mtime:
+        if verbose: print("reading", path)
+        zp_table = Table.read(path, format = "ascii.commented_header")
+        zp_table.add_index("filename")
+        _zeropoint_tables[path] = (mtime, zp_table)
+
+    return _zeropoint_tables[path][1]
+
+
+def get_zeropoint_table_row(path, verbose = False):
+    """
+    Looks up the filter file at `path` in the zeropoint table of the directory
+    it lives in.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    Row of the table, or None if the filter isn't in the table or has changed
+    since the table was made.
+    """
+    path = os.path.abspath(path)
+    zp_table = read_zeropoint_table(filter_dir = os.path.dirname(path), verbose = verbose)
+
+    if zp_table is None:
+        return None
+
+    filename = path.split("/")[-1]
+    if filename not in zp_table["filename"]:
+        if verbose: print(filename, "not in zeropoint table")
+        return None
+
+    row = zp_table.loc[filename]
+    if row["md5"] != _get_file_hash(path):
+        if verbose: print(filename, "has changed since the zeropoint table was made")
+        return None
+
+    return row
+
+
+def _check_zeropoint_table(filter_dir = False):
+    """
+    True if every filter in the directory has an up to date zeropoint table entry.
+    """
+    if not filter_dir:
+        filter_dir = _get_filter_directory()
+
+    return all([get_zeropoint_table_row(os.path.join(filter_dir, filter_file)) is not None
+                for filter_file in _get_filters(filter_dir)])
+
+
+def make_zeropoint_table(filter_dir = False, force = False, verbose = False):
+    """
+    Writes a table of the AB and Vega zeropoints, effective wavelengths, areas
+    and edges of every filter in `filter_dir` ($PYCOCO_FILTER_DIR by default)
+    to `zeropoints.dat` alongside list.txt. Only new or changed filters are
+    recalculated unless `force = True`.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    """
+    from . import kcorr ## kcorr imports utils
+
+    if not filter_dir:
+        filter_dir = _get_filter_directory()
+    check_dir_path(filter_dir)
+
+    rows = []
+    for filter_file in sort(_get_filters(filter_dir)):
+        path = os.path.join(filter_dir, filter_file)
+
+        row = None
+        if not force:
+            row = get_zeropoint_table_row(path, verbose = verbose)
+
+        if row is None:
+            if verbose: print("calculating zeropoints for", filter_file)
+            try:
+                row = kcorr.calc_filter_properties(path, verbose = verbose)
+            except Exception:
+                ## keep a row so that the table isn't seen as out of date forever
+                warnings.warn("Couldn't calculate zeropoints for " + path)
+                row = dict(zip(_zeropoint_table_names[3:], [float("nan")] * 6))
+                row["filename"] = filter_file
+                row["filter_name"] = filter_file.split(".")[0]
+                row["md5"] = _get_file_hash(path)
+
+        rows.append([row[name] for name in _zeropoint_table_names])
+
+    zp_table = Table(rows = rows, names = _zeropoint_table_names,
+                     dtype = (str, str, str, float, float, float, float, float, float))
+
+    outpath = os.path.join(filter_dir, _zeropoint_table_filename)
+    if verbose: print("writing", outpath)
+    zp_table.write(outpath, format = "ascii.commented_header", overwrite = True)
+    pass
+
+
 def load_coords(filename = "sncoordinates.list"):
     """
 
@@ -261,10 +427,299 @@ def read_list_file(path, names = ('spec_path', 'snname', 'mjd_obs', 'z'), verbos
     """
     check_file_path(path)
 
-    data = Table.read(path, names = names, format = 'ascii')
+    data = read_columns_table(path, names = names)
     return data
 
 
+def sniff_columns(path, comments = "#"):
+    """
+    Counts the whitespace separated columns on the first line of data in
+    `path` (the first line that isn't blank or a comment), and picks up the
+    column names from a commented header - the first comment line, if it has
+    the same number of entries, as in "# MJD flux flux_err filter" (as
+    astropy's ascii.commented_header does).
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    (ncols, header_names) - header_names is None if there isn't a header.
+    """
+    first_comment = None
+    with open(path, "r") as f:
+        for line in f:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith(comments):
+                if first_comment is None:
+                    first_comment = stripped[len(comments):].split()
+                continue
+
+            ncols = len(stripped.split())
+            if first_comment is not None and len(first_comment) == ncols:
+                return ncols, tuple(first_comment)
+            return ncols, None
+
+    return 0, None
+
+
+def read_columns(path, names = False, comments = "#", verbose = False):
+    """
+    Fast reader for the fixed layouts CoCo uses - whitespace separated columns,
+    with "#" comments - which sniffs the number of columns once (see
+    sniff_columns) and parses the file with astropy's C reader, rather than
+    guessing the format as Table.read(format = "ascii") does. Files the C
+    reader can't handle (e.g. with trailing tabs) are read as before.
+
+    Parameters
+    ----------
+    names : column names. Defaults to the commented header if there is one,
+        else col1, col2, ...
+
+    Returns
+    -------
+    (columns, comments) - an OrderedDict of name: numpy array, in file order,
+    and a list of the comment lines (without the header and "#"s), as
+    Table.read would put in meta["comments"].
+    """
+    from astropy.io import ascii
+
+    ncols, header_names = sniff_columns(path, comments = comments)
+
+    if not names:
+        names = header_names if header_names else tuple("col" + str(i + 1) for i in range(ncols))
+    elif len(names) != ncols:
+        raise errors.TableReadError(path + " has " + str(ncols) + " columns, not " + str(len(names)))
+
+    if verbose: print("reading", path, "as", names)
+
+    try:
+        table = ascii.read(path, format = "no_header", names = names, guess = False, fast_reader = True,
+                           comment = comments)
+    except (ascii.InconsistentTableError, ValueError) as e:
+        ## e.g. trailing tabs - leave it to the general reader
+        if verbose: print("fast reader failed on", path, ":", e)
+        table = Table.read(path, format = "ascii", names = names)
+
+    file_comments = list(table.meta.get("comments", []))
+    if header_names and file_comments:
+        ## the header isn't a comment
+        file_comments = file_comments[1:]
+
+    columns = OrderedDict((name, table[name].data) for name in table.colnames)
+
+    return columns, file_comments
+
+
+def read_columns_table(path, names = False, comments = "#", verbose = False):
+    """
+    read_columns, as an AstroPy Table with the comments in meta["comments"]
+    (if there are any) - a drop in for Table.read(path, format = "ascii").
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    AstroPy Table
+    """
+    columns, file_comments = read_columns(path, names = names, comments = comments, verbose = verbose)
+
+    table = Table(list(columns.values()), names = list(columns.keys()), copy = False)
+    if file_comments:
+        table.meta["comments"] = file_comments
+
+    return table
+
+
+def _get_write_format(format_string):
+    """
+    The %-format that gives what astropy's ascii writers write for a column
+    with format `format_string` ("5.5f", ".5g", ... or none) - the values are
+    stripped of whitespace, so the width is dropped. None for anything else.
+    """
+    if not format_string:
+        return "%s"
+    match = re.match(r"^%?([1-9]\d*)?(\.\d+)?([eEfFgG])$", format_string)
+    if match:
+        return "%" + (match.group(2) or "") + match.group(3)
+    return None
+
+
+def format_columns(columns, formats = False):
+    """
+    The rows of `columns` as astropy's ascii writers would write them -
+    formatted with a single %-format over all of the values, rather than
+    value by value. None if astropy would have to quote any of them
+    (strings that are empty or have spaces in), or the columns aren't plain
+    floats, ints or strings.
+
+    Parameters
+    ----------
+    columns : OrderedDict of name: array - Columns and Quantities are fine.
+
+    formats : dict of name: format, for those without their own.
+
+    Returns
+    -------
+    str, with a newline after each row, or None.
+    """
+    row_formats = []
+    values = []
+
+    for name in columns:
+        column = columns[name]
+        if not isinstance(column, (np.ndarray, list, tuple)) or np.ma.is_masked(column):
+            return None
+
+        if formats and name in formats:
+            format_string = formats[name]
+        else:
+            format_string = getattr(getattr(column, "info", None), "format", None)
+
+        data = np.asarray(getattr(column, "value", column))
+        if data.ndim != 1:
+            return None
+
+        if data.dtype.kind in "SU":
+            if format_string:
+                return None
+            if data.dtype.kind == "S":
+                data = char.decode(data)
+            data = data.tolist()
+            if not all(value and not re.search(r'[\s"]', value) for value in data):
+                return None
+            row_format = "%s"
+        elif data.dtype.kind in "biuf":
+            row_format = _get_write_format(format_string)
+            data = data.tolist()
+        else:
+            return None
+
+        if row_format is None:
+            return None
+        row_formats.append(row_format)
+        values.append(data)
+
+    if len(set(len(value) for value in values)) > 1:
+        raise ValueError("The columns aren't all the same length")
+
+    nrows = len(values[0]) if values else 0
+    return ((" ".join(row_formats) + "\n") * nrows) % tuple(itertools.chain.from_iterable(zip(*values)))
+
+
+def write_columns(path, columns, formats = False, comments = False, header = True, overwrite = False,
+                  verbose = False):
+    """
+    Fast writer for the fixed layouts CoCo uses - the counterpart of
+    read_columns - which writes the columns straight from their arrays (see
+    format_columns), byte for byte as astropy's ascii.fast_commented_header
+    writer (or ascii.no_header, with header = False) would from a Table of
+    them. Columns it can't format are left to astropy.
+
+    Parameters
+    ----------
+    columns : OrderedDict of name: array - Columns and Quantities (written
+        in their units) are fine.
+
+    formats : dict of name: format ("5.5f", ".5g", ...) - defaults to the
+        column's own format, if it has one.
+
+    comments : list of comment lines - after the header, as astropy does.
+
+    Returns
+    -------
+    """
+    if os.path.isfile(path) and not overwrite:
+        raise OSError("File " + path + " already exists. If you mean to replace it then use the argument "
+                      + "\"overwrite=True\".")
+
+    names = list(columns.keys())
+    rows = format_columns(columns, formats = formats)
+
+    if rows is None or any(len(name.split()) != 1 for name in names):
+        if verbose: print("leaving", path, "to astropy")
+        table = Table(list(columns.values()), names = names)
+        if formats:
+            for name in formats:
+                table[name].format = formats[name]
+        if comments:
+            table.meta["comments"] = list(comments)
+        table.write(path, format = "ascii.fast_commented_header" if header else "ascii.no_header",
+                    overwrite = overwrite)
+        return
+
+    lines = []
+    if header:
+        lines.append("# " + " ".join(names) + "\n")
+    if comments:
+        lines.extend("# " + str(comment) + "\n" for comment in comments)
+
+    if verbose: print("writing", path)
+    with open(path, "w") as outfile:
+        outfile.write("".join(lines) + rows)
+    pass
+
+
+def write_columns_files(paths, columns_list, formats = False, comments_list = False, header = True,
+                        overwrite = False, verbose = False):
+    """
+    write_columns for many files in one call - e.g. all of the mangled
+    spectra of a SN. All of the paths are checked before any are written,
+    so nothing is written if any would be clobbered without overwrite.
+
+    Parameters
+    ----------
+    paths : list of paths.
+
+    columns_list : list of OrderedDicts of columns, one per path.
+
+    comments_list : list of lists of comments, one per path.
+
+    Returns
+    -------
+    """
+    if len(paths) != len(columns_list) or (comments_list and len(comments_list) != len(paths)):
+        raise ValueError("Need one set of columns (and comments) per path")
+
+    if not overwrite:
+        existing = [path for path in paths if os.path.isfile(path)]
+        if existing:
+            raise OSError("Files " + ", ".join(existing) + " already exist. If you mean to replace them then "
+                          + "use the argument \"overwrite=True\".")
+
+    for i, path in enumerate(paths):
+        write_columns(path, columns_list[i], formats = formats, comments = comments_list[i] if comments_list else False,
+                      header = header, overwrite = True, verbose = verbose)
+    pass
+
+
+def write_table(path, table, names = False, header = True, overwrite = False, verbose = False):
+    """
+    write_columns for an AstroPy Table, using its column formats and
+    meta["comments"] - a drop in for table.write(path, format =
+    "ascii.fast_commented_header", names = names).
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    """
+
+    if not names:
+        names = table.colnames
+    elif len(names) != len(table.colnames):
+        raise ValueError("Need a name for each of the " + str(len(table.colnames)) + " columns")
+
+    columns = OrderedDict(zip(names, table.columns.values()))
+    write_columns(path, columns, comments = table.meta.get("comments", False), header = header,
+                  overwrite = overwrite, verbose = verbose)
+    pass
+
+
 def strictly_increasing(L):
     """https://stackoverflow.com/a/4983359"""
     return all(x<=y for x, y in zip(L, L[1:]))
@@ -365,7 +820,9 @@ def load_formatted_phot(path, format = "ascii", names = False,
 
     errors.StringWarning(path)
 
-    if names:
+    if format == "ascii":
+        phot_table = read_columns_table(path, names = names)
+    elif names:
         phot_table = Table.read(path, format = format, names = names)
     else:
         phot_table = Table.read(path, format = format)
@@ -456,6 +913,489 @@ def read_phasefile(filepath=os.path.join(defaults._default_coco_dir_path, "examp
     return Table.read(filepath, format="ascii", names=("snname", "z_obs", "mu"))
 
 
+def map_ordered(function, items, max_workers = False):
+    """
+    [function(item) for item in items], using a pool of max_workers threads
+    if max_workers is more than 1 - useful for reading many files where
+    waiting on the file system, rather than parsing, takes the time. The
+    results are in the same order as `items` either way, and the first
+    exception raised is raised here.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    list
+    """
+    items = list(items)
+
+    if not max_workers or max_workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers = min(max_workers, len(items))) as executor:
+        return list(executor.map(function, items))
+
+
+def read_spectrum_extent(path, comments = "#"):
+    """
+    First and last wavelengths in a spectrum file (the first column of the
+    first and last lines that aren't blank or comments), reading only the
+    ends of the file.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    (first, last) tuple of floats, or None if either line can't be parsed.
+    """
+    def _first_value(lines):
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith(comments):
+                try:
+                    return float(line.split()[0])
+                except ValueError:
+                    return None
+        return None
+
+    with open(path, "rb") as f:
+        head = f.read(4096)
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - 4096, 0))
+        tail = f.read()
+
+    head_lines = head.decode("utf-8", "replace").splitlines()
+    tail_lines = tail.decode("utf-8", "replace").splitlines()
+    if size > 4096:
+        ## the first line of each chunk could be cut short
+        head_lines = head_lines[:-1]
+        tail_lines = tail_lines[1:]
+
+    first = _first_value(head_lines)
+    last = _first_value(tail_lines[::-1])
+
+    if first is None or last is None:
+        return None
+    return first, last
+
+
+def get_spectrum_cache_path(path, cache_dir, fmt = "ascii", names = ("wavelength", "flux")):
+    """
+    Where the binary copy of the spectrum at `path` lives in `cache_dir`. The
+    name includes a hash of the absolute path, size and modification time of
+    the file (and the format and column names it is read with), so editing or
+    replacing the file means it is read again.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    String, path of the .npz file.
+    """
+    stat = os.stat(path)
+    key = "|".join([os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns), str(fmt), ",".join(names)])
+
+    return os.path.join(cache_dir, os.path.basename(path) + "." + hashlib.md5(key.encode("utf-8")).hexdigest() + ".npz")
+
+
+def read_spectrum_cache(cache_path, verbose = False):
+    """
+    Reads a spectrum written by write_spectrum_cache.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    AstroPy Table, or None if there isn't a (readable) copy at `cache_path`.
+    """
+    if not os.path.isfile(cache_path):
+        return None
+
+    try:
+        with np.load(cache_path, allow_pickle = False) as cached:
+            colnames = [str(name) for name in cached["_colnames"]]
+            spec_table = Table([cached[name] for name in colnames], names = colnames)
+            if "_comments" in cached.files:
+                spec_table.meta["comments"] = [str(line) for line in cached["_comments"]]
+    except Exception as e:
+        warnings.warn("couldn't read " + cache_path + ": " + str(e))
+        return None
+
+    if verbose: print("Reading " + cache_path)
+    return spec_table
+
+
+def write_spectrum_cache(cache_path, spec_table, verbose = False):
+    """
+    Writes the columns (and any comments) of `spec_table` to `cache_path` as an
+    uncompressed .npz. The file is written under a temporary name and moved
+    into place, so a half-written copy is never read. Failing to write only
+    warns - the cache is an optimisation.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    """
+    cache_dir = os.path.dirname(cache_path)
+    tmp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+
+    arrays = {name: np.asarray(spec_table[name]) for name in spec_table.colnames}
+    arrays["_colnames"] = np.array(spec_table.colnames)
+    if "comments" in spec_table.meta:
+        arrays["_comments"] = np.array(spec_table.meta["comments"], dtype = str)
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, cache_path)
+        if verbose: print("Writing " + cache_path)
+    except (IOError, OSError) as e:
+        warnings.warn("couldn't write " + cache_path + ": " + str(e))
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+    pass
+
+
+def calc_overlap_matrix(spectrum_limits, filter_edges):
+    """
+    Which filters lie within which spectra, for many of both at once. A filter
+    is within a spectrum if both of its edges are inside the spectrum's
+    wavelength range (as in functions.filter_within_spec).
+
+    Parameters
+    ----------
+    spectrum_limits : (n_spectra, 2) array of [min, max] wavelengths.
+
+    filter_edges : (n_filters, 2) array of [lower, upper] edges.
+
+    Returns
+    -------
+    (n_spectra, n_filters) boolean array, True where the filter is within
+    the spectrum.
+    """
+    spectrum_limits = asarray(spectrum_limits, dtype = float).reshape(-1, 2)
+    filter_edges = asarray(filter_edges, dtype = float).reshape(-1, 2)
+
+    return logical_and(filter_edges[:, 0] > spectrum_limits[:, 0][:, newaxis],
+                       filter_edges[:, 1] < spectrum_limits[:, 1][:, newaxis])
+
+
+def group_by_grid(wavelengths):
+    """
+    Groups spectra by wavelength grid, so that those sharing one can be
+    worked on as a stack. Grids are told apart by an md5 of their bytes.
+
+    Parameters
+    ----------
+    wavelengths : list of arrays (or Quantities) of wavelengths, one per
+        spectrum.
+
+    Returns
+    -------
+    list of (grid, indices) pairs in the order the grids first turn up -
+    grid as a contiguous float64 array, and indices the positions in
+    `wavelengths` of the spectra on it.
+    """
+    grids = OrderedDict()
+    for i, wavelength in enumerate(wavelengths):
+        wavelength = np.ascontiguousarray(getattr(wavelength, "value", wavelength), dtype = np.float64)
+        key = (wavelength.shape, hashlib.md5(wavelength.tobytes()).hexdigest())
+        if key not in grids:
+            grids[key] = (wavelength, [])
+        grids[key][1].append(i)
+
+    return list(grids.values())
+
+
+def _basic_simpson_weights(x, start, weights):
+    """
+    Adds the weights of Simpson's rule over pairs of intervals from x[start]
+    to the end of x (which must span an even number of intervals) to `weights`,
+    with the same zero-width guards as scipy's _basic_simpson.
+    """
+    h = np.diff(x)
+    h0 = h[start:len(h) - 1:2]
+    h1 = h[start + 1::2]
+    hsum = h0 + h1
+    hprod = h0 * h1
+
+    h0divh1 = np.true_divide(h0, h1, out = np.zeros_like(h0), where = h1 != 0)
+    h1divh0 = np.true_divide(1.0, h0divh1, out = np.zeros_like(h0divh1), where = h0divh1 != 0)
+    hsumdivhprod = np.true_divide(hsum, hprod, out = np.zeros_like(hsum), where = hprod != 0)
+
+    i = np.arange(start, start + 2 * len(h0), 2)
+    weights[i] += hsum / 6.0 * (2.0 - h1divh0)
+    weights[i + 1] += hsum / 6.0 * hsum * hsumdivhprod
+    weights[i + 2] += hsum / 6.0 * (2.0 - h0divh1)
+    return weights
+
+
+def _calc_simpson_weights(x, even = "simpson"):
+    """
+    Simpson's rule weights for x, handling an even number of points (odd
+    number of intervals) either as scipy >= 1.11 does ("simpson", Cartwright's
+    correction for the last interval) or as older versions do ("avg").
+    """
+    N = len(x)
+    weights = np.zeros(N)
+
+    if N < 3:
+        if N == 2:
+            weights += 0.5 * (x[1] - x[0])
+        return weights
+
+    if N % 2:
+        return _basic_simpson_weights(x, 0, weights)
+
+    if even == "simpson":
+        _basic_simpson_weights(x[:-1], 0, weights[:-1])
+
+        h0 = x[-2] - x[-3]
+        h1 = x[-1] - x[-2]
+        weights[-1] += (2 * h1 ** 2 + 3 * h0 * h1) / (6 * (h1 + h0)) if h1 + h0 != 0 else 0.
+        weights[-2] += (h1 ** 2 + 3.0 * h0 * h1) / (6 * h0) if h0 != 0 else 0.
+        weights[-3] -= h1 ** 3 / (6 * h0 * (h0 + h1)) if h0 * (h0 + h1) != 0 else 0.
+    else:
+        ## average of Simpson on the first N-1 + trapezium on the last, and vice versa
+        first = _basic_simpson_weights(x[:-1], 0, np.zeros(N - 1))
+        last = _basic_simpson_weights(x[1:], 0, np.zeros(N - 1))
+        weights[:-1] += 0.5 * first
+        weights[1:] += 0.5 * last
+        weights[-2:] += 0.25 * (x[-1] - x[-2])
+        weights[:2] += 0.25 * (x[1] - x[0])
+
+    return weights
+
+
+_scipy_simps_even = []
+
+
+def _get_scipy_simps_even():
+    """
+    Which way the installed scipy's simps handles an even number of points,
+    worked out (once) by comparing against it.
+    """
+    if not _scipy_simps_even:
+        from scipy.integrate import simps
+
+        x = np.array([0., 1., 2.5, 3., 5.])
+        y = np.array([1., -2., 3., 0.5, 2.])
+        for even in ["simpson", "avg"]:
+            if np.isclose(np.dot(_calc_simpson_weights(x, even), y), simps(y, x), rtol = 1e-12, atol = 0.):
+                break
+        _scipy_simps_even.append(even)
+
+    return _scipy_simps_even[0]
+
+
+def calc_quadrature_weights(x, method = "simpson"):
+    """
+    Weights w such that np.dot(w, y) is the integral of y over x - for
+    method = "simpson" the same as scipy.integrate.simps(y, x) (for
+    however the installed scipy handles an even number of points), for
+    method = "trapz" the same as numpy.trapz(y, x). Works for uneven grids.
+
+    If the Simpson weights aren't finite, the trapezium ones are returned
+    instead (see Issue #26 on GitHub).
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    weights : array, the same length as x.
+    """
+    x = np.asarray(getattr(x, "value", x), dtype = float)
+
+    if method == "trapz":
+        weights = np.zeros(len(x))
+        if len(x) > 1:
+            h = np.diff(x)
+            weights[:-1] += 0.5 * h
+            weights[1:] += 0.5 * h
+        return weights
+
+    elif method == "simpson":
+        weights = _calc_simpson_weights(x, even = _get_scipy_simps_even())
+
+        if not np.all(np.isfinite(weights)): ## See Issue #26 on GitHub
+            weights = calc_quadrature_weights(x, method = "trapz")
+
+        return weights
+
+    else:
+        raise errors.CustomValueError("method must be 'simpson' or 'trapz', not " + str(method))
+
+
+def calc_linear_product_weights(wavelength, filter_wavelength, filter_throughput):
+    """
+    Quadrature weights for the exact integral of a piecewise-linear spectrum
+    on `wavelength` times a piecewise-linear filter on `filter_wavelength`
+    (zero outside it), over the range of `wavelength`.
+
+    Both functions are linear between the merged set of knots, so the product
+    is quadratic there and each interval integrates exactly as
+    h/6 * (f_a*(2*T_a + T_b) + f_b*(T_a + 2*T_b)). The f at the merged knots
+    are themselves linear in the spectrum's fluxes, so the whole integral is
+    np.dot(weights, flux), and np.sum(weights) is the area of the filter.
+
+    Parameters
+    ----------
+    wavelength : increasing wavelengths of the spectrum.
+
+    filter_wavelength, filter_throughput : the filter response.
+
+    Returns
+    -------
+    weights : array, the same length as wavelength.
+    """
+    wavelength = np.asarray(wavelength, dtype = float)
+    filter_wavelength = np.asarray(filter_wavelength, dtype = float)
+    filter_throughput = np.asarray(filter_throughput, dtype = float)
+
+    order = np.argsort(filter_wavelength, kind = "mergesort")
+    filter_wavelength = filter_wavelength[order]
+    filter_throughput = filter_throughput[order]
+
+    weights = np.zeros(len(wavelength))
+    if len(wavelength) < 2:
+        return weights
+
+    knots = np.union1d(wavelength, filter_wavelength[logical_and(filter_wavelength > wavelength[0],
+                                                                 filter_wavelength < wavelength[-1])])
+    a = knots[:-1]
+    b = knots[1:]
+    h = b - a
+
+    ## the filter is zero outside its own range - every interval is either all in or all out
+    within = logical_and(a >= filter_wavelength[0], b <= filter_wavelength[-1])
+    T_a = np.interp(a, filter_wavelength, filter_throughput) * within
+    T_b = np.interp(b, filter_wavelength, filter_throughput) * within
+
+    c_a = h * (2. * T_a + T_b) / 6.
+    c_b = h * (T_a + 2. * T_b) / 6.
+
+    ## spread each end of each interval over the two spectrum points either side
+    i = np.clip(np.searchsorted(wavelength, a, side = "right") - 1, 0, len(wavelength) - 2)
+    step = wavelength[i + 1] - wavelength[i]
+    step[step == 0.] = 1.
+    t_a = (a - wavelength[i]) / step
+    t_b = (b - wavelength[i]) / step
+
+    weights += np.bincount(i, c_a * (1. - t_a) + c_b * (1. - t_b), minlength = len(wavelength))
+    weights += np.bincount(i + 1, c_a * t_a + c_b * t_b, minlength = len(wavelength))
+
+    return weights
+
+
+def calc_bin_edges(wavelength):
+    """
+    Edges of the bins centred on `wavelength` - halfway between neighbouring
+    points, with the end bins as wide as their neighbour's half-gap either
+    side.
+
+    Parameters
+    ----------
+    wavelength : increasing wavelengths, at least two.
+
+    Returns
+    -------
+    edges : array, one longer than wavelength.
+    """
+    wavelength = np.asarray(wavelength, dtype = float)
+
+    edges = np.empty(len(wavelength) + 1)
+    edges[1:-1] = 0.5 * (wavelength[1:] + wavelength[:-1])
+    edges[0] = wavelength[0] - 0.5 * (wavelength[1] - wavelength[0])
+    edges[-1] = wavelength[-1] + 0.5 * (wavelength[-1] - wavelength[-2])
+
+    return edges
+
+
+def rebin_flux(wavelength, flux, new_wavelength):
+    """
+    Flux conserving rebinning of one or many spectra sharing the grid
+    `wavelength` onto `new_wavelength`. Each flux is taken as constant across
+    its bin (see calc_bin_edges), and each new bin gets the integral of that
+    over it divided by its width - the whole old bins it covers summed with
+    np.add.reduceat, plus the parts of the old bins at either end - so the
+    total flux over any whole number of new bins is kept. All of the spectra
+    are done at once.
+
+    Non-finite fluxes are left out, and new bins that overlap them or run off
+    the end of `wavelength` are NaN.
+
+    Parameters
+    ----------
+    wavelength : increasing wavelengths of the spectra.
+
+    flux : array of fluxes on wavelength, or a 2D (n_spectra, n_wavelength)
+        stack of them.
+
+    new_wavelength : increasing wavelengths to rebin onto.
+
+    Returns
+    -------
+    new_flux : the rebinned flux, 1D or 2D like flux.
+
+    covered : boolean array the shape of new_flux, True where new_flux is
+        fully within the finite part of the spectrum.
+    """
+    wavelength = np.asarray(getattr(wavelength, "value", wavelength), dtype = float)
+    new_wavelength = np.asarray(getattr(new_wavelength, "value", new_wavelength), dtype = float)
+    flux = np.asarray(getattr(flux, "value", flux), dtype = float)
+    single = flux.ndim == 1
+    flux = np.atleast_2d(flux)
+
+    edges = calc_bin_edges(wavelength)
+    new_edges = calc_bin_edges(new_wavelength)
+    n = len(wavelength)
+
+    good = np.isfinite(flux)
+    ## flux in each old bin, padded with an empty bin so reduceat can run to the end
+    binned = np.zeros((flux.shape[0], n + 1))
+    binned[:, :n] = np.where(good, flux, 0.) * np.diff(edges)
+
+    ## the old bin each new edge falls in, and how far across it
+    i = np.clip(np.searchsorted(edges, new_edges, side = "right") - 1, 0, n - 1)
+    t = np.clip((new_edges - edges[i]) / (edges[i + 1] - edges[i]), 0., 1.)
+    first, last = i[:-1], i[1:]
+
+    ## whole old bins between the first and last, from reduceat over
+    ## [first + 1, last) - empty ranges come back as binned[first + 1], so zero them
+    whole = np.add.reduceat(binned, np.column_stack((first + 1, np.maximum(last, first + 1))).ravel(),
+                            axis = 1)[:, ::2]
+    whole[:, last <= first + 1] = 0.
+
+    integral = np.where(last == first,
+                        binned[:, first] * (t[1:] - t[:-1]),
+                        binned[:, first] * (1. - t[:-1]) + whole + binned[:, last] * t[1:])
+    new_flux = integral / np.diff(new_edges)
+
+    ## count the bad old bins each new bin touches
+    cumulative_bad = np.zeros((flux.shape[0], n + 1), dtype = int)
+    np.cumsum(~good, axis = 1, out = cumulative_bad[:, 1:])
+    last_touched = np.clip(np.searchsorted(edges, new_edges[1:], side = "left") - 1, 0, n - 1)
+    within = logical_and(new_edges[:-1] >= edges[0], new_edges[1:] <= edges[-1])
+    covered = logical_and(within, cumulative_bad[:, last_touched + 1] - cumulative_bad[:, first] == 0)
+    new_flux[~covered] = np.nan
+
+    if single:
+        return new_flux[0], covered[0]
+    return new_flux, covered
+
+
 def weighted_mean(values, sigma, weights=False, correct=False):
     """
     from sullivanweighted_mean.pro
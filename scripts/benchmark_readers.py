@@ -0,0 +1,59 @@
+"""
+Times the fixed layout reader (utils.read_columns_table) against astropy's
+guessing ascii reader on the spectra, photometry, lists and filters in the
+data directory, and checks that they read the same thing.
+"""
+import glob
+import os
+import time
+
+import numpy as np
+from astropy.table import Table
+
+import pycoco as pcc
+
+
+def time_reader(reader, paths, names):
+    start = time.time()
+    tables = [reader(path, names) for path in paths]
+    return time.time() - start, tables
+
+
+def guessing_reader(path, names):
+    try:
+        return Table.read(path, format="ascii", names=names) if names else Table.read(path, format="ascii")
+    except Exception:
+        ## spectra with an error column
+        return Table.read(path, format="ascii", names=names + ("flux_err",))
+
+
+def fast_reader(path, names):
+    if names and pcc.utils.sniff_columns(path)[0] == len(names) + 1:
+        names = names + ("flux_err",)
+    return pcc.utils.read_columns_table(path, names=names)
+
+
+data_dir = pcc.defaults._default_data_dir_path
+
+file_sets = [("spectra", glob.glob(os.path.join(data_dir, "spec/*/*.txt")), ("wavelength", "flux")),
+             ("photometry", glob.glob(os.path.join(data_dir, "lc/*.dat")), ("MJD", "flux", "flux_err", "filter")),
+             ("lists", glob.glob(os.path.join(pcc.defaults._default_list_dir_path, "*.list")),
+              ("spec_path", "snname", "mjd_obs", "z")),
+             ("filters", [path for path in glob.glob(os.path.join(data_dir, "filters/*.dat"))
+                          if os.path.basename(path) not in ("list.txt", pcc.utils._zeropoint_table_filename)],
+              ("wavelength", "throughput"))]
+
+if __name__ == "__main__":
+    print("{:>12} {:>6} {:>12} {:>12} {:>8} {:>6}".format("", "files", "guessing/s", "fixed/s", "speedup", "same"))
+
+    for name, paths, names in file_sets:
+        paths = sorted(paths)
+
+        t_guess, guessed = time_reader(guessing_reader, paths, names)
+        t_fast, fast = time_reader(fast_reader, paths, names)
+
+        same = all(a.colnames == b.colnames and all(np.array_equal(a[c], b[c]) for c in a.colnames)
+                   for a, b in zip(guessed, fast))
+
+        print("{:>12} {:>6} {:>12.3f} {:>12.3f} {:>8.1f} {:>6}".format(name, len(paths), t_guess, t_fast,
+                                                                      t_guess / t_fast, str(same)))